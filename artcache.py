@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+
+"""
+Beatbox 1.0
+
+Copyright (C) 2013 Luke Hansford - l.s.hansford@gmail.com
+
+DESCRIPTION
+
+This module contains the cache of album cover thumbnails. Covers are shown
+at a couple of small sizes, so rather than finding and decoding the full
+size cover every time a song is loaded or added to the playlist, each cover
+is scaled once to each size and kept in memory and on disk.
+
+Thumbnails are stored by the hash of the cover they were made from, so songs
+sharing a cover share its thumbnails. Which cover a song has is remembered
+by the song's fingerprint (its path, modification time, and size, and the
+modification time of its folder, which changes when a cover.jpg is added),
+so an unchanged song's cover isn't looked for again.
+
+The playlist shows covers through an IconRegistry, which keeps one icon for
+each cover hash, and the default cover, shared by every item showing it.
+
+LICENSE
+
+I, Luke Hansford, Hereby grant the rights to distribute, modify, and edit the
+source to Beatbox 1.0, on the condition that this agreement, and my ownership
+of the code contained herewithin be maintained.
+
+Furthurmore, I grant the right to use excerpts from the source to Beatbox 1.0
+without express permission, with exclusion of commercial application.
+"""
+
+#Standard libraries
+import collections
+import cPickle
+import hashlib
+import os
+import os.path
+import sys
+import threading
+import time
+
+#3rd party libraries
+from PySide import QtCore, QtGui
+
+#Beatbox libraries
+import metadata
+
+
+THUMBNAIL_DIRECTORY = 'data/thumbnails'
+INDEX_NAME = 'index.cpk' # The file in the directory songs' covers are kept in
+PLAYLIST_ICON_SIZE = 60 # Pixels
+PLAYER_COVER_SIZE = 100
+THUMBNAIL_SIZES = (PLAYLIST_ICON_SIZE, PLAYER_COVER_SIZE) # Made when ingesting
+THUMBNAIL_FORMAT = 'PNG' # Lossless, so covers aren't compressed twice
+THUMBNAIL_EXTENSION = '.png'
+MEMORY_CACHE_BYTES = 8 * 1024 * 1024 # Bytes of thumbnails kept in memory
+DISK_CACHE_BYTES = 256 * 1024 * 1024 # Bytes of thumbnails kept on disk
+INDEX_SIZE = 100000 # Songs whose cover hash is remembered, at least
+ICON_REGISTRY_SIZE = 5000 # Covers whose shared playlist icon is kept
+BENCHMARK_ITEMS = 20000 # Playlist items built by the icon benchmark
+BENCHMARK_ALBUM_SIZE = 15 # Items sharing each cover in the benchmark
+
+def scale_image(image_bytes, size):
+	""" Scales an image to fit a square of the given size, keeping its aspect
+	ratio, and returns it encoded in THUMBNAIL_FORMAT, or None if it can't be
+	decoded. QImage is used so this can be called from any thread.
+
+	scale_image(str, int) -> str
+	"""
+	image = decode_image(image_bytes, size)
+	if image is None:
+		return None
+	return encode_image(image)
+
+def decode_image(image_bytes, size):
+	""" Decodes an image scaled to fit a square of the given size, keeping its
+	aspect ratio, or returns None if it can't be decoded. Formats that can be
+	scaled as they're decoded, like JPEG, are scaled by the reader, so the
+	full size image is never held. QImage is used so this can be called from
+	any thread, and the result handed to the GUI thread ready to paint.
+
+	decode_image(str, int) -> QImage
+	"""
+	data = QtCore.QByteArray(image_bytes)
+	buffer = QtCore.QBuffer(data)
+	buffer.open(QtCore.QIODevice.ReadOnly)
+	reader = QtGui.QImageReader(buffer)
+	scaled_size = reader.size()
+	if scaled_size.isValid() and \
+		reader.supportsOption(QtGui.QImageIOHandler.ScaledSize):
+		scaled_size.scale(size, size, QtCore.Qt.KeepAspectRatio)
+		reader.setScaledSize(scaled_size)
+	image = reader.read()
+	buffer.close()
+	if image.isNull():
+		return None
+	if max(image.width(), image.height()) != size:
+		image = image.scaled(size, size, QtCore.Qt.KeepAspectRatio,
+			QtCore.Qt.SmoothTransformation)
+	return image
+
+def encode_image(image):
+	""" Returns the given image encoded in THUMBNAIL_FORMAT.
+
+	encode_image(QImage) -> str
+	"""
+	data = QtCore.QByteArray()
+	buffer = QtCore.QBuffer(data)
+	buffer.open(QtCore.QIODevice.WriteOnly)
+	image.save(buffer, THUMBNAIL_FORMAT)
+	buffer.close()
+	return data.data()
+
+class ArtCache(object):
+	""" A cache of album cover thumbnails, bounded in memory and on disk.
+	The least recently used thumbnails are dropped first from each. Counts
+	of hits in each tier, and of misses, are kept in stats. The cache can be
+	used from any thread.
+	"""
+
+	def __init__(self, directory=THUMBNAIL_DIRECTORY,
+		memory_bytes=MEMORY_CACHE_BYTES, disk_bytes=DISK_CACHE_BYTES):
+		self.directory = directory
+		self.memory_bytes = memory_bytes
+		self.disk_bytes = disk_bytes
+		self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0,
+			'index_hits': 0}
+		self._memory = collections.OrderedDict() # name: thumbnail
+		self._memory_total = 0
+		self._disk = None # name: bytes, least recently used first
+		self._disk_total = 0
+		self._index = None # song fingerprint: cover hash or None
+		self.index_size = INDEX_SIZE
+		self._lock = threading.RLock()
+
+	def get_thumbnail(self, file_path, size):
+		""" Returns the album cover of the given song scaled to fit a square
+		of the given size, or None if it doesn't have one.
+
+		ArtCache.get_thumbnail(str, int) -> str
+		"""
+		return self.get_cover(file_path, size)[1]
+
+	def get_cover(self, file_path, size):
+		""" Returns the hash of the album cover of the given song, and the
+		cover scaled to fit a square of the given size, or (None, None) if it
+		doesn't have one. Songs with the same hash share a cover.
+
+		ArtCache.get_cover(str, int) -> (str, str)
+		"""
+		try:
+			fingerprint = self.get_fingerprint(file_path)
+		except OSError:
+			return None, None
+		with self._lock:
+			index = self.load_index()
+			if fingerprint in index:
+				cover_hash = index.pop(fingerprint)
+				index[fingerprint] = cover_hash
+				self.stats['index_hits'] += 1
+				if cover_hash is None:
+					return None, None
+				thumbnail = self.load_thumbnail(thumbnail_name(cover_hash,
+					size))
+				if thumbnail is not None:
+					return cover_hash, thumbnail
+			self.stats['misses'] += 1
+		## Missing, so the cover is found and scaled outside the lock
+		cover = metadata.Metadata().get_album_cover(file_path)
+		cover_hash = hashlib.sha1(cover).hexdigest() if cover else None
+		thumbnail = scale_image(cover, size) if cover else None
+		with self._lock:
+			if thumbnail is None:
+				cover_hash = None
+			self.remember(fingerprint, cover_hash)
+			if thumbnail is not None:
+				self.store_thumbnail(thumbnail_name(cover_hash, size),
+					thumbnail)
+		return cover_hash, thumbnail
+
+	def add_cover(self, file_path, cover_hash, cover=None):
+		""" Remembers that the given song has the cover with the given hash,
+		or no cover if it's None, so it's never opened again for its cover
+		until it changes. Called as songs are read into the library. If the
+		cover's bytes are given, its thumbnails at each of THUMBNAIL_SIZES
+		that aren't on disk already are made, decoding it only once.
+
+		ArtCache.add_cover(str, str, str) -> None
+		"""
+		fingerprint = self.get_fingerprint(file_path)
+		thumbnails = {}
+		sizes = []
+		if cover:
+			sizes = [size for size in THUMBNAIL_SIZES if not os.path.exists(
+				os.path.join(self.directory, thumbnail_name(cover_hash, size)))]
+		if sizes:
+			image = decode_image(cover, max(sizes))
+			if image is None:
+				cover_hash = None
+			else:
+				for size in sizes:
+					if size != max(sizes):
+						thumbnails[thumbnail_name(cover_hash, size)] = \
+							encode_image(image.scaled(size, size,
+							QtCore.Qt.KeepAspectRatio,
+							QtCore.Qt.SmoothTransformation))
+					else:
+						thumbnails[thumbnail_name(cover_hash, size)] = \
+							encode_image(image)
+		with self._lock:
+			self.remember(fingerprint, cover_hash)
+			for name, thumbnail in thumbnails.iteritems():
+				self.store_thumbnail(name, thumbnail)
+
+	def set_index_size(self, size):
+		""" Makes sure the cover hashes of at least the given number of songs
+		are remembered, so a whole library can be.
+
+		ArtCache.set_index_size(int) -> None
+		"""
+		with self._lock:
+			self.index_size = max(self.index_size, size)
+
+	def get_fingerprint(self, file_path):
+		""" Returns the fingerprint the given song's cover is remembered by:
+		its path, modification time, and size, and the modification time of
+		its folder.
+
+		ArtCache.get_fingerprint(str) -> tuple
+		"""
+		stat = os.stat(file_path)
+		folder_mtime = os.stat(os.path.dirname(file_path) or '.').st_mtime
+		return (file_path, stat.st_mtime, stat.st_size, folder_mtime)
+
+	def remember(self, fingerprint, cover_hash):
+		""" Remembers the hash of the cover of the song with the given
+		fingerprint, forgetting the least recently used songs past its size.
+		Called with the lock held.
+
+		ArtCache.remember(tuple, str) -> None
+		"""
+		index = self.load_index()
+		index.pop(fingerprint, None)
+		index[fingerprint] = cover_hash
+		while len(index) > self.index_size:
+			index.popitem(last=False)
+
+	def load_thumbnail(self, name):
+		""" Returns the thumbnail with the given name from memory, or from
+		disk, or None if it isn't cached. Called with the lock held.
+
+		ArtCache.load_thumbnail(str) -> str
+		"""
+		thumbnail = self._memory.pop(name, None)
+		if thumbnail is not None:
+			self._memory[name] = thumbnail
+			self.stats['memory_hits'] += 1
+			return thumbnail
+		disk = self.load_disk()
+		if name not in disk:
+			return None
+		path = os.path.join(self.directory, name)
+		try:
+			with open(path, 'rb') as thumbnail_file:
+				thumbnail = thumbnail_file.read()
+			os.utime(path, None) # Keeps the order of use for the next run
+		except (IOError, OSError):
+			self._disk_total -= disk.pop(name)
+			return None
+		disk[name] = disk.pop(name)
+		self.stats['disk_hits'] += 1
+		self.add_to_memory(name, thumbnail)
+		return thumbnail
+
+	def store_thumbnail(self, name, thumbnail):
+		""" Adds a thumbnail to the memory and disk caches. Called with the
+		lock held.
+
+		ArtCache.store_thumbnail(str, str) -> None
+		"""
+		self.add_to_memory(name, thumbnail)
+		disk = self.load_disk()
+		try:
+			temp_name = os.path.join(self.directory, name + '.tmp')
+			with open(temp_name, 'wb') as thumbnail_file:
+				thumbnail_file.write(thumbnail)
+			os.rename(temp_name, os.path.join(self.directory, name))
+		except (IOError, OSError):
+			return None # Still kept in memory
+		self._disk_total -= disk.pop(name, 0)
+		disk[name] = len(thumbnail)
+		self._disk_total += len(thumbnail)
+		while self._disk_total > self.disk_bytes and len(disk) > 1:
+			old_name, old_size = disk.popitem(last=False)
+			self._disk_total -= old_size
+			try:
+				os.remove(os.path.join(self.directory, old_name))
+			except OSError:
+				pass
+
+	def add_to_memory(self, name, thumbnail):
+		""" Adds a thumbnail to the memory cache, dropping the least recently
+		used to keep it within its bytes. Called with the lock held.
+
+		ArtCache.add_to_memory(str, str) -> None
+		"""
+		self._memory_total -= len(self._memory.pop(name, ''))
+		self._memory[name] = thumbnail
+		self._memory_total += len(thumbnail)
+		while self._memory_total > self.memory_bytes and len(self._memory) > 1:
+			self._memory_total -= len(self._memory.popitem(last=False)[1])
+
+	def load_disk(self):
+		""" Returns the thumbnails kept on disk and their sizes, least
+		recently used first, listing the directory the first time it's needed.
+		Called with the lock held.
+
+		ArtCache.load_disk() -> OrderedDict
+		"""
+		if self._disk is None:
+			self._disk = collections.OrderedDict()
+			if not os.path.isdir(self.directory):
+				os.makedirs(self.directory)
+			thumbnails = []
+			for name in os.listdir(self.directory):
+				if name.endswith(THUMBNAIL_EXTENSION):
+					stat = os.stat(os.path.join(self.directory, name))
+					thumbnails.append((stat.st_mtime, name, stat.st_size))
+			for mtime, name, size in sorted(thumbnails):
+				self._disk[name] = size
+				self._disk_total += size
+		return self._disk
+
+	def load_index(self):
+		""" Returns the cover hash of each song fingerprint, reading it from
+		the directory the first time it's needed. Called with the lock held.
+
+		ArtCache.load_index() -> OrderedDict
+		"""
+		if self._index is None:
+			self._index = collections.OrderedDict()
+			try:
+				with open(os.path.join(self.directory, INDEX_NAME),
+					'rb') as index_file:
+					self._index.update(cPickle.load(index_file))
+			except (IOError, EOFError, cPickle.UnpicklingError):
+				pass
+			self.index_size = max(self.index_size, len(self._index))
+		return self._index
+
+	def save(self):
+		""" Writes the cover hash of each song to the directory, so they're
+		remembered in the next run. The thumbnails themselves are written as
+		they're made.
+
+		ArtCache.save() -> None
+		"""
+		with self._lock:
+			if self._index is None:
+				return None
+			if not os.path.isdir(self.directory):
+				os.makedirs(self.directory)
+			index_name = os.path.join(self.directory, INDEX_NAME)
+			with open(index_name + '.tmp', 'wb') as index_file:
+				cPickle.dump(self._index.items(), index_file,
+					cPickle.HIGHEST_PROTOCOL)
+			os.rename(index_name + '.tmp', index_name)
+
+class IconRegistry(object):
+	""" The icons album covers are shown with in the playlist, so every item
+	with the same cover shares one icon rather than decoding its own. Icons of
+	the least recently used covers past ICON_REGISTRY_SIZE are forgotten,
+	though items showing them keep them. QPixmaps can only be made in the GUI
+	thread, so icons are only got there, and the default cover isn't loaded
+	until it's first needed. Other threads may check which covers are
+	registered, to skip decoding them.
+	"""
+
+	def __init__(self, default_cover, size=ICON_REGISTRY_SIZE):
+		self.default_cover = default_cover
+		self.size = size
+		self._icons = collections.OrderedDict() # cover hash: QIcon
+		self._default_icon = None
+		self._default_pixmaps = {} # size: QPixmap
+
+	def get_icon(self, cover_hash, image=None):
+		""" Returns the icon of the cover with the given hash, made from the
+		given image, already decoded at its size by decode_image, if the cover
+		hasn't been registered, or None if it hasn't and there's no image.
+
+		IconRegistry.get_icon(str, QImage) -> QIcon
+		"""
+		icon = self._icons.pop(cover_hash, None)
+		if icon is None:
+			if image is None:
+				return None
+			icon = QtGui.QIcon(QtGui.QPixmap.fromImage(image))
+		self._icons[cover_hash] = icon
+		while len(self._icons) > self.size:
+			self._icons.popitem(last=False)
+		return icon
+
+	def has_icon(self, cover_hash):
+		""" Returns whether the cover with the given hash has an icon. The
+		icon may be forgotten before it's got, so get_icon can still return
+		None afterwards.
+
+		IconRegistry.has_icon(str) -> bool
+		"""
+		return cover_hash in self._icons
+
+	def get_default_icon(self):
+		""" Returns the icon of the default cover.
+
+		IconRegistry.get_default_icon() -> QIcon
+		"""
+		if self._default_icon is None:
+			self._default_icon = QtGui.QIcon(self.get_default_pixmap())
+		return self._default_icon
+
+	def get_default_pixmap(self, size=None):
+		""" Returns the default cover, scaled to fit a square of the given
+		size if one is given.
+
+		IconRegistry.get_default_pixmap(int) -> QPixmap
+		"""
+		if size not in self._default_pixmaps:
+			pixel_map = QtGui.QPixmap(self.default_cover)
+			if size is not None:
+				pixel_map = pixel_map.scaled(size, size,
+					QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+			self._default_pixmaps[size] = pixel_map
+		return self._default_pixmaps[size]
+
+def thumbnail_name(cover_hash, size):
+	""" Returns the name a cover's thumbnail of the given size is kept under.
+
+	thumbnail_name(str, int) -> str
+	"""
+	return '%s_%d%s' % (cover_hash, size, THUMBNAIL_EXTENSION)
+
+def benchmark_icons(default_cover, count=BENCHMARK_ITEMS,
+	album_size=BENCHMARK_ALBUM_SIZE):
+	""" Compares building count playlist items, in albums of album_size
+	sharing a cover, with each item decoding its own icons and with the icons
+	shared by an IconRegistry from covers decoded by decode_image, as the
+	cover thread does. Prints the time taken in the GUI thread, and the
+	number of distinct icons the items hold along with the bytes of their
+	decoded pixmaps. A QApplication must exist.
+
+	benchmark_icons(str, int, int) -> None
+	"""
+	thumbnails = []
+	for i in range(count / album_size + 1):
+		image = QtGui.QImage(PLAYLIST_ICON_SIZE, PLAYLIST_ICON_SIZE,
+			QtGui.QImage.Format_RGB32)
+		image.fill(i)
+		thumbnail = encode_image(image)
+		thumbnails.append((hashlib.sha1(thumbnail).hexdigest(), thumbnail,
+			decode_image(thumbnail, PLAYLIST_ICON_SIZE)))
+	for name in ('separate', 'shared'):
+		registry = IconRegistry(default_cover)
+		start = time.time()
+		items = []
+		for i in range(count):
+			item = QtGui.QStandardItem()
+			cover_hash, thumbnail, image = thumbnails[i / album_size]
+			if name == 'separate':
+				item.setIcon(QtGui.QPixmap(default_cover))
+				pixel_map = QtGui.QPixmap()
+				pixel_map.loadFromData(thumbnail)
+				item.setIcon(pixel_map)
+			else:
+				item.setIcon(registry.get_default_icon())
+				item.setIcon(registry.get_icon(cover_hash, image))
+			items.append(item)
+		elapsed = time.time() - start
+		icons = len(set([item.icon().cacheKey() for item in items]))
+		print '%s: %d items in %.2fs, %d icons, %.1f MiB of pixmaps' % (name,
+			count, elapsed, icons, icons * PLAYLIST_ICON_SIZE ** 2 * 4 /
+			(1024.0 * 1024))
+
+## The cache every album cover shown in Beatbox is read through
+ART_CACHE = ArtCache()
+
+
+if __name__ == "__main__":
+	## artcache.py [default cover] benchmarks the playlist's album icons
+	app = QtGui.QApplication(sys.argv)
+	benchmark_icons(sys.argv[1] if len(sys.argv) > 1 else 'images/cover.png')
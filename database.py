@@ -0,0 +1,276 @@
+# -◊- coding: utf-8 -◊-
+
+"""
+Beatbox 1.0
+
+Copyright (C) 2013 Luke Hansford - l.s.hansford@gmail.com
+
+DESCRIPTION
+
+This module contains all functions for managing connections to Beatbox's
+SQLite databases.
+
+LICENSE
+
+I, Luke Hansford, Hereby grant the rights to distribute, modify, and edit the
+source to Beatbox 1.0, on the condition that this agreement, and my ownership
+of the code contained herewithin be maintained.
+
+Furthurmore, I grant the right to use excerpts from the source to Beatbox 1.0
+without express permission, with exclusion of commercial application.
+"""
+
+#Standard libraries
+import Queue
+import sqlite3
+import threading
+
+
+STATEMENT_CACHE_SIZE = 200 # Prepared statements kept per connection
+MMAP_SIZE = 256 * 1024 * 1024 # Bytes of the database file to memory map
+CACHE_SIZE = -16000 # Page cache per connection, negative means KiB
+MAX_JOBS_PER_TRANSACTION = 1000 # Queued writes committed together
+FLUSH_CHECK_INTERVAL = 1.0 # Seconds between checks that the writer is alive
+
+class ConnectionManager(object):
+	""" Owns the long-lived connections to a database: one reader connection
+	per thread, and a single writer thread that makes every change to the
+	database. Each connection is set up with WAL journaling so readers don't
+	block the writer, and keeps a cache of prepared statements so repeated
+	queries aren't parsed again.
+	"""
+
+	def __init__(self, database_name):
+		self.database_name = database_name
+		self._local = threading.local()
+		self._writer = None
+		## Held to start, stop, or replace the writer and to migrate, never
+		## while the writer commits, so queueing a change never waits on one
+		self._writer_lock = threading.RLock()
+		self._connections = []
+		self._connections_lock = threading.Lock()
+
+	def connect(self, check_same_thread=True):
+		""" Opens a new connection to the database with Beatbox's settings.
+
+		ConnectionManager.connect(bool) -> Connection
+		"""
+		connection = sqlite3.connect(self.database_name,
+			cached_statements=STATEMENT_CACHE_SIZE,
+			check_same_thread=check_same_thread)
+		connection.execute('PRAGMA journal_mode=WAL')
+		connection.execute('PRAGMA synchronous=NORMAL')
+		connection.execute('PRAGMA mmap_size=%d' % MMAP_SIZE)
+		connection.execute('PRAGMA cache_size=%d' % CACHE_SIZE)
+		connection.execute('PRAGMA temp_store=MEMORY')
+		with self._connections_lock:
+			self._connections.append(connection)
+		return connection
+
+	def reader(self):
+		""" Returns the calling thread's reader connection, opening it if this
+		is the first time it's needed.
+
+		ConnectionManager.reader() -> Connection
+		"""
+		connection = getattr(self._local, 'connection', None)
+		if connection is None:
+			connection = self.connect()
+			self._local.connection = connection
+		return connection
+
+	def write(self, function, callback=None):
+		""" Queues a change to the database. The function is called on the
+		writer thread with the writer connection, and the callback, if given,
+		is called there with the function's result once it's committed.
+		Returns without waiting for the change to be made.
+
+		ConnectionManager.write(function, function) -> None
+		"""
+		writer = self._writer
+		if writer is None or not writer.is_alive():
+			writer = self.start_writer()
+		writer.jobs.put((function, callback))
+
+	def start_writer(self):
+		""" Starts the writer thread if it hasn't been started, or starts a new
+		one to carry on with the queued changes if it has died. Returns the
+		running writer.
+
+		ConnectionManager.start_writer() -> WriterThread
+		"""
+		with self._writer_lock:
+			if self._writer is None:
+				self._writer = WriterThread(self)
+				self._writer.start()
+			elif not self._writer.is_alive():
+				print "Database writer stopped unexpectedly, restarting it."
+				self._writer = WriterThread(self, self._writer.jobs)
+				self._writer.start()
+			return self._writer
+
+	def execute(self, query, parameters=(), callback=None):
+		""" Queues a query to be run on the writer thread.
+
+		ConnectionManager.execute(str, tuple, function) -> None
+		"""
+		self.write(lambda connection: connection.execute(query, parameters),
+			callback)
+
+	def executemany(self, query, rows, callback=None):
+		""" Queues a query to be run for each of the given rows on the writer
+		thread.
+
+		ConnectionManager.executemany(str, list(tuple), function) -> None
+		"""
+		self.write(lambda connection: connection.executemany(query, rows),
+			callback)
+
+	def flush(self):
+		""" Blocks until every change queued so far has been committed. If
+		the writer dies while this is waiting, a new one is started to finish
+		the queued changes.
+
+		ConnectionManager.flush() -> None
+		"""
+		if self._writer is not None:
+			done = threading.Event()
+			self.write(lambda connection: None, lambda result: done.set())
+			while not done.wait(FLUSH_CHECK_INTERVAL):
+				self.start_writer()
+
+	def migrate(self, migrations):
+		""" Brings the database schema up to date. migrations is a list of
+		functions that each take a connection and upgrade the schema by one
+		version, the first upgrading from version 0 (a new or unversioned
+		database) to version 1. The current version is kept in SQLite's
+		user_version, and each migration is run in its own transaction so a
+		failed upgrade leaves the database at the last good version.
+
+		ConnectionManager.migrate(list(function)) -> None
+		"""
+		with self._writer_lock:
+			connection = self.connect()
+			## Python's sqlite3 commits before DDL, so manage transactions here
+			connection.isolation_level = None
+			try:
+				version = connection.execute('PRAGMA user_version').fetchone()[0]
+				for number in range(version, len(migrations)):
+					connection.execute('BEGIN IMMEDIATE')
+					try:
+						migrations[number](connection)
+						connection.execute('PRAGMA user_version = %d' % \
+							(number + 1))
+					except:
+						connection.execute('ROLLBACK')
+						raise
+					connection.execute('COMMIT')
+			finally:
+				with self._connections_lock:
+					self._connections.remove(connection)
+				connection.close()
+
+	def close(self):
+		""" Commits the changes still queued, then closes all the connections
+		that have been opened.
+
+		ConnectionManager.close() -> None
+		"""
+		with self._writer_lock:
+			writer = None
+			if self._writer is not None:
+				writer = self.start_writer()
+				self._writer = None
+		## Joined without the lock so nothing waits on it while the queued
+		## changes are committed
+		if writer is not None:
+			writer.jobs.put(None)
+			writer.join()
+		with self._connections_lock:
+			for connection in self._connections:
+				try:
+					connection.close()
+				except sqlite3.ProgrammingError:
+					pass # Belongs to a thread that has finished
+			self._connections = []
+		self._local = threading.local()
+
+class WriterThread(threading.Thread):
+	""" The thread that makes every change to a database, so changes never
+	wait on each other or fail because the database is locked, and the GUI
+	never waits on a write. Queued changes are run in the order they were
+	queued, and whatever has built up while a transaction was being committed
+	goes into the next one. Each change is run in its own savepoint so one
+	failing doesn't undo the rest, and a change or callback that fails is
+	reported without stopping the thread. jobs is the queue of changes, so a
+	new writer can take over from one that has died.
+	"""
+
+	def __init__(self, connection_manager, jobs=None):
+		super(WriterThread, self).__init__()
+		self.daemon = True
+		self.connection_manager = connection_manager
+		self.jobs = jobs if jobs is not None else Queue.Queue()
+
+	def run(self):
+		""" Runs queued changes until None is queued.
+
+		WriterThread.run() -> None
+		"""
+		connection = self.connection_manager.connect(check_same_thread=False)
+		connection.isolation_level = None # Transactions are managed here
+		running = True
+		while running:
+			jobs = [self.jobs.get()]
+			while len(jobs) < MAX_JOBS_PER_TRANSACTION:
+				try:
+					jobs.append(self.jobs.get_nowait())
+				except Queue.Empty:
+					break
+			if None in jobs:
+				jobs = jobs[:jobs.index(None)]
+				running = False
+			if jobs:
+				try:
+					self.commit(connection, jobs)
+				except Exception as e:
+					print "Database transaction failed. " + \
+						type(e).__name__ + ': ' + unicode(e)
+
+	def commit(self, connection, jobs):
+		""" Runs the given changes in one transaction, then calls their
+		callbacks with their results. If the transaction can't be committed
+		it's rolled back and the error raised, and no callbacks are called.
+
+		WriterThread.commit(Connection, list(tuple)) -> None
+		"""
+		results = []
+		connection.execute('BEGIN IMMEDIATE')
+		try:
+			for function, callback in jobs:
+				connection.execute('SAVEPOINT job')
+				try:
+					results.append((callback, function(connection)))
+				except Exception as e:
+					connection.execute('ROLLBACK TO job')
+					print "Database write failed. " + \
+						type(e).__name__ + ': ' + unicode(e)
+				connection.execute('RELEASE job')
+			connection.execute('COMMIT')
+		except:
+			try:
+				connection.execute('ROLLBACK')
+			except sqlite3.Error:
+				pass # SQLite has already rolled it back
+			raise
+		for callback, result in results:
+			if callback is not None:
+				try:
+					callback(result)
+				except Exception as e:
+					print "Database write callback failed. " + \
+						type(e).__name__ + ': ' + unicode(e)
+
+
+if __name__ == "__main__":
+	pass
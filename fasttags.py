@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+
+"""
+Beatbox 1.0
+
+Copyright (C) 2013 Luke Hansford - l.s.hansford@gmail.com
+
+DESCRIPTION
+
+This module contains a fast reader for the metadata of audio files, used when
+scanning the library. A scan only needs the tags a Track is made from and the
+stream info, but mutagen reads every tag in a file, including any embedded
+pictures, which are usually most of its tags. This reader memory maps the
+file and walks the ID3v2 frames, FLAC metadata blocks, and MP4 ilst atoms
+itself, passing mutagen only the ones a Track needs. Pictures (APIC frames,
+PICTURE blocks, and covr atoms) are skipped without being read.
+
+Anything unusual is left to mutagen: read_track returns None and the file is
+read the normal way, so errors are still reported as mutagen raises them.
+
+LICENSE
+
+I, Luke Hansford, Hereby grant the rights to distribute, modify, and edit the
+source to Beatbox 1.0, on the condition that this agreement, and my ownership
+of the code contained herewithin be maintained.
+
+Furthurmore, I grant the right to use excerpts from the source to Beatbox 1.0
+without express permission, with exclusion of commercial application.
+"""
+
+#Standard libraries
+import io
+import mmap
+import os
+import os.path
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+#3rd party libraries
+from mutagen.flac import FLAC, Picture, StreamInfo, VCFLACDict
+from mutagen.id3 import ID3, ID3NoHeaderError, APIC, TALB, TIT2, TPE1, TRCK
+from mutagen.mp3 import MPEGInfo
+from mutagen.mp4 import Atoms, MP4Info, MP4NoTrackError, MP4Tags
+
+#Beatbox libraries
+import metadata
+
+
+FLAC_STREAMINFO = 0 # FLAC metadata block types
+FLAC_VORBIS_COMMENT = 4
+ID3_HEADER_SIZE = 10 # Bytes in an ID3v2 tag header, and in a frame header
+ID3V1_SEARCH_SIZE = 131 # Bytes at the end of a file mutagen looks for ID3v1 in
+## The ID3v2 frames a Track is read from, along with the ID3v2.3 date frames
+## mutagen turns into TDRC. Every other frame is skipped.
+ID3_FRAMES = frozenset([key.split(':')[0] for fields in \
+	metadata.FORMAT_TAGS['mp3'].itervalues() for key, converter in fields] + \
+	['TYER', 'TDAT', 'TIME'])
+BENCHMARK_FILES = 200 # Files of each format in the synthetic corpus
+BENCHMARK_PICTURE_SIZE = 512 * 1024 # Bytes of the picture embedded in each
+
+class ParsedFile(object):
+	""" The tags and stream info of an audio file read by the fast reader,
+	in the form Metadata reads them from a mutagen object.
+	"""
+
+	def __init__(self, tags, info):
+		self.tags = tags
+		self.info = info
+
+def read_track(file_path):
+	""" Reads the given audio file into a Track with the fast reader, or
+	returns None if it's in a form the fast reader leaves to mutagen.
+
+	read_track(str) -> Track
+	"""
+	try:
+		with open(file_path, 'rb') as audio_file:
+			if os.fstat(audio_file.fileno()).st_size == 0:
+				return None # An empty file can't be mapped
+			data = mmap.mmap(audio_file.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			format = metadata.recognise_format(data[:metadata.SNIFF_SIZE]) or \
+				metadata.get_format(file_path)
+			reader = READERS.get(format)
+			parsed = reader(data) if reader is not None else None
+		finally:
+			data.close()
+	except Exception:
+		return None # Left to mutagen, which raises the real error
+	if parsed is None:
+		return None
+	md = metadata.Metadata()
+	return metadata.Track.from_tags(file_path, format,
+		md.get_tags(parsed, format), md.get_stream_info(parsed))
+
+def read_flac(data):
+	""" Reads the Vorbis comment and stream info from the metadata blocks of
+	a memory mapped FLAC file, or returns None if it needs mutagen. The
+	bit rate is worked out from the size of the audio as mutagen does.
+
+	read_flac(mmap) -> ParsedFile
+	"""
+	if data[:4] != 'fLaC':
+		return None # An ID3 tag before the FLAC stream
+	info = None
+	tags = None
+	offset = 4
+	last = False
+	while not last:
+		header = data[offset:offset + 4]
+		if len(header) < 4:
+			return None
+		code = ord(header[0]) & 0x7f
+		last = bool(ord(header[0]) & 0x80)
+		start = offset + 4
+		offset = start + struct.unpack('>I', '\x00' + header[1:])[0]
+		if offset > len(data):
+			return None
+		if info is None:
+			if code != FLAC_STREAMINFO:
+				return None
+			info = StreamInfo(data[start:offset])
+		elif code == FLAC_VORBIS_COMMENT and tags is None:
+			data.seek(start)
+			tags = VCFLACDict(data)
+			if data.tell() != offset:
+				return None # A wrong block size, which mutagen works around
+	if info.length:
+		info.bitrate = int(float(len(data) - offset) * 8 / info.length)
+	else:
+		info.bitrate = 0
+	return ParsedFile(tags, info)
+
+def read_mp3(data):
+	""" Reads the ID3 tags and stream info of a memory mapped MP3 file, or
+	returns None if it needs mutagen. The frames a Track needs are copied
+	into a small ID3v2 tag, with the end of the file for any ID3v1 tag, and
+	read by mutagen from that, so they're decoded just as they would be
+	from the file.
+
+	read_mp3(mmap) -> ParsedFile
+	"""
+	frames = []
+	if data[:3] == 'ID3':
+		version = ord(data[3])
+		flags = ord(data[5])
+		## Unsynchronisation, extended headers, and footers are left to mutagen
+		if version not in (3, 4) or flags & 0xd0:
+			return None
+		end = ID3_HEADER_SIZE + read_syncsafe(data[6:10])
+		offset = ID3_HEADER_SIZE
+		while offset + ID3_HEADER_SIZE <= end:
+			name = data[offset:offset + 4]
+			if name.strip('\x00') == '':
+				break # Padding
+			if not (name.isalnum() and name.isupper()):
+				return None
+			if version == 4:
+				size = read_syncsafe(data[offset + 4:offset + 8])
+			else:
+				size = struct.unpack('>I', data[offset + 4:offset + 8])[0]
+			start = offset
+			offset += ID3_HEADER_SIZE + size
+			if offset > end:
+				return None
+			if name in ID3_FRAMES:
+				frames.append(data[start:offset])
+		body = ''.join(frames)
+		tag = data[:5] + chr(flags) + write_syncsafe(len(body)) + body
+	else:
+		end = None
+		tag = ''
+	if len(data) - ID3V1_SEARCH_SIZE < (end or 0):
+		return None # An ID3v1 tag would overlap the ID3v2 tag
+	try:
+		tags = ID3(io.BytesIO(tag + data[-ID3V1_SEARCH_SIZE:]))
+	except ID3NoHeaderError:
+		tags = None
+	return ParsedFile(tags, MPEGInfo(data, end))
+
+def read_m4a(data):
+	""" Reads the ilst tags and stream info of a memory mapped MP4 file, or
+	returns None if it needs mutagen. Only the atom headers are read to find
+	the tags, and the cover art atoms are dropped before mutagen reads the
+	rest.
+
+	read_m4a(mmap) -> ParsedFile
+	"""
+	atoms = Atoms(data)
+	info = MP4Info()
+	try:
+		info.load(atoms, data)
+	except MP4NoTrackError:
+		pass
+	try:
+		ilst = atoms.path('moov', 'udta', 'meta', 'ilst')[-1]
+	except KeyError:
+		return ParsedFile(None, info)
+	ilst.children = [atom for atom in ilst.children if atom.name != 'covr']
+	return ParsedFile(MP4Tags(atoms, data), info)
+
+def read_syncsafe(data):
+	""" Reads a 4 byte ID3v2 syncsafe integer, which uses the low 7 bits of
+	each byte. Raises ValueError if it isn't syncsafe.
+
+	read_syncsafe(str) -> int
+	"""
+	value = 0
+	for byte in bytearray(data):
+		if byte & 0x80:
+			raise ValueError('Not a syncsafe integer')
+		value = (value << 7) | byte
+	return value
+
+def write_syncsafe(value):
+	""" Writes an integer as a 4 byte ID3v2 syncsafe integer.
+
+	write_syncsafe(int) -> str
+	"""
+	return ''.join([chr((value >> shift) & 0x7f) for shift in (21, 14, 7, 0)])
+
+## The reader for each format. Formats without one are always read by mutagen.
+READERS = {'flac': read_flac, 'mp3': read_mp3, 'm4a': read_m4a}
+
+def create_benchmark_corpus(directory, count, picture_size):
+	""" Creates count FLAC and count MP3 files in the given directory for the
+	benchmark, each tagged by mutagen with a picture of the given size. The
+	audio is a few silent frames, as only the metadata is read.
+
+	create_benchmark_corpus(str, int, int) -> None
+	"""
+	picture = os.urandom(picture_size)
+	mp3_frame = '\xff\xfb\x90\x44' + '\x00' * 413 # 128 kbps, 44.1 kHz
+	flac_info = struct.pack('>HH', 4096, 4096) + '\x00' * 6 + \
+		struct.pack('>Q', (44100 << 44) | (1 << 41) | (15 << 36) | \
+		44100 * 200) + '\x00' * 16 # 200 seconds of 44.1 kHz stereo
+	for i in range(count):
+		title = u'Track %d' % i
+		file_path = os.path.join(directory, '%05d.flac' % i)
+		with open(file_path, 'wb') as audio_file:
+			audio_file.write('fLaC\x80' + struct.pack('>I', len(flac_info))[1:]
+				+ flac_info + '\xff\xf8' + '\x00' * 2000)
+		audio = FLAC(file_path)
+		audio['title'] = title
+		audio['artist'] = u'Artist %d' % (i % 20)
+		audio['album'] = u'Album %d' % (i % 50)
+		audio['tracknumber'] = unicode(i % 12 + 1)
+		cover = Picture()
+		cover.type = 3
+		cover.mime = u'image/jpeg'
+		cover.data = picture
+		audio.add_picture(cover)
+		audio.save()
+
+		file_path = os.path.join(directory, '%05d.mp3' % i)
+		with open(file_path, 'wb') as audio_file:
+			audio_file.write(mp3_frame * 200)
+		tags = ID3()
+		tags.add(TIT2(encoding=3, text=title))
+		tags.add(TPE1(encoding=3, text=u'Artist %d' % (i % 20)))
+		tags.add(TALB(encoding=3, text=u'Album %d' % (i % 50)))
+		tags.add(TRCK(encoding=3, text=u'%d/12' % (i % 12 + 1)))
+		tags.add(APIC(encoding=3, mime=u'image/jpeg', type=3, desc=u'',
+			data=picture))
+		tags.save(file_path)
+
+def benchmark(directory, repeat=3):
+	""" Compares the rate the audio files in the given directory are read into
+	Tracks by the fast reader and by mutagen, and prints the results along
+	with the number of files the fast reader left to mutagen and any whose
+	metadata differed. The best of the given number of runs is used.
+
+	benchmark(str, int) -> None
+	"""
+	md = metadata.Metadata()
+	file_paths = [os.path.join(directory, f) for f in sorted(os.listdir(
+		directory)) if md.isValidFile(f)]
+	if not file_paths:
+		print 'No audio files in ' + directory
+		return None
+	for name, function in (('mutagen', metadata.Track),
+		('fast reader', read_track)):
+		best = None
+		for i in range(repeat):
+			start = time.time()
+			tracks = [function(file_path) for file_path in file_paths]
+			elapsed = time.time() - start
+			if best is None or elapsed < best:
+				best = elapsed
+		print '%s: %d files in %.2fs, %.0f files/s' % (name, len(file_paths),
+			best, len(file_paths) / max(best, 1e-6))
+	fallbacks = 0
+	differences = 0
+	for file_path, track in zip(file_paths, tracks):
+		if track is None:
+			fallbacks += 1
+		elif [getattr(track, field) for field in metadata.Track.__slots__] != \
+			[getattr(metadata.Track(file_path), field) for field in \
+			metadata.Track.__slots__]:
+			differences += 1
+			print 'Differs from mutagen: ' + file_path
+	print '%d left to mutagen, %d different' % (fallbacks, differences)
+
+
+if __name__ == "__main__":
+	## fasttags.py [directory] benchmarks an existing directory, otherwise a
+	## synthetic corpus is created in a temporary directory and removed after
+	if len(sys.argv) > 1:
+		benchmark(sys.argv[1])
+	else:
+		benchmark_directory = tempfile.mkdtemp()
+		try:
+			create_benchmark_corpus(benchmark_directory, BENCHMARK_FILES,
+				BENCHMARK_PICTURE_SIZE)
+			benchmark(benchmark_directory)
+		finally:
+			shutil.rmtree(benchmark_directory)
@@ -20,9 +20,19 @@ without express permission, with exclusion of commercial application.
 """
 
 #Standard libraries
+import cPickle
+import hashlib
+import os
 import os.path
+import itertools
+import multiprocessing
+import re
+import shutil
 import sqlite3
-import datetime
+import tempfile
+import threading
+import time
+import unicodedata
 
 #3rd party libraries
 import mutagen
@@ -32,19 +42,519 @@ from mutagen.oggvorbis import OggVorbis
 from mutagen.easyid3 import EasyID3
 
 #Beatbox libraries
+import database
+import fasttags
 import metadata
+import scanner
 
 
 DATABASE_NAME = 'data/library.db'
+INGEST_BATCH_SIZE = 500 # Rows written to the database per transaction
+PARALLEL_INGEST_THRESHOLD = 50 # Smaller jobs aren't worth starting a pool for
+SCAN_CHECKPOINT_NAME = 'data/scan_checkpoint.cpk'
+PROGRESS_INTERVAL = 0.1 # Minimum seconds between progress reports of a scan
+STREAM_CHUNK_SIZE = 16 # Files sent to each worker at a time while scanning
+MAX_QUERY_PARAMETERS = 500 # Values bound to one query, under SQLite's limit
+USE_FAST_TAGS = True # Read files with fasttags, leaving only odd ones to mutagen
+BENCHMARK_ROWS = 50000 # Songs in the library built by benchmark
+## Text columns that are sorted by a normalised copy in a <column>_sort column
+SORT_KEY_COLUMNS = ('path', 'artist', 'title', 'album', 'year', 'genre',
+	'album_artist', 'publisher', 'comment', 'composer', 'bpm', 'format',
+	'channels')
+## Numeric columns, which are sorted by their own values
+NUMERIC_COLUMNS = ('track_number', 'total_tracks', 'disc_number',
+	'total_discs', 'time', 'plays', 'date_added', 'date_modified', 'size',
+	'bit_rate', 'sample_rate')
+SORT_ARTICLES = ('the ', 'a ', 'an ') # Ignored at the start of sort keys
+SORT_NUMBER_WIDTH = 10 # Digits numbers are padded to so they sort naturally
+NUMBER_PATTERN = re.compile(r'\d+', re.UNICODE)
+## Columns of the Songs table that are read from the file itself, followed by
+## their sort keys. Plays and date added are Beatbox specific so aren't
+## included.
+TRACK_COLUMNS = ('path', 'artist', 'title', 'album', 'year', 'genre',
+	'track_number', 'total_tracks', 'disc_number', 'total_discs',
+	'album_artist', 'publisher', 'time', 'comment', 'composer', 'bpm',
+	'date_modified', 'size', 'bit_rate', 'sample_rate', 'format', 'channels',
+	'mtime', 'file_size') + tuple(c + '_sort' for c in SORT_KEY_COLUMNS)
+INSERT_TRACK_QUERY = 'INSERT OR IGNORE INTO Songs(' + \
+	', '.join(TRACK_COLUMNS) + ', plays, date_added) VALUES(' + \
+	', '.join(['?'] * (len(TRACK_COLUMNS) + 2)) + ')'
+INSERT_FAILED_FILE_QUERY = 'INSERT OR REPLACE INTO failed_files(path, mtime, \
+	file_size, error, message) VALUES (?, ?, ?, ?, ?)'
+DELETE_FAILED_FILE_QUERY = 'DELETE FROM failed_files WHERE path = ?'
+UPDATE_TRACK_QUERY = 'UPDATE Songs SET ' + \
+	', '.join([c + '=?' for c in TRACK_COLUMNS[1:]]) + ' WHERE path = ?'
+## Columns that can be found by searching the library
+SEARCH_COLUMNS = ('title', 'artist', 'album', 'album_artist', 'composer',
+	'genre', 'comment')
+SEARCH_TRIGGER_COLUMNS = ', '.join(SEARCH_COLUMNS)
+SEARCH_TRIGGER_VALUES = ', '.join(['%s.' + c for c in SEARCH_COLUMNS])
+## Order of the library when it isn't sorted by a column
+DEFAULT_ORDER = 'artist_sort ASC, album_sort ASC, disc_number ASC, \
+	track_number ASC'
+## Columns stored as raw numbers, and the Metadata method that formats each one
+## for display
+COLUMN_FORMATTERS = {'time': 'format_time', 'size': 'format_size',
+	'bit_rate': 'format_bit_rate', 'sample_rate': 'format_sample_rate',
+	'date_modified': 'format_date', 'date_added': 'format_date'}
+
+def track_values(track, fingerprint):
+	""" Returns the values of the given Track and its (mtime, file_size)
+	fingerprint in the order of TRACK_COLUMNS.
+
+	track_values(Track, (float, int)) -> tuple
+	"""
+	values = (track.file_path, track.artist, track.title, track.album,
+		track.year, track.genre, track.track_number, track.total_tracks,
+		track.disc_number, track.total_discs, track.album_artist,
+		track.publisher, track.time, track.comment, track.composer,
+		track.bpm, track.date_modified, track.size, track.bit_rate,
+		track.sample_rate, track.format, track.channels) + tuple(fingerprint)
+	return values + tuple(sort_key(values[TRACK_COLUMNS.index(c)])
+		for c in SORT_KEY_COLUMNS)
+
+def sort_key(text):
+	""" Returns the key the given text is sorted by in the library. Unicode
+	is normalised so equivalent characters (e.g. full width and half width
+	forms) sort together, case is ignored, a leading 'The', 'A' or 'An' is
+	ignored, and numbers are padded so they sort by value. Text in scripts
+	without case, such as Chinese, keeps its code point order.
+
+	sort_key(str) -> unicode
+	"""
+	if text is None:
+		return None
+	if not isinstance(text, unicode):
+		text = str(text).decode('utf-8', 'replace')
+	key = unicodedata.normalize('NFKC', text).lower().strip()
+	for article in SORT_ARTICLES:
+		if key.startswith(article) and len(key) > len(article):
+			key = key[len(article):].lstrip()
+			break
+	return NUMBER_PATTERN.sub(
+		lambda match: match.group().zfill(SORT_NUMBER_WIDTH), key)
+
+def sort_column(column):
+	""" Returns the column of the Songs table that the given column is sorted
+	by.
+
+	sort_column(str) -> str
+	"""
+	if column in SORT_KEY_COLUMNS:
+		return column + '_sort'
+	return column
+
+def ingest_chunk_size(total, workers):
+	""" Returns the number of files sent to each ingest worker at a time, so
+	the workers aren't sent one file per message but each still gets several
+	chunks to balance the load. A total of 0 means a stream of files still
+	being found, which is sent STREAM_CHUNK_SIZE files at a time.
+
+	ingest_chunk_size(int, int) -> int
+	"""
+	if not total:
+		return STREAM_CHUNK_SIZE
+	return max(1, min(64, total / (workers * 8)))
+
+def read_track(file_path):
+	""" Reads the metadata of the given file and returns it as a tuple of
+	values in the order of TRACK_COLUMNS. This runs in the ingest worker
+	processes, so failures are returned rather than raised, as the file's
+	(mtime, file_size) fingerprint followed by the error's class and message.
+	The fingerprint is None if the file couldn't be found.
+
+	read_track(str) -> (str, tuple, tuple)
+	"""
+	return read_file(file_path, False)[:3]
+
+def read_track_and_art(file_path):
+	""" Reads the metadata of the given file like read_track, and takes its
+	cover from the same parse, returning the result of read_cover as well, or
+	None if it couldn't be read. The file is always read by mutagen, as the
+	fast reader skips pictures.
+
+	read_track_and_art(str) -> (str, tuple, tuple, tuple)
+	"""
+	return read_file(file_path, True)
+
+def read_file(file_path, with_art):
+	""" Reads the given file for read_track, or read_track_and_art if with_art
+	is True.
+
+	read_file(str, bool) -> (str, tuple, tuple, tuple)
+	"""
+	try:
+		## Fingerprint first so a file changed mid-parse is caught next scan
+		fingerprint = metadata.Metadata().get_fingerprint(file_path)
+	except OSError as e:
+		return file_path, None, (None, None, type(e).__name__, unicode(e)), \
+			None
+	if _ingest_state['readahead']:
+		scanner.advise_readahead(file_path)
+	try:
+		if with_art:
+			track, cover = metadata.read_track_and_cover(file_path)
+		else:
+			track = fasttags.read_track(file_path) if USE_FAST_TAGS else None
+			if track is None:
+				track = metadata.Track(file_path)
+	except Exception as e:
+		return file_path, None, tuple(fingerprint) + (type(e).__name__,
+			unicode(e)), None
+	art = None
+	if with_art:
+		try:
+			art = read_cover(file_path, cover)
+		except Exception as e:
+			## The song is still added, and its cover found when it's shown
+			print "Couldn't read the cover of " + file_path + ". " + \
+				type(e).__name__ + ': ' + unicode(e)
+	return file_path, track_values(track, fingerprint), None, art
+
+def read_cover(file_path, cover):
+	""" Returns the hash of the given song's cover, which is the cover
+	embedded in it if there is one or else its folder's cover file, along
+	with the cover's bytes, or None for them if this process has already
+	returned them since init_ingest_worker. (None, None) is returned if the
+	song has no cover. Scaling the cover is left to the process using the art
+	cache, so workers never use Qt.
+
+	read_cover(str, str) -> (str, str)
+	"""
+	if not cover:
+		cover_path = _ingest_state['cover_resolver'].get_cover_path(
+			os.path.dirname(file_path))
+		if cover_path is not None:
+			cover = metadata.Metadata().convert_image(cover_path)
+	if not cover:
+		return None, None
+	cover_hash = hashlib.sha1(cover).hexdigest()
+	if cover_hash in _ingest_state['sent_covers']:
+		return cover_hash, None
+	_ingest_state['sent_covers'].add(cover_hash)
+	return cover_hash, cover
+
+def init_ingest_worker(readahead=False):
+	""" Gives the process that's about to read covers with read_cover its own
+	cover resolver, rather than one whose lock may have been held by another
+	thread when the process was forked, and forgets the covers it has sent.
+	If readahead is True, read_file asks the kernel to fetch each file's tags
+	just before reading it. Used as the initializer of the ingest pool's
+	workers.
+
+	init_ingest_worker(bool) -> None
+	"""
+	_ingest_state['cover_resolver'] = metadata.CoverResolver()
+	_ingest_state['sent_covers'] = set()
+	_ingest_state['readahead'] = readahead
+
+## The state read_file and read_cover keep in each process, set up by
+## init_ingest_worker
+_ingest_state = {'cover_resolver': metadata.CoverResolver(),
+	'sent_covers': set(), 'readahead': False}
+
+def create_songs_table(connection):
+	""" Schema version 1. Creates the Songs table, or adds the file
+	fingerprint columns to a table made before they existed. Rows without a
+	fingerprint are read again on the next update.
+
+	create_songs_table(Connection) -> None
+	"""
+	connection.execute("CREATE TABLE IF NOT EXISTS Songs(path TEXT, \
+		artist TEXT, title TEXT, album TEXT, year TEXT, genre TEXT, \
+		track_number INT, total_tracks INT, disc_number INT, \
+		total_discs INT, album_artist TEXT, publisher TEXT, time REAL, \
+		plays INT, comment TEXT, date_added TEXT, composer TEXT, \
+		bpm TEXT, date_modified TEXT, size TEXT, bit_rate TEXT, \
+		sample_rate TEXT, format TEXT, channels TEXT, mtime REAL, \
+		file_size INT)")
+	columns = [row[1] for row in connection.execute('PRAGMA table_info(Songs)')]
+	if 'mtime' not in columns:
+		connection.execute('ALTER TABLE Songs ADD COLUMN mtime REAL')
+	if 'file_size' not in columns:
+		connection.execute('ALTER TABLE Songs ADD COLUMN file_size INT')
+
+def add_songs_indexes(connection):
+	""" Schema version 2. Makes paths unique, keeping the most recently added
+	row of any duplicates, and adds indexes for looking up paths, for the
+	default library ordering, and for the columns the library is browsed by.
+
+	add_songs_indexes(Connection) -> None
+	"""
+	connection.execute('DELETE FROM Songs WHERE rowid NOT IN \
+		(SELECT MAX(rowid) FROM Songs GROUP BY path)')
+	connection.execute('CREATE UNIQUE INDEX songs_path ON Songs(path)')
+	connection.execute('CREATE INDEX songs_default_order ON Songs(artist, \
+		album, disc_number, track_number)')
+	connection.execute('CREATE INDEX songs_album ON Songs(album)')
+	connection.execute('CREATE INDEX songs_album_artist ON Songs(album_artist)')
+	connection.execute('CREATE INDEX songs_genre ON Songs(genre)')
+	connection.execute('CREATE INDEX songs_year ON Songs(year)')
+	connection.execute('CREATE INDEX songs_composer ON Songs(composer)')
+
+def parse_number(text):
+	""" Returns the first number in a formatted string such as '320 kbps', or
+	None if there isn't one. Used to convert rows from before schema version 3.
+
+	parse_number(str) -> float
+	"""
+	match = re.search(r'\d+(\.\d+)?', text or '')
+	if match is None:
+		return None
+	return float(match.group())
+
+def parse_time(text):
+	""" Converts a track length formatted as [HH:]MM:SS to seconds. Older
+	versions of Beatbox wrote the total minutes after the hours, so 3700
+	seconds was written 01:61:40, and a minutes field of 60 or more is taken
+	as the total.
+
+	parse_time(str) -> int
+	"""
+	try:
+		parts = [int(part) for part in text.split(':')]
+	except (AttributeError, ValueError):
+		return None
+	if len(parts) == 3 and parts[1] >= 60:
+		parts = parts[1:] # The hours are already counted in the minutes
+	seconds = 0
+	for part in parts:
+		seconds = seconds * 60 + part
+	return seconds
+
+def parse_ctime(text):
+	""" Converts a date formatted by time.ctime to seconds since the epoch.
+
+	parse_ctime(str) -> float
+	"""
+	try:
+		return time.mktime(time.strptime(text))
+	except (TypeError, ValueError):
+		return None
+
+def parse_timestamp(text):
+	""" Converts a date stored by sqlite3's datetime adapter to seconds since
+	the epoch.
+
+	parse_timestamp(str) -> float
+	"""
+	try:
+		return time.mktime(time.strptime(text[:19], '%Y-%m-%d %H:%M:%S'))
+	except (TypeError, ValueError):
+		return None
+
+def add_numeric_columns(connection):
+	""" Schema version 3. Rebuilds the Songs table so the time, size, bit
+	rate, sample rate and dates are stored as numbers (seconds, bytes, bits per
+	second, Hz and seconds since the epoch) rather than formatted strings, so
+	they can be sorted and summed by SQLite. The songs get an integer id, and
+	existing rows are converted.
+
+	add_numeric_columns(Connection) -> None
+	"""
+	connection.create_function('parse_number', 1, parse_number)
+	connection.create_function('parse_time', 1, parse_time)
+	connection.create_function('parse_ctime', 1, parse_ctime)
+	connection.create_function('parse_timestamp', 1, parse_timestamp)
+	connection.execute("CREATE TABLE songs_numeric(id INTEGER PRIMARY KEY, \
+		path TEXT NOT NULL, artist TEXT, title TEXT, album TEXT, year TEXT, \
+		genre TEXT, track_number INT, total_tracks INT, disc_number INT, \
+		total_discs INT, album_artist TEXT, publisher TEXT, time REAL, \
+		plays INT DEFAULT 0, comment TEXT, date_added REAL, composer TEXT, \
+		bpm TEXT, date_modified REAL, size INT, bit_rate INT, \
+		sample_rate INT, format TEXT, channels TEXT, mtime REAL, \
+		file_size INT)")
+	connection.execute("INSERT INTO songs_numeric(path, artist, title, \
+		album, year, genre, track_number, total_tracks, disc_number, \
+		total_discs, album_artist, publisher, time, plays, comment, \
+		date_added, composer, bpm, date_modified, size, bit_rate, \
+		sample_rate, format, channels, mtime, file_size) \
+		SELECT path, artist, title, album, year, genre, track_number, \
+		total_tracks, disc_number, total_discs, album_artist, publisher, \
+		parse_time(time), plays, comment, parse_timestamp(date_added), \
+		composer, bpm, COALESCE(mtime, parse_ctime(date_modified)), \
+		COALESCE(file_size, CAST(parse_number(size) * 1048576 AS INT)), \
+		CAST(parse_number(bit_rate) * 1000 AS INT), \
+		CAST(parse_number(sample_rate) AS INT), format, channels, mtime, \
+		file_size FROM Songs ORDER BY rowid")
+	connection.execute('DROP TABLE Songs')
+	connection.execute('ALTER TABLE songs_numeric RENAME TO Songs')
+	connection.execute('CREATE UNIQUE INDEX songs_path ON Songs(path)')
+	connection.execute('CREATE INDEX songs_default_order ON Songs(artist, \
+		album, disc_number, track_number)')
+	connection.execute('CREATE INDEX songs_album ON Songs(album)')
+	connection.execute('CREATE INDEX songs_album_artist ON Songs(album_artist)')
+	connection.execute('CREATE INDEX songs_genre ON Songs(genre)')
+	connection.execute('CREATE INDEX songs_year ON Songs(year)')
+	connection.execute('CREATE INDEX songs_composer ON Songs(composer)')
+
+def add_sort_keys(connection):
+	""" Schema version 4. Adds a sort key column for each text column, fills
+	them in for the existing rows, and indexes every column the library can
+	be sorted by so sorting the library view is done by an index.
+
+	add_sort_keys(Connection) -> None
+	"""
+	connection.create_function('sort_key', 1, sort_key)
+	for column in SORT_KEY_COLUMNS:
+		connection.execute('ALTER TABLE Songs ADD COLUMN %s_sort TEXT' % column)
+	connection.execute('UPDATE Songs SET ' + ', '.join(['%s_sort = sort_key(%s)'
+		% (c, c) for c in SORT_KEY_COLUMNS]))
+	for index in ('songs_default_order', 'songs_album', 'songs_album_artist',
+		'songs_genre', 'songs_year', 'songs_composer'):
+		connection.execute('DROP INDEX ' + index)
+	connection.execute('CREATE INDEX songs_default_order ON Songs(artist_sort, \
+		album_sort, disc_number, track_number)')
+	for column in SORT_KEY_COLUMNS + NUMERIC_COLUMNS:
+		connection.execute('CREATE INDEX songs_%s_order ON Songs(%s)' % \
+			(column, sort_column(column)))
+
+def add_search_index(connection):
+	""" Schema version 5. Adds an FTS5 full text index over the searchable
+	columns of the Songs table, kept up to date by triggers, and fills it in
+	for the existing rows. The index only stores the words, the text itself
+	stays in the Songs table. If SQLite was built without FTS5 nothing is
+	added and searching falls back to LIKE queries.
+
+	add_search_index(Connection) -> None
+	"""
+	try:
+		connection.execute("CREATE VIRTUAL TABLE songs_search USING fts5(" + \
+			SEARCH_TRIGGER_COLUMNS + ", content='Songs', content_rowid='id', \
+			tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+	except sqlite3.OperationalError:
+		return None # No FTS5 module
+	connection.execute('CREATE TRIGGER songs_search_insert AFTER INSERT ON \
+		Songs BEGIN INSERT INTO songs_search(rowid, ' + SEARCH_TRIGGER_COLUMNS + \
+		') VALUES (new.id, ' + SEARCH_TRIGGER_VALUES % \
+		(('new',) * len(SEARCH_COLUMNS)) + '); END')
+	connection.execute('CREATE TRIGGER songs_search_delete AFTER DELETE ON \
+		Songs BEGIN INSERT INTO songs_search(songs_search, rowid, ' + \
+		SEARCH_TRIGGER_COLUMNS + ") VALUES ('delete', old.id, " + \
+		SEARCH_TRIGGER_VALUES % (('old',) * len(SEARCH_COLUMNS)) + '); END')
+	## Only changes to searchable columns, so play counts don't touch the index
+	connection.execute('CREATE TRIGGER songs_search_update AFTER UPDATE OF ' + \
+		SEARCH_TRIGGER_COLUMNS + ' ON Songs BEGIN INSERT INTO \
+		songs_search(songs_search, rowid, ' + SEARCH_TRIGGER_COLUMNS + \
+		") VALUES ('delete', old.id, " + SEARCH_TRIGGER_VALUES % \
+		(('old',) * len(SEARCH_COLUMNS)) + '); INSERT INTO songs_search(rowid, ' \
+		+ SEARCH_TRIGGER_COLUMNS + ') VALUES (new.id, ' + \
+		SEARCH_TRIGGER_VALUES % (('new',) * len(SEARCH_COLUMNS)) + '); END')
+	connection.execute("INSERT INTO songs_search(songs_search) VALUES('rebuild')")
+
+def add_failed_files_table(connection):
+	""" Schema version 6. Creates the failed_files table, which records the
+	files that couldn't be read along with their fingerprint and the error,
+	so they aren't read again on every update unless they've changed.
+
+	add_failed_files_table(Connection) -> None
+	"""
+	connection.execute('CREATE TABLE IF NOT EXISTS failed_files(\
+		path TEXT PRIMARY KEY, mtime REAL, file_size INTEGER, error TEXT, \
+		message TEXT)')
+
+def search_query(text):
+	""" Converts text typed by the user into an FTS5 query that matches songs
+	containing words starting with each of the typed words.
+
+	search_query(unicode) -> unicode
+	"""
+	return u' '.join([u'"' + word.replace(u'"', u'""') + u'"*'
+		for word in text.split()])
+
+def like_pattern(word):
+	""" Converts a word typed by the user into a LIKE pattern that matches
+	text containing it.
+
+	like_pattern(unicode) -> unicode
+	"""
+	for character in (u'\\', u'%', u'_'):
+		word = word.replace(character, u'\\' + character)
+	return u'%' + word + u'%'
+
+## Each function upgrades the library database by one schema version
+LIBRARY_MIGRATIONS = [create_songs_table, add_songs_indexes,
+	add_numeric_columns, add_sort_keys, add_search_index,
+	add_failed_files_table]
+
+class ScanTask(object):
+	""" Lets a scan or ingest running off the GUI thread report its progress
+	and be cancelled. Progress is passed to the callback as (label, value,
+	maximum), no more than every PROGRESS_INTERVAL seconds so a fast scan
+	doesn't flood the GUI. Cancelling is cooperative: the Library checks
+	is_cancelled between files and stops at the next one.
+	"""
+
+	def __init__(self, callback=None):
+		self.callback = callback
+		self.label = ''
+		self.value = 0
+		self.maximum = 0
+		self.failed_files = [] # (path, error) of files that couldn't be read
+		self._cancelled = threading.Event()
+		self._last_report = 0
+
+	def cancel(self):
+		""" Asks the scan to stop.
+
+		ScanTask.cancel() -> None
+		"""
+		self._cancelled.set()
+
+	def is_cancelled(self):
+		""" Checks if the scan has been asked to stop.
+
+		ScanTask.is_cancelled() -> bool
+		"""
+		return self._cancelled.is_set()
+
+	def set_stage(self, label, maximum=0):
+		""" Starts a new stage of the scan, with the given label and number of
+		steps. A maximum of 0 means the number of steps isn't known.
+
+		ScanTask.set_stage(str, int) -> None
+		"""
+		self.label = label
+		self.value = 0
+		self.maximum = maximum
+		self.report(True)
+
+	def advance(self, steps=1):
+		""" Records that the given number of steps have been done.
+
+		ScanTask.advance(int) -> None
+		"""
+		self.value += steps
+		self.report()
+
+	def report(self, force=False):
+		""" Passes the progress to the callback, unless it was passed less than
+		PROGRESS_INTERVAL seconds ago.
+
+		ScanTask.report(bool) -> None
+		"""
+		now = time.time()
+		if self.callback is not None and \
+			(force or now - self._last_report >= PROGRESS_INTERVAL):
+			self._last_report = now
+			self.callback(self.label, self.value, self.maximum)
 
 class Library(object):
 	def __init__(self, parent, columns):
 		self.parent = parent
 		self.localisation = self.parent.localisation
 		self.directories = self.parent.preferences.get_library_dirs_pref()
+		self.ingest_workers = self.parent.preferences.get_ingest_workers_pref()
+		self.io_ordered_ingest = \
+			self.parent.preferences.get_io_ordered_ingest_pref()
+		self.ingest_thumbnails = \
+			self.parent.preferences.get_ingest_thumbnails_pref()
 		self._columns = columns
-		if not self.database_exists():
-			self.build_library(self.directories)
+		self._pending_plays = {} # path -> plays not yet written
+		self._plays_lock = threading.Lock()
+		self.database = database.ConnectionManager(DATABASE_NAME)
+		self.new_database = not self.database_exists()
+		self.create_library_database()
 
 	def database_exists(self):
 		""" Checks that the library database file exists. Returns a boolean of
@@ -54,48 +564,56 @@ class Library(object):
 		"""
 		return os.path.exists(DATABASE_NAME)
 
-	def scan_directory(self, directory):
-		""" Scans a given directory for MP3, FLAC, and OGG files. If they are
-		found they are appended to a list which is returned once the search is
-		complete.
-
-		Library.scan_directory(str) -> list(str)
-		"""
-
-		progress_dialog = self.parent.get_add_files_progress_dialog()
-		files_added = progress_dialog.value()
-		file_paths = []
-		for dirpath,dirnames,filenames in os.walk(directory):
-		    for f in filenames:
-		        if f.endswith(".flac"):
-		             file_paths.append(dirpath+'/'+f)
-		             files_added += 1
-		        elif f.endswith(".mp3"):
-		             file_paths.append(dirpath+'/'+f)
-		             files_added += 1
-		        elif f.endswith(".ogg"):
-		             file_paths.append(dirpath+'/'+f)
-		             files_added += 1
-		        elif f.endswith(".m4a"):
-		             file_paths.append(dirpath+'/'+f)
-		             files_added += 1
-		       	elif f.endswith(".wma"):
-		             file_paths.append(dirpath+'/'+f)
-		             files_added += 1
-		    progress_dialog.setValue(files_added)
-		return file_paths
-
-	def scan_all_directories(self, directories):
-		""" Calls the scan_directory function for a list of given directories.
-		Returns a list all song files from all given directories.
-
-		Library.scan_all_directories(list(str)) -> list(str)
-		"""
-		self.parent.create_add_files_progress_dialog()
-		all_files = []
-		for directory in directories:
-			all_files += self.scan_directory(directory)
-		return all_files
+	def needs_scan(self):
+		""" Checks if the directories need to be scanned when Beatbox starts,
+		either because the library has just been created or because the last
+		scan was cancelled or never finished.
+
+		Library.needs_scan() -> bool
+		"""
+		return self.new_database or os.path.exists(SCAN_CHECKPOINT_NAME)
+
+	def scan_all_directories(self, directories, task=None):
+		""" Yields every song file in the given directories as it's found, so
+		the files can be read while the directories are still being searched.
+		Stops early if the task is cancelled.
+
+		Library.scan_all_directories(list(str), ScanTask) -> iter(str)
+		"""
+		if task is None:
+			task = ScanTask()
+		return scanner.scan_directories(directories, task.is_cancelled)
+
+	def load_scan_checkpoint(self):
+		""" Returns the checkpoint saved by an unfinished scan, or None if
+		there isn't one or it can't be read.
+
+		Library.load_scan_checkpoint() -> dict
+		"""
+		try:
+			with open(SCAN_CHECKPOINT_NAME, 'rb') as checkpoint_file:
+				return cPickle.load(checkpoint_file)
+		except (IOError, EOFError, cPickle.UnpicklingError):
+			return None
+
+	def save_scan_checkpoint(self, checkpoint):
+		""" Saves the progress of a scan. The checkpoint is written to a
+		temporary file first so a crash while saving can't corrupt it.
+
+		Library.save_scan_checkpoint(dict) -> None
+		"""
+		temp_name = SCAN_CHECKPOINT_NAME + '.tmp'
+		with open(temp_name, 'wb') as checkpoint_file:
+			cPickle.dump(checkpoint, checkpoint_file, cPickle.HIGHEST_PROTOCOL)
+		os.rename(temp_name, SCAN_CHECKPOINT_NAME)
+
+	def remove_scan_checkpoint(self):
+		""" Removes the checkpoint once a scan has finished.
+
+		Library.remove_scan_checkpoint() -> None
+		"""
+		if os.path.exists(SCAN_CHECKPOINT_NAME):
+			os.remove(SCAN_CHECKPOINT_NAME)
 
 	def add_directory(self, directory):
 		self.directories.append(directory)
@@ -103,15 +621,43 @@ class Library(object):
 	def remove_directory(self, directory):
 		self.directories.remove(directory)
 
-	def build_library(self, directories):
-		""" Scans all given directories and creates a database from the result.
+	def set_ingest_workers(self, workers):
+		""" Sets the number of worker processes used to read metadata when
+		adding files. 0 uses one worker per CPU.
 
-		Library.build_library(list(str)) -> None
+		Library.set_ingest_workers(int) -> None
 		"""
-		file_paths = self.scan_all_directories(directories)
-		self.create_library_database()
-		self.add_files_to_library(file_paths)
-		return None
+		self.ingest_workers = workers
+
+	def set_io_ordered_ingest(self, io_ordered):
+		""" Sets whether new files are read in the order they're laid out on
+		disk rather than the order they're found in, which saves seeking on
+		hard drives.
+
+		Library.set_io_ordered_ingest(bool) -> None
+		"""
+		self.io_ordered_ingest = io_ordered
+
+	def set_ingest_thumbnails(self, ingest_thumbnails):
+		""" Sets whether thumbnails of new files' covers are made for the art
+		cache as they're read, so the playlist and player never need to open
+		them for their covers.
+
+		Library.set_ingest_thumbnails(bool) -> None
+		"""
+		self.ingest_thumbnails = ingest_thumbnails
+
+	def get_ingest_workers(self):
+		""" Returns the number of worker processes to read metadata with.
+
+		Library.get_ingest_workers() -> int
+		"""
+		if self.ingest_workers > 0:
+			return self.ingest_workers
+		try:
+			return multiprocessing.cpu_count()
+		except NotImplementedError:
+			return 1
 
 	def get_library(self):
 		""" Returns all rows from the library database.
@@ -119,15 +665,106 @@ class Library(object):
 		Library.get_library() -> list(tuple)
 		"""
 		select_query = self.build_select_query(self._columns)
-		all_rows = []
-		connection = sqlite3.connect(DATABASE_NAME)
-		with connection:
-			cursor = connection.cursor()
-			for row in cursor.execute('SELECT ' + select_query + ' FROM \
-				songs ORDER BY artist ASC, album ASC, disc_number ASC, \
-				track_number ASC'):
-				all_rows.append(row)
-		return all_rows
+		return self.database.reader().execute('SELECT ' + select_query + \
+			' FROM songs ORDER BY ' + DEFAULT_ORDER).fetchall()
+
+	def get_library_ids(self, order_by=None, descending=False):
+		""" Returns the ids of all songs in the library, ordered by the given
+		column of the database or in the default order if no column is given.
+
+		Library.get_library_ids(str, bool) -> list(int)
+		"""
+		cursor = self.database.reader().execute('SELECT id FROM Songs \
+			ORDER BY ' + self.build_order_clause(order_by, descending))
+		return [row[0] for row in cursor]
+
+	def build_order_clause(self, order_by, descending):
+		""" Creates the ORDER BY clause for sorting songs by the given column,
+		or in the default order if no column is given. The song id breaks ties
+		so the order is stable and can be read straight from an index.
+
+		Library.build_order_clause(str, bool) -> str
+		"""
+		if order_by is None:
+			return DEFAULT_ORDER + ', id ASC'
+		elif descending:
+			return sort_column(order_by) + ' DESC, id DESC'
+		else:
+			return sort_column(order_by) + ' ASC, id ASC'
+
+	def has_search_index(self):
+		""" Checks if the library database has a full text search index.
+
+		Library.has_search_index() -> bool
+		"""
+		return self.database.reader().execute("SELECT 1 FROM sqlite_master \
+			WHERE name = 'songs_search'").fetchone() is not None
+
+	def search(self, text, order_by=None, descending=False):
+		""" Returns the ids of the songs with a word starting with each of
+		the words in the given text in their title, artist, album, album
+		artist, composer, genre or comment. They're ordered in the same way as
+		get_library_ids.
+
+		Library.search(unicode, str, bool) -> list(int)
+		"""
+		words = text.split()
+		if not words:
+			return self.get_library_ids(order_by, descending)
+		if self.has_search_index():
+			query = 'SELECT id FROM Songs WHERE id IN (SELECT rowid FROM \
+				songs_search WHERE songs_search MATCH ?)'
+			parameters = [search_query(text)]
+		else:
+			conditions = ['(' + ' OR '.join([c + " LIKE ? ESCAPE '\\'"
+				for c in SEARCH_COLUMNS]) + ')'] * len(words)
+			query = 'SELECT id FROM Songs WHERE ' + ' AND '.join(conditions)
+			parameters = [like_pattern(word) for word in words
+				for c in SEARCH_COLUMNS]
+		cursor = self.database.reader().execute(query + ' ORDER BY ' + \
+			self.build_order_clause(order_by, descending), parameters)
+		return [row[0] for row in cursor]
+
+	def get_rows(self, ids):
+		""" Returns a dictionary of the given song ids and their rows from the
+		library database. Ids that aren't in the library are left out.
+
+		Library.get_rows(list(int)) -> dict
+		"""
+		select_query = self.build_select_query(self._columns)
+		cursor = self.database.reader().execute('SELECT id, ' + select_query + \
+			' FROM Songs WHERE id IN (' + ', '.join(['?'] * len(ids)) + ')', ids)
+		return dict((row[0], row[1:]) for row in cursor)
+
+	def get_item_id(self, file_path):
+		""" Returns the id of the given song, or None if it isn't in the
+		library.
+
+		Library.get_item_id(str) -> int
+		"""
+		row = self.database.reader().execute(
+			'SELECT id FROM Songs WHERE path = ?', (file_path,)).fetchone()
+		if row is None:
+			return None
+		return row[0]
+
+	def format_row(self, row):
+		""" Returns the values of a row from the library database as strings
+		for display, formatting the columns stored as numbers.
+
+		Library.format_row(tuple) -> list(unicode)
+		"""
+		md = metadata.Metadata()
+		items = []
+		for col, value in zip(self._columns, row):
+			formatter = COLUMN_FORMATTERS.get(col['Database Name'])
+			if formatter is not None:
+				items.append(unicode(getattr(md, formatter)(value)))
+			elif value is None:
+				items.append(u'')
+			else:
+				items.append(unicode(value))
+		return items
 
 	def build_select_query(self, columns):
 		"""Creates a select query for SQLite based on which columns are supplied
@@ -144,166 +781,602 @@ class Library(object):
 
 		Library.update_play_count(str) -> None
 		"""
-		connection = sqlite3.connect(DATABASE_NAME)
-		with connection:
-			cursor = connection.cursor()
-			query_result = cursor.execute(
-				'SELECT plays FROM songs WHERE path = "' + file_path + '"')
-			current_play_count = query_result.fetchone()
-			if current_play_count:
-				cursor.execute("UPDATE songs SET plays = ? WHERE path = ?",
-				 (current_play_count[0]+1, file_path))
-			else:
-				return None
-		self.parent.update_table_row(file_path)
-	
+		with self._plays_lock:
+			queued = bool(self._pending_plays)
+			self._pending_plays[file_path] = \
+				self._pending_plays.get(file_path, 0) + 1
+		if not queued:
+			self.database.write(self.write_play_counts, self.rows_changed)
+
+	def write_play_counts(self, connection):
+		""" Adds the plays counted since the last write to the library
+		database. Plays of the same song counted before this runs are written
+		together. Runs on the database's writer thread and returns the paths
+		of the songs that were updated.
+
+		Library.write_play_counts(Connection) -> list(str)
+		"""
+		with self._plays_lock:
+			plays, self._pending_plays = self._pending_plays, {}
+		connection.executemany('UPDATE Songs SET plays = plays + ? \
+			WHERE path = ?', [(count, file_path) for file_path, count
+			in plays.iteritems()])
+		return plays.keys()
+
+	def rows_changed(self, file_paths):
+		""" Tells the library view that the rows of the given files have
+		changed. Called from the database's writer thread, so this goes
+		through the view's signal.
+
+		Library.rows_changed(list(str)) -> None
+		"""
+		self.parent.rows_changed.emit(file_paths)
+
 	def get_item_data(self, file_path):
 		""" Returns the row of the given song from the library database.
 
 		Library.get_item_data(str) -> tuple
 		"""	
 		select_query = self.build_select_query(self._columns)
-		connection = sqlite3.connect(DATABASE_NAME)
+		query_result = self.database.reader().execute('SELECT ' + \
+			select_query + ' FROM songs WHERE path = ?', (file_path,))
+		return query_result.fetchone() #path is unique so only 1 result
 
-		with connection:
-			cursor = connection.cursor()
-			query_result = cursor.execute('SELECT ' + select_query + \
-				' FROM songs WHERE path = "' + file_path + '"')
-		return query_result.fetchone() #path is primary key so only 1 result
+	def get_track(self, file_path):
+		""" Returns a Track of the given song made from its row in the library
+		database, without reading the file, or None if it isn't in the
+		library.
+
+		Library.get_track(str) -> Track
+		"""
+		return self.get_tracks([file_path]).get(file_path)
+
+	def get_tracks(self, file_paths):
+		""" Returns a dictionary of the given songs and Tracks made from their
+		rows in the library database, without reading the files. Songs that
+		aren't in the library are left out.
+
+		Library.get_tracks(list(str)) -> dict
+		"""
+		tracks = {}
+		reader = self.database.reader()
+		for start in range(0, len(file_paths), MAX_QUERY_PARAMETERS):
+			batch = file_paths[start:start + MAX_QUERY_PARAMETERS]
+			cursor = reader.execute('SELECT ' + \
+				', '.join(metadata.Track.ROW_COLUMNS) + ' FROM Songs WHERE \
+				path IN (' + ', '.join(['?'] * len(batch)) + ')', batch)
+			for row in cursor:
+				tracks[row[0]] = metadata.Track.from_row(row)
+		return tracks
 
 	def create_library_database(self):
-		""" Creates the library database.
+		""" Creates the library database, or upgrades an existing one to the
+		latest schema version.
 
 		Library.create_library_database() -> None
 		"""
-		connection = sqlite3.connect(DATABASE_NAME)
-		with connection:
-			cursor = connection.cursor()
-			cursor.execute("DROP TABLE IF EXISTS Songs")
-
-			cursor.execute("CREATE TABLE Songs(path TEXT PRIMARYKEY, \
-				artist TEXT, title TEXT, album TEXT, year TEXT, genre TEXT, \
-				track_number INT, total_tracks INT, disc_number INT, \
-				total_discs INT, album_artist TEXT, publisher TEXT, time REAL, \
-				plays INT, comment TEXT, date_added TEXT, composer TEXT, \
-				bpm TEXT, date_modified TEXT, size TEXT, bit_rate TEXT, \
-				sample_rate TEXT, format TEXT, channels TEXT)")
+		self.database.migrate(LIBRARY_MIGRATIONS)
 
 	def get_library_files(self):
 		""" Returns all file paths from the library database.
 
 		Library.get_library_files() -> list(tuple)
 		"""
-		connection = sqlite3.connect(DATABASE_NAME)
-		with connection:
-			cursor = connection.cursor()
-			rows = [row[0] for row in cursor.execute('SELECT path FROM songs')]
-		return rows
+		cursor = self.database.reader().execute('SELECT path FROM songs')
+		return [row[0] for row in cursor]
+
+	def get_library_fingerprints(self):
+		""" Returns a dictionary of every file path in the library database
+		and its stored (mtime, file_size) fingerprint.
+
+		Library.get_library_fingerprints() -> dict
+		"""
+		cursor = self.database.reader().execute(
+			'SELECT path, mtime, file_size FROM Songs')
+		return dict((row[0], (row[1], row[2])) for row in cursor)
+
+	def in_library_directory(self, file_path, directories):
+		""" Checks if the given file path is inside one of the given
+		directories.
 
-	def update_library(self):
+		Library.in_library_directory(str, list(str)) -> bool
+		"""
+		for directory in directories:
+			if file_path.startswith(directory.rstrip('/') + '/'):
+				return True
+		return False
+
+	def find_linked_files(self, file_paths):
+		""" Finds which of the given files in the library directories are
+		stored under a path through a symbolic link, which scans no longer
+		find them by, and returns a dictionary of their real paths. Each
+		folder's real path is only worked out once.
+
+		Library.find_linked_files(list(str)) -> dict
+		"""
+		real_folders = {}
+		linked_files = {}
+		for file_path in file_paths:
+			if not self.in_library_directory(file_path, self.directories):
+				continue
+			folder, name = os.path.split(file_path)
+			if folder not in real_folders:
+				real_folders[folder] = os.path.realpath(folder)
+			if real_folders[folder] != folder:
+				real_path = os.path.join(real_folders[folder], name)
+				if os.path.exists(real_path):
+					linked_files[file_path] = real_path
+		return linked_files
+
+	def move_to_real_paths(self, linked_files):
+		""" Queues rewriting the stored paths of the given files to their real
+		paths, given as a dictionary, so their rows keep their plays and date
+		added. If a file is already in the library under its real path too,
+		that row is kept with the plays of both and the earlier date added,
+		and the other is removed.
+
+		Library.move_to_real_paths(dict) -> None
+		"""
+		def move(connection):
+			for file_path, real_path in linked_files.iteritems():
+				row = connection.execute('SELECT plays, date_added FROM Songs \
+					WHERE path = ?', (file_path,)).fetchone()
+				if row is None:
+					continue
+				real_row = connection.execute('SELECT plays, date_added FROM \
+					Songs WHERE path = ?', (real_path,)).fetchone()
+				if real_row is None:
+					connection.execute('UPDATE Songs SET path = ?, \
+						path_sort = ? WHERE path = ?', (real_path,
+						sort_key(real_path), file_path))
+				else:
+					dates = [d for d in (row[1], real_row[1]) if d is not None]
+					connection.execute('UPDATE Songs SET plays = ?, \
+						date_added = ? WHERE path = ?', ((row[0] or 0) + \
+						(real_row[0] or 0), min(dates) if dates else None,
+						real_path))
+					connection.execute('DELETE FROM Songs WHERE path = ?',
+						(file_path,))
+				connection.execute('DELETE FROM failed_files WHERE path = ?',
+					(file_path,))
+		self.database.write(move)
+
+	def update_library(self, task=None):
 		""" Scans all the directories and checks them against the current
-		library, and adds any new files. Returns a list of all items added
-		successfully.
+		library using each file's (mtime, size) fingerprint. New files are
+		added, files whose fingerprint has changed are read again, and files
+		that have gone from a directory which was scanned are removed. Files
+		outside the library directories (i.e. dropped on the library) and
+		files on directories that can't be found (e.g. unplugged drives) are
+		left alone. Files stored under a path through a symbolic link are
+		moved to their real path first, keeping their rows. Returns a list of
+		all items added successfully.
 
-		Library.update_library() -> list(str)
+		New files are read as the scan finds them. The files found are saved to
+		the scan checkpoint once the scan is done, and the checkpoint is only
+		removed when the update has finished, so an update that was cancelled
+		or crashed carries on from it next time without searching the
+		directories again. Files already written are kept and aren't read again.
+		Nor are files that failed to be read before, unless they've changed.
+
+		Library.update_library(ScanTask) -> list(str)
 		"""
-		all_files = self.scan_all_directories(self.directories)
-		current_library = self.get_library_files()
-		new_files = [f for f in all_files if f not in current_library]
-		successful_files = self.add_files_to_library(new_files)
+		if task is None:
+			task = ScanTask()
+		checkpoint = self.load_scan_checkpoint()
+		if checkpoint is None or checkpoint['directories'] != self.directories:
+			checkpoint = {'directories': list(self.directories), 'files': None}
+			self.save_scan_checkpoint(checkpoint)
+		if checkpoint['files'] is not None:
+			found_files = iter(checkpoint['files'])
+		else:
+			found_files = self.scan_all_directories(self.directories, task)
+		fingerprints = self.get_library_fingerprints()
+		linked_files = self.find_linked_files(fingerprints)
+		if linked_files:
+			self.move_to_real_paths(linked_files)
+			self.database.flush()
+			fingerprints = self.get_library_fingerprints()
+		failed_fingerprints = self.get_failed_fingerprints()
+		md = metadata.Metadata()
+		all_files = []
+		changed_files = []
+
+		def new_files():
+			for file_path in found_files:
+				all_files.append(file_path)
+				if file_path in failed_fingerprints:
+					try:
+						if md.get_fingerprint(file_path) == \
+							failed_fingerprints[file_path]:
+							continue # Failed before and hasn't changed since
+					except OSError:
+						continue
+				if file_path not in fingerprints:
+					yield file_path
+					continue
+				try:
+					if md.get_fingerprint(file_path) != fingerprints[file_path]:
+						changed_files.append(file_path)
+				except OSError:
+					pass # Removed since the scan, it'll be caught next time
+			if not task.is_cancelled():
+				checkpoint['files'] = all_files
+				self.save_scan_checkpoint(checkpoint)
+
+		successful_files = self.add_files_to_library(new_files(), task)
+		if task.is_cancelled():
+			return successful_files
+		scanned_directories = [d for d in self.directories + \
+			scanner.normalise_directories(self.directories) if os.path.isdir(d)]
+		## Checked against the disk too, as the checkpoint's list of files may
+		## be older than files the watcher has added since
+		all_files = set(all_files)
+		removed_files = [f for f in fingerprints if f not in all_files and \
+			self.in_library_directory(f, scanned_directories) and \
+			not os.path.exists(f)]
+		if removed_files:
+			self.remove_items(removed_files)
+		self.remove_failed_files([f for f in failed_fingerprints if \
+			f not in all_files and not os.path.exists(f)])
+		if changed_files:
+			self.update_files_in_library(changed_files, task)
+		if not task.is_cancelled():
+			self.remove_scan_checkpoint()
 		return successful_files
 
+	def sync_files(self, updated_paths, removed_paths):
+		""" Brings the library up to date with a batch of changes from the
+		directory watcher. Updated files that aren't in the library are added,
+		ones whose fingerprint has changed are read again, and removed paths
+		(files, or directories and everything inside them) are deleted. Returns
+		the lists of file paths added, changed, and removed.
+
+		Library.sync_files(set(str), set(str)) -> (list(str), list(str),
+			list(str))
+		"""
+		fingerprints = {}
+		removed_files = []
+		connection = self.database.reader()
+		for file_path in updated_paths:
+			row = connection.execute('SELECT mtime, file_size FROM Songs \
+				WHERE path = ?', (file_path,)).fetchone()
+			if row is not None:
+				fingerprints[file_path] = tuple(row)
+		for path in removed_paths:
+			prefix = path.rstrip('/') + '/'
+			removed_files += [row[0] for row in connection.execute(
+				'SELECT path FROM Songs WHERE path = ? OR \
+				substr(path, 1, ?) = ?', (path, len(prefix), prefix))]
+
+		md = metadata.Metadata()
+		new_files = []
+		changed_files = []
+		for file_path in updated_paths:
+			if file_path not in fingerprints:
+				new_files.append(file_path)
+				continue
+			try:
+				if md.get_fingerprint(file_path) != fingerprints[file_path]:
+					changed_files.append(file_path)
+			except OSError:
+				pass # Gone again, a removal will follow
+
+		if removed_files:
+			self.remove_items(removed_files)
+		changed_files = self.update_files_in_library(changed_files)
+		new_files = self.add_files_to_library(new_files)
+		return new_files, changed_files, removed_files
+
 	def update_file(self, track):
-		""" Updates the given track in the library.
+		""" Updates the given track in the library. Plays and date added are
+		Beatbox specific so they're kept.
 
 		Library.update_file(Track) -> None
 		"""
-		connection = sqlite3.connect(DATABASE_NAME)
-		with connection:
-			cursor = connection.cursor()
-			## Need to get date added and plays as they're Beatbox specific
-			query_result = cursor.execute('SELECT plays, date_added FROM\
-			 songs WHERE path = "' + track.file_path + '"')
-			row = query_result.fetchone()
-			play_count = row[0]
-			date_added = row[1]
-			cursor.execute("UPDATE songs SET path=?, artist=?, title=?, \
-				album=?, year=?, genre=?, track_number=?, total_tracks=?, \
-				disc_number=?, total_discs=?, album_artist=?, publisher=?, \
-				time=?, plays=?, comment=?, date_added=?, composer=?, bpm=?, \
-				date_modified=?, size=?, bit_rate=?, sample_rate=?, format=?, \
-				channels=? WHERE path = ?", (track.file_path, track.artist, 
-					track.title, track.album, 
-				 	track.year, track.genre, track.track_number, 
-				 	track.total_tracks, track.disc_number, track.total_discs, 
-				 	track.album_artist, track.publisher, track.time, play_count, 
-				 	track.comment, date_added, track.composer, track.bpm,
-				 	track.date_modified, track.size, track.bit_rate, 
-				 	track.sample_rate, track.format, track.channels,
-				 	track.file_path))
-		self.parent.update_table_row(track.file_path)
+		values = track_values(track, metadata.Metadata().get_fingerprint(
+			track.file_path))
+		self.database.execute(UPDATE_TRACK_QUERY,
+			values[1:] + (track.file_path,),
+			lambda cursor: self.rows_changed([track.file_path]))
 
 	def file_in_library(self, file_path):
-		connection = sqlite3.connect(DATABASE_NAME)
-		cursor = connection.cursor()
-		with connection:
-			query_result = cursor.execute(
-				'SELECT * FROM songs WHERE path = "' + file_path + '"')
+		""" Checks if the given file path is in the library.
+
+		Library.file_in_library(str) -> bool
+		"""
+		query_result = self.database.reader().execute(
+			'SELECT 1 FROM songs WHERE path = ? LIMIT 1', (file_path,))
 		if query_result.fetchone() == None:
 			return False
 		else:
 			return True
 
-	def add_files_to_library(self, file_paths):
+	def read_tracks(self, file_paths, task=None):
+		""" Reads the metadata of the given files, which can be a list or a
+		stream of files still being found, yielding the results of read_track
+		as they arrive and reporting progress to the task. If io ordered
+		ingest is on, the files are read in disk order, with readahead
+		requested just before each one is read, and if ingest thumbnails is
+		on, the thumbnails of their covers are made from the same parse and
+		added to the art cache. Metadata is read by a pool of worker
+		processes unless there are only a few files. Stops as soon as the
+		task is cancelled, without waiting for the files the pool is still
+		reading.
+
+		Library.read_tracks(iter(str), ScanTask) -> iter((str, tuple, tuple))
+		"""
+		if task is None:
+			task = ScanTask()
+		if isinstance(file_paths, (list, tuple, set)):
+			total = len(file_paths)
+		else:
+			total = 0 # A stream of files still being found
+		task.set_stage(self.localisation.ADDING_FILES_STRING, total)
+		if self.io_ordered_ingest:
+			file_paths = scanner.io_order(file_paths,
+				total or scanner.IO_ORDER_WINDOW)
+
+		if self.ingest_thumbnails:
+			reader = read_track_and_art
+			## Imported here so the workers, which import this module, never
+			## load Qt
+			import artcache
+			art_cache = artcache.ART_CACHE
+			song_count = self.database.reader().execute(
+				'SELECT COUNT(*) FROM Songs').fetchone()[0]
+			art_cache.set_index_size(song_count + total)
+		else:
+			reader = read_track
+		workers = self.get_ingest_workers()
+		if workers > 1 and (total == 0 or total >= PARALLEL_INGEST_THRESHOLD):
+			pool = multiprocessing.Pool(workers, init_ingest_worker,
+				(self.io_ordered_ingest,))
+			results = pool.imap_unordered(reader, file_paths,
+				ingest_chunk_size(total, workers))
+		else:
+			pool = None
+			init_ingest_worker(self.io_ordered_ingest)
+			results = itertools.imap(reader, file_paths)
+		try:
+			for result in results:
+				if task.is_cancelled():
+					break
+				file_path, values, failure = result[:3]
+				if len(result) > 3 and result[3] is not None:
+					try:
+						art_cache.add_cover(file_path, *result[3])
+					except Exception as e:
+						print "Couldn't make thumbnails for " + file_path + \
+							". " + type(e).__name__ + ': ' + unicode(e)
+				if values is None:
+					print file_path + " could not be added to the library. " +\
+					 failure[2] + ': ' + failure[3]
+				yield file_path, values, failure
+				task.advance()
+		finally:
+			if pool is not None:
+				if task.is_cancelled():
+					pool.terminate()
+				else:
+					pool.close()
+				pool.join()
+
+	def add_files_to_library(self, file_paths, task=None):
 		""" Adds the given file paths to the library. Returns a list of all
 		files that were successfully to be added to the library.
 
-		Library.add_files_to_library(list(str)) -> list(str)
+		Metadata is read by read_tracks, and the results are written to the
+		database in batches as they arrive. If the task is cancelled, the files
+		read so far are still written. Files that couldn't be read are added to
+		the task's failed_files and recorded in the failed_files table.
+
+		Library.add_files_to_library(iter(str), ScanTask) -> list(str)
 		"""
-		progress_dialog = self.parent.get_add_files_progress_dialog()
-		tracks_added = 0
-		progress_dialog.setValue(tracks_added)
-		progress_dialog.setLabelText(self.localisation.ADDING_FILES_STRING)
-		progress_dialog.setMaximum(len(file_paths))
+		if task is None:
+			task = ScanTask()
+		current_date = time.time()
+		successful_files = []
+		batch = []
+		batch_paths = []
+		failed_batch = []
+		for file_path, values, failure in self.read_tracks(file_paths, task):
+			if values is not None:
+				batch.append(values + (0, current_date))
+				batch_paths.append(file_path)
+				successful_files.append(file_path)
+			else:
+				failed_batch.append((file_path,) + failure)
+			if len(batch) + len(failed_batch) >= INGEST_BATCH_SIZE:
+				self.write_rows(INSERT_TRACK_QUERY, batch, batch_paths,
+					failed_batch, task)
+				batch = []
+				batch_paths = []
+				failed_batch = []
+		self.write_rows(INSERT_TRACK_QUERY, batch, batch_paths, failed_batch,
+			task)
+		self.database.flush()
+		return successful_files
+
+	def update_files_in_library(self, file_paths, task=None):
+		""" Reads the given files again and updates their rows in the library,
+		keeping their play counts and date added. Returns a list of all files
+		that were successfully updated. Files that can't be read any more keep
+		their old rows, and are recorded like failures in add_files_to_library.
 
-		connection = sqlite3.connect(DATABASE_NAME)
-		current_date = datetime.datetime.now()
+		Library.update_files_in_library(list(str), ScanTask) -> list(str)
+		"""
+		if task is None:
+			task = ScanTask()
 		successful_files = []
-		with connection:
-			cursor = connection.cursor()
-			for file_path in file_paths:
-				try:
-					track = metadata.Track(file_path)
-					cursor.execute("INSERT INTO Songs VALUES(?, ?, ?, ?, ?, ?,\
-					 ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-					 (track.file_path, track.artist, track.title, track.album, 
-					 	track.year, track.genre, track.track_number, 
-					 	track.total_tracks, track.disc_number,
-					 	track.total_discs, track.album_artist, track.publisher,
-					 	track.time, 0 , track.comment, current_date,
-					 	track.composer, track.bpm,
-					 	track.date_modified, track.size, track.bit_rate, 
-					 	track.sample_rate, track.format, track.channels))
-
-					successful_files.append(file_path)
-
-				except:					
-					print file_path + " could not be added to the library."
-				tracks_added += 1
-				progress_dialog.setValue(tracks_added)
+		batch = []
+		batch_paths = []
+		failed_batch = []
+		for file_path, values, failure in self.read_tracks(file_paths, task):
+			if values is not None:
+				batch.append(values[1:] + (file_path,))
+				batch_paths.append(file_path)
+				successful_files.append(file_path)
+			else:
+				failed_batch.append((file_path,) + failure)
+			if len(batch) + len(failed_batch) >= INGEST_BATCH_SIZE:
+				self.write_rows(UPDATE_TRACK_QUERY, batch, batch_paths,
+					failed_batch, task)
+				batch = []
+				batch_paths = []
+				failed_batch = []
+		self.write_rows(UPDATE_TRACK_QUERY, batch, batch_paths, failed_batch,
+			task)
+		self.database.flush()
 		return successful_files
 
+	def write_rows(self, query, rows, file_paths=(), failed_rows=(),
+		task=None):
+		""" Queues the given query to be run for each of the given rows in a
+		single transaction. Reading the next batch of files carries on while
+		they're written. file_paths are the files the rows are for, which are
+		taken off the failed_files table, and failed_rows are the files that
+		couldn't be read, which are put on it and reported to the task.
+
+		Library.write_rows(str, list(tuple), list(str), list(tuple), ScanTask)
+			-> None
+		"""
+		if task is not None:
+			task.failed_files += [(row[0], row[3] + ': ' + row[4]) for row in \
+				failed_rows]
+		## Files that have gone can't be recorded as they have no fingerprint
+		failed_rows = [row for row in failed_rows if row[1] is not None]
+		if not rows and not failed_rows:
+			return None
+		paths = [(file_path,) for file_path in file_paths]
+		def write(connection):
+			connection.executemany(query, rows)
+			connection.executemany(DELETE_FAILED_FILE_QUERY, paths)
+			connection.executemany(INSERT_FAILED_FILE_QUERY, failed_rows)
+		self.database.write(write)
+
+	def get_failed_fingerprints(self):
+		""" Returns a dictionary of every file in the failed_files table and
+		its (mtime, file_size) fingerprint when it failed to be read.
+
+		Library.get_failed_fingerprints() -> dict
+		"""
+		cursor = self.database.reader().execute(
+			'SELECT path, mtime, file_size FROM failed_files')
+		return dict((row[0], (row[1], row[2])) for row in cursor)
+
+	def remove_failed_files(self, file_paths):
+		""" Takes the given files off the failed_files table.
+
+		Library.remove_failed_files(list(str)) -> None
+		"""
+		if file_paths:
+			self.database.executemany(DELETE_FAILED_FILE_QUERY,
+				[(file_path,) for file_path in file_paths])
+
 	def remove_items(self, file_paths):
 		""" Remove the given files from the library.
 
 		Library.remove_items(list(str)) -> None
 		"""
-		connection = sqlite3.connect(DATABASE_NAME)
-		with connection:
-			cursor = connection.cursor()
-			for file_path in file_paths:
-				cursor.execute(
-					'DELETE FROM Songs WHERE path = "' + file_path + '"')
+		self.remove_songs('path', file_paths)
+
+	def remove_ids(self, ids):
+		""" Remove the songs with the given ids from the library.
+
+		Library.remove_ids(list(int)) -> None
+		"""
+		self.remove_songs('id', ids)
+
+	def remove_songs(self, column, values):
+		""" Queues the removal of the songs whose value in the given column is
+		one of the given values. The values are put in a temporary table so all
+		the songs are removed by a single DELETE in one transaction.
+
+		Library.remove_songs(str, list) -> None
+		"""
+		if not values:
+			return None
+		rows = [(value,) for value in values]
+		def remove(connection):
+			connection.execute('CREATE TEMP TABLE IF NOT EXISTS \
+				removed_songs(value PRIMARY KEY)')
+			connection.execute('DELETE FROM temp.removed_songs')
+			connection.executemany(
+				'INSERT OR IGNORE INTO temp.removed_songs VALUES (?)', rows)
+			connection.execute('DELETE FROM Songs WHERE ' + column + \
+				' IN (SELECT value FROM temp.removed_songs)')
+			connection.execute('DELETE FROM temp.removed_songs')
+		self.database.write(remove)
+
+	def close(self):
+		""" Closes the connections to the library database.
+
+		Library.close() -> None
+		"""
+		self.database.close()
+
+def benchmark(rows=BENCHMARK_ROWS):
+	""" Compares sorting the library by length and totalling its length and
+	size as it was done on the schema that stored them formatted, fetching
+	and parsing every row in Python, with doing it in SQLite on the numeric
+	columns. A temporary library of the given number of songs is made at
+	schema version 2 and migrated, and the time the migration takes is
+	printed as well.
+
+	benchmark(int) -> None
+	"""
+	directory = tempfile.mkdtemp()
+	try:
+		database_name = os.path.join(directory, 'library.db')
+		connection = sqlite3.connect(database_name)
+		for migration in LIBRARY_MIGRATIONS[:2]:
+			migration(connection)
+		songs = []
+		for i in range(rows):
+			length = 60 + i * 7 % 4000
+			## Formatted as the old format_time did, with total minutes
+			if length >= 3600:
+				length_text = '%02d:%d:%02d' % (length / 3600, length / 60,
+					length % 60)
+			else:
+				length_text = '%d:%02d' % (length / 60, length % 60)
+			songs.append(('/music/%06d.mp3' % i, u'Artist %d' % (i % 500),
+				u'Title %d' % i, u'Album %d' % (i % 5000), length_text,
+				'%.2f MB' % (length / 30.0), '2013-05-01 12:00:00',
+				time.ctime(1367409600 + i), '320 kbps', '44100'))
+		connection.executemany('INSERT INTO Songs(path, artist, title, album, \
+			time, size, date_added, date_modified, bit_rate, sample_rate, \
+			plays) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0)', songs)
+		connection.execute('PRAGMA user_version = 2')
+		connection.commit()
+
+		start = time.time()
+		songs = connection.execute('SELECT * FROM Songs').fetchall()
+		songs.sort(key=lambda row: parse_time(row[12]))
+		total_time = sum([parse_time(row[12]) for row in songs])
+		total_size = sum([parse_number(row[19]) for row in songs])
+		print 'Formatted, in Python: %.0f ms' % ((time.time() - start) * 1000)
+		connection.close()
+
+		manager = database.ConnectionManager(database_name)
+		start = time.time()
+		manager.migrate(LIBRARY_MIGRATIONS)
+		print 'Migration: %.0f ms' % ((time.time() - start) * 1000)
+		connection = manager.reader()
+		start = time.time()
+		songs = connection.execute('SELECT * FROM Songs ORDER BY time') \
+			.fetchall()
+		sorted_time = time.time() - start
+		start = time.time()
+		total_time, total_size = connection.execute('SELECT SUM(time), \
+			SUM(size) FROM Songs').fetchone()
+		print 'Numeric, in SQLite: %.0f ms sorting, %.0f ms totalling' % (
+			sorted_time * 1000, (time.time() - start) * 1000)
+		manager.close()
+	finally:
+		shutil.rmtree(directory)
+
 
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+	benchmark()
\ No newline at end of file
@@ -55,6 +55,7 @@ LYRICS_STRING = "Lyrics"
 #Prompts
 YES_STRING = "Yes"
 NO_STRING = "No"
+OK_STRING = "OK"
 APPLY_STRING = "Apply"
 CANCEL_STRING = "Cancel"
 
@@ -74,11 +75,20 @@ FILE_SEARCH_STRING = "Searching for audio files..."
 ADDING_FILES_STRING = "Adding songs to library..."
 REFRESH_LIBRARY_STRING = "Refreshing the library..."
 FILE_DOESNT_EXIST_STRING = 'File does not exist'
+SEARCH_STRING = "Search"
+BROKEN_FILES_TITLE_STRING = "Broken Files"
+BROKEN_FILES_STRING = "These files couldn't be read, so they weren't added to \
+the library:"
 
 #Preferences
 LANGUAGE_STRING = "Language"
 CHOOSE_DIRECTORY_STRING = "Choose a directory"
 DIRECTORIES_SEARCH_STRING = 'Directories to search for music in:'
+INGEST_WORKERS_STRING = "Processes used to read new files (0 = automatic):"
+IO_ORDERED_INGEST_STRING = "Read new files in disk order (faster on hard drives)"
+INGEST_THUMBNAILS_STRING = "Make album cover thumbnails while reading new files"
+WATCH_POLL_INTERVAL_STRING = "Seconds between checks for changed files \
+without inotify:"
 
 #Metadata editor
 
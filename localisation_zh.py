@@ -55,6 +55,7 @@ LYRICS_STRING = u"歌词"
 #Prompts
 YES_STRING = u"是"
 NO_STRING = u"不"
+OK_STRING = u"确定"
 APPLY_STRING = u"应用"
 CANCEL_STRING = u"取消"
 
@@ -73,11 +74,18 @@ FILE_SEARCH_STRING = u"Searching for audio files..."
 ADDING_FILES_STRING = "Adding songs to library..."
 REFRESH_LIBRARY_STRING = "Refreshing the library..."
 FILE_DOESNT_EXIST_STRING = 'File does not exist'
+SEARCH_STRING = u"搜索"
+BROKEN_FILES_TITLE_STRING = u"损坏的文件"
+BROKEN_FILES_STRING = u"无法读取以下文件, 所以它们没有被添加到音乐库:"
 
 #Preferences
 LANGUAGE_STRING = u"语言"
 CHOOSE_DIRECTORY_STRING = u"选择一首搜索"
 DIRECTORIES_SEARCH_STRING = u'目录搜索音乐:'
+INGEST_WORKERS_STRING = u"读取新文件的进程数 (0 = 自动):"
+IO_ORDERED_INGEST_STRING = u"按磁盘顺序读取新文件 (机械硬盘上更快)"
+INGEST_THUMBNAILS_STRING = u"读取新文件时生成专辑封面缩略图"
+WATCH_POLL_INTERVAL_STRING = u"没有 inotify 时检查文件变化的间隔秒数:"
 
 #Metadata editor
 
@@ -23,6 +23,8 @@ without express permission, with exclusion of commercial application.
 #Standard libraries
 import sys
 import os.path
+import collections
+import json
 
 #3rd party libraries
 import requests
@@ -31,12 +33,14 @@ from PySide import QtGui, QtCore, QtWebKit
 from PySide.phonon import Phonon
 
 #Beatbox libraries
+import artcache
 import metadata
 import phonon
 import player
 import playlist
 import library
 import preferences
+import watcher
 import localisation_en
 import localisation_zh
 
@@ -49,7 +53,7 @@ PLAYER_WINDOW_WIDTH = 320
 PLAYER_WINDOW_HEIGHT = 160
 PLAYER_ICON_SIZE = 32
 PLAYER_TEXT_SIZE = 12
-PLAYER_COVER_SIZE = 100
+PLAYER_COVER_SIZE = artcache.PLAYER_COVER_SIZE
 MARGIN_SIZE = 10
 ## IMAGE PATHS ##
 DEFAULT_ALBUM_COVER = os.path.abspath("images/cover.png")
@@ -77,8 +81,17 @@ TABLE_FONT_SIZE = 12
 SPLASH_TEXT_COLOUR = QtGui.QColor(255, 255, 255) #RGB
 BACKGROUND_COLOUR = QtGui.QColor(176, 224, 245) #RGB
 INVALID_FILE_FONT_COLOUR = QtGui.QColor(168, 168, 168) #RGB
+LIBRARY_FETCH_SIZE = 1000 # Rows added to the library view at a time
+LIBRARY_PAGE_SIZE = 200 # Rows read from the database at a time
+LIBRARY_CACHED_PAGES = 50 # Pages of rows kept in memory
+LIBRARY_MAX_REMOVED_RANGES = 100 # More are removed as one layout change
+SEARCH_DELAY = 250 # Milliseconds without typing before the library is searched
+LIBRARY_MIME_TYPE = 'application/x-beatbox-songs' # Songs dragged to a playlist
 ### ----------- ###
 
+## The album cover icons shared by every playlist item showing them
+ICON_REGISTRY = artcache.IconRegistry(DEFAULT_ALBUM_COVER)
+
 class MainGui(QtGui.QMainWindow):
     def __init__(self, splash):
         super(MainGui, self).__init__()
@@ -322,6 +335,9 @@ class BeatboxGui(QtGui.QWidget):
         self.tabview_gui.library_gui.localisation = self.localisation
         self.tabview_gui.library_gui.library_widget.localisation =\
          self.localisation
+        self.tabview_gui.library_gui.model.localisation = self.localisation
+        self.tabview_gui.library_gui.search_box.setPlaceholderText(
+            self.localisation.SEARCH_STRING)
 
         self.tabview_gui.tabview_widget.setTabText(
             0, self.localisation.LIBRARY_STRING)
@@ -367,10 +383,9 @@ class PlayerGui(QtGui.QWidget):
         player_layout.setRowMinimumHeight(2, PLAYER_COVER_SIZE/3)
 
         self.album_art = QtGui.QLabel(self)
-        pixel_map = QtGui.QPixmap(DEFAULT_ALBUM_COVER)
-        self.album_art.setPixmap(pixel_map.scaled(PLAYER_COVER_SIZE,\
-         PLAYER_COVER_SIZE, QtCore.Qt.KeepAspectRatio,\
-          QtCore.Qt.SmoothTransformation))
+        self.album_art.setPixmap(
+            ICON_REGISTRY.get_default_pixmap(PLAYER_COVER_SIZE))
+        self.album_art_path = None # The song whose cover is being loaded
         player_layout.addWidget(self.album_art, 0, 0, 3, 0)
 
         self.track_name = QtGui.QLabel("", self)
@@ -493,8 +508,7 @@ class PlayerGui(QtGui.QWidget):
                   self.parent.tabview_gui.lyrics_gui.setHtml)
                 
         else:
-            row = self.parent.tabview_gui.library_gui.get_library_row(file_path)
-            self.parent.tabview_gui.library_gui.set_row_unavailable(row)
+            self.parent.tabview_gui.library_gui.set_path_unavailable(file_path)
 
     def load_preferences(self):
         """ Gets the saved preferences for the Player (i.e. shuffle and repeat
@@ -518,16 +532,32 @@ class PlayerGui(QtGui.QWidget):
         for widget in player_widgets:
             widget.setFont(QtGui.QFont(font, text_size))
 
-    def set_album_art(self, image_bytes):
-        """Changes the image for the album_art widget to the given image.
+    def load_album_art(self, file_path):
+        """ Starts a thread to find and decode the album cover of the given
+        song, which calls set_album_art once it's ready.
+
+        PlayerGui.load_album_art(str) -> None
+        """
+        self.album_art_path = file_path
+        self.album_art_thread = PlayerCoverThread(file_path, self)
+        self.album_art_thread.thread_done.connect(
+            self.set_album_art, QtCore.Qt.QueuedConnection)
+        self.album_art_thread.start()
+
+    def set_album_art(self, file_path, image):
+        """Changes the image for the album_art widget to the given image,
+        already decoded at PLAYER_COVER_SIZE, or to the default image if it's
+        None. Ignored if another song has been loaded since.
 
-        PlayerGui.set_album_art(str) -> None
+        PlayerGui.set_album_art(str, QImage) -> None
         """
-        pixel_map = QtGui.QPixmap()
-        pixel_map.loadFromData(image_bytes)
-        self.album_art.setPixmap(pixel_map.scaled(PLAYER_COVER_SIZE,\
-         PLAYER_COVER_SIZE, QtCore.Qt.KeepAspectRatio,\
-          QtCore.Qt.SmoothTransformation))
+        if file_path != self.album_art_path:
+            return None
+        if image is None:
+            self.album_art.setPixmap(
+                ICON_REGISTRY.get_default_pixmap(PLAYER_COVER_SIZE))
+        else:
+            self.album_art.setPixmap(QtGui.QPixmap.fromImage(image))
 
     def set_artist_name(self, artist):
         """ Changes the text in artist_name.
@@ -701,20 +731,32 @@ class PlaylistGui(QtGui.QWidget):
             self.load_album_covers, QtCore.Qt.QueuedConnection)
         self.add_covers_thread.start()
 
-    def load_album_covers(self, items, images):
-        """ Receives a list of items and image bytes. Adds the images to each
-        item.
-
-        PlaylistGui.load_album_covers(list(PlaylistItem), list(str)) -> None
-        """
-        for index, item in enumerate(items):
-            image = images[index]
-            if image != '':
-                try:
-                    item.set_item_icon(image)
-                except:
-                    print 'Playlist item deleted.'
-        self.status_bar.set_left_message('')
+    def load_album_covers(self, items, cover_hashes, images):
+        """ Receives a list of items, the hash of each item's cover, and the
+        covers that weren't registered decoded at the icon size. Gives each
+        item the shared icon of its cover, made from its image if the cover is
+        new. Items whose cover was forgotten by the registry since the thread
+        checked it are sent back to the thread to be decoded.
+
+        PlaylistGui.load_album_covers(list(PlaylistItem), list(str),
+            dict(str: QImage)) -> None
+        """
+        forgotten_items = []
+        for item, cover_hash in zip(items, cover_hashes):
+            if cover_hash is None:
+                continue
+            icon = ICON_REGISTRY.get_icon(cover_hash, images.get(cover_hash))
+            if icon is None:
+                forgotten_items.append(item)
+                continue
+            try:
+                item.set_item_icon(icon)
+            except:
+                print 'Playlist item deleted.'
+        if forgotten_items:
+            self.get_album_covers(forgotten_items)
+        else:
+            self.status_bar.set_left_message('')
 
     def playlist_item_double_clicked(self, item):
         """ Called when a playlist item is double clicked. Gets the file path of
@@ -808,6 +850,9 @@ class TabviewGui(QtGui.QWidget):
         self.tabview_widget.setCurrentWidget(self.lyrics_gui)
 
 class LibraryGui(QtGui.QWidget):
+    ## Sent from the library database's writer thread
+    rows_changed = QtCore.Signal(object)
+
     def __init__(self, parent=None):
         super(LibraryGui, self).__init__(parent)
         self.parent = parent
@@ -817,8 +862,17 @@ class LibraryGui(QtGui.QWidget):
         self.library_columns = self.preferences.get_library_columns_pref()
         self.main_gui = self.parent.parent
         self.library = library.Library(self, self.library_columns)
+        self.rows_changed.connect(
+            self.update_table_rows, QtCore.Qt.QueuedConnection)
+        self.scan_thread = None
+        self.queued_tasks = collections.deque() # (function, args, callback)
+        self.library_task_running = False
+        self.progress_dialog = None
         self.create_library_window()
         self.set_library_status()
+        self.start_library_watcher()
+        if self.library.needs_scan():
+            self.scan_library()
 
     def create_library_window(self):
         """ Creates a QTableView widget within the parent LibraryGui widget and
@@ -828,40 +882,63 @@ class LibraryGui(QtGui.QWidget):
         LibraryGui.create_library_window() -> None
         """
         self.layout = QtGui.QVBoxLayout(self)
+        self.search_box = QtGui.QLineEdit(self)
+        self.search_box.setPlaceholderText(self.localisation.SEARCH_STRING)
+        self.search_box.textChanged.connect(self.search_text_changed)
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.search_library)
+        self.layout.addWidget(self.search_box)
         self.library_widget = LibraryTableView(self)
         self.library_widget.doubleClicked.connect(
             self.library_item_double_clicked)
-        self.model = QtGui.QStandardItemModel(self.library_widget)
+        self.model = LibraryTableModel(self.library, self.library_columns,
+            self.localisation, self.library_widget)
         self.library_widget.setModel(self.model)
         self.load_library()
         self.layout.addWidget(self.library_widget)
         self.layout.setContentsMargins(0,0,0,0)
 
     def load_library(self):
-        """ Gets a list of database rows from the Library class and for each
-        row creates a QStandardItem and inserts it into the LibraryGui's
-        QTableView.
+        """ Loads the songs from the Library class into the LibraryGui's
+        model. Rows are only read from the database when they're displayed.
 
         LibraryGui.load_library() -> None
         """
-        self.set_column_headers(self.library_columns)
-        library = self.library.get_library()
-        for track in library:
-            row = [self.create_table_item(unicode(tag)) for tag in track]
-            self.model.appendRow(row)
+        self.model.load()
         self.set_row_heights(TABLE_FONT_SIZE)
         self.set_visible_columns(self.library_columns)
 
     def refresh_library(self):
-        """ Removes the current library model and reloads the library. Used
-        when adding new directories to the library as it's faster than 
-        individually adding each new file.
+        """ Reloads the library. Used when adding new directories to the
+        library as it's faster than individually adding each new file.
 
         LibraryGui.refresh_library() -> None
         """
-        self.model = QtGui.QStandardItemModel(self.library_widget)
-        self.library_widget.setModel(self.model)
-        self.load_library()
+        self.model.load()
+
+    def search_text_changed(self, text):
+        """ Called when the text in the search box is changed. The search is
+        only run once typing has stopped for a moment.
+
+        LibraryGui.search_text_changed(str) -> None
+        """
+        self.search_timer.start()
+
+    def search_library(self):
+        """ Filters the library to the songs matching the text in the search
+        box. A single letter matches too much of the library to be useful, so
+        it's ignored.
+
+        LibraryGui.search_library() -> None
+        """
+        text = self.search_box.text().strip()
+        if len(text) == 1 and ord(text) < 128:
+            text = u''
+        if text != self.model.search_text:
+            self.model.set_search_text(text)
+            self.set_library_status()
 
     def check_library_status(self):
         """ Checks each item in the library to see if the file path exists. If
@@ -870,41 +947,183 @@ class LibraryGui(QtGui.QWidget):
 
         LibraryGui.check_library_status() -> None
         """
-        for row in range(self.model.rowCount()):
-            file_path =  self.model.item(
-                row, self.get_file_path_column()).text()
+        for file_path in self.library.get_library_files():
             if not os.path.exists(file_path):
-                self.set_row_unavailable(row)
-
-    def add_items(self, items):
-        """ Adds the given items to the library.
-
-        LibraryGui.add_items(list(list(str))) -> None
-        """
-        row_counter = 0
-        self.progress_dialog.setValue(row_counter)
-        self.progress_dialog.setMaximum(len(items))
-        self.progress_dialog.setLabelText(
-            self.localisation.REFRESH_LIBRARY_STRING)
-        for track in items:
-            row = [self.create_table_item(unicode(tag)) for tag in track]
-            self.model.appendRow(row)
-            row_counter += 1
-            self.progress_dialog.setValue(row_counter)
-        self.set_row_heights(TABLE_FONT_SIZE)
-        self.progress_dialog.reset()
+                self.set_path_unavailable(file_path)
 
-    def set_column_headers(self, columns):
-        """ Receives a dictionary containing the settings for libary columns. 
-        Sets the text of each column header in LibraryGui's QTableView according
-        to the names specified in the settings dictionary.
+    def add_items(self, file_paths):
+        """ Adds the given files, which have just been added to the library
+        database, to the library view.
 
-        LibraryGui.set_column_headers(dict) -> None
+        LibraryGui.add_items(list(str)) -> None
         """
-        for index, column in enumerate(columns):
-            item = QtGui.QStandardItem()
-            item.setText(column['Name'])
-            self.model.setHorizontalHeaderItem(index, item)
+        self.model.append_paths(file_paths)
+        self.set_library_status()
+
+    def add_files(self, file_paths):
+        """ Adds the given files to the library in the background, then adds
+        the ones that were read successfully to the library view.
+
+        LibraryGui.add_files(list(str)) -> None
+        """
+        self.start_library_task(self.library.add_files_to_library,
+            (file_paths,), self.add_items)
+
+    def scan_library(self):
+        """ Scans the library directories in the background and reloads the
+        library once the library database is up to date.
+
+        LibraryGui.scan_library() -> None
+        """
+        self.start_library_task(
+            self.library.update_library, (), self.library_scanned)
+
+    def library_scanned(self, file_paths):
+        """ Called when a scan of the library directories has finished or
+        been cancelled.
+
+        LibraryGui.library_scanned(list(str)) -> None
+        """
+        self.refresh_library()
+        self.set_library_status()
+
+    def start_library_task(self, function, args, callback):
+        """ Runs the given Library function on a LibraryScanThread, showing
+        its progress in a progress dialog that can cancel it. The function is
+        called with the given arguments and a ScanTask, and the callback is
+        called on the GUI thread with its result. If a task is already
+        running, this one is queued to run once it has finished, unless the
+        same task is already waiting.
+
+        LibraryGui.start_library_task(function, tuple, function) -> None
+        """
+        if self.library_task_running:
+            if (function, args, callback) not in self.queued_tasks:
+                self.queued_tasks.append((function, args, callback))
+            return None
+        task = library.ScanTask()
+        self.library_task_running = True
+        self.scan_thread = LibraryScanThread(function, args, task, self)
+        self.scan_thread.progress_changed.connect(
+            self.library_task_progress, QtCore.Qt.QueuedConnection)
+        self.scan_thread.task_done.connect(
+            self.library_task_done, QtCore.Qt.QueuedConnection)
+        self.scan_thread.task_done.connect(
+            callback, QtCore.Qt.QueuedConnection)
+        self.create_add_files_progress_dialog()
+        self.progress_dialog.canceled.connect(task.cancel)
+        self.scan_thread.start()
+
+    def cancel_library_task(self):
+        """ Cancels the running library task, if there is one, along with any
+        queued ones, and waits for it to stop. Only used when Beatbox is
+        closing, as the GUI is blocked while waiting; a scan that's cancelled
+        is resumed from its checkpoint the next time Beatbox starts.
+
+        LibraryGui.cancel_library_task() -> None
+        """
+        self.queued_tasks.clear()
+        if self.scan_thread is not None and self.scan_thread.isRunning():
+            self.scan_thread.task.cancel()
+            self.scan_thread.wait()
+
+    def library_task_progress(self, label, value, maximum):
+        """ Shows the progress of the running library task. A maximum of 0
+        means the number of steps isn't known, so the number done is shown
+        instead.
+
+        LibraryGui.library_task_progress(str, int, int) -> None
+        """
+        if self.progress_dialog is None or \
+            self.sender() is not self.scan_thread:
+            return None # Sent by a task that was cancelled
+        if maximum == 0:
+            label = label + ' (' + str(value) + ')'
+        self.progress_dialog.setLabelText(label)
+        self.progress_dialog.setMaximum(maximum)
+        self.progress_dialog.setValue(value)
+
+    def library_task_done(self, result):
+        """ Closes the progress dialog once a library task has stopped, lists
+        any files that couldn't be read, and starts the next queued task.
+
+        LibraryGui.library_task_done(object) -> None
+        """
+        if self.sender() is not self.scan_thread:
+            return None
+        self.library_task_running = False
+        if self.progress_dialog is not None:
+            self.progress_dialog.close()
+            self.progress_dialog = None
+        if self.scan_thread.task.failed_files:
+            self.show_broken_files(self.scan_thread.task.failed_files)
+        if self.queued_tasks:
+            self.start_library_task(*self.queued_tasks.popleft())
+
+    def show_broken_files(self, failed_files):
+        """ Opens a dialog listing the given files that couldn't be added to
+        the library and why.
+
+        LibraryGui.show_broken_files(list((str, str))) -> None
+        """
+        self.broken_files_dialog = QtGui.QDialog(self)
+        self.broken_files_dialog.setWindowTitle(
+            self.localisation.BROKEN_FILES_TITLE_STRING)
+        layout = QtGui.QVBoxLayout(self.broken_files_dialog)
+        label = QtGui.QLabel(
+            self.localisation.BROKEN_FILES_STRING, self.broken_files_dialog)
+        layout.addWidget(label)
+        files_list = QtGui.QListWidget(self.broken_files_dialog)
+        for file_path, error in failed_files:
+            item = QtGui.QListWidgetItem(file_path + '\n    ' + error)
+            item.setToolTip(error)
+            files_list.addItem(item)
+        layout.addWidget(files_list)
+        ok_button = QtGui.QPushButton(
+            self.localisation.OK_STRING, self.broken_files_dialog)
+        ok_button.clicked.connect(self.broken_files_dialog.accept)
+        layout.addWidget(ok_button)
+        self.broken_files_dialog.resize(600, 300)
+        self.broken_files_dialog.open()
+
+    def start_library_watcher(self):
+        """ Starts a thread that watches the library directories for changes
+        and sends them to library_files_changed in batches.
+
+        LibraryGui.start_library_watcher() -> None
+        """
+        self.library_watcher = watcher.DirectoryWatcher(
+            self.library.directories, poll_interval=
+            self.preferences.get_watch_poll_interval_pref())
+        self.library_watcher_thread = LibraryWatcherThread(
+            self.library_watcher, self.library, self)
+        self.library_watcher_thread.batch_ready.connect(
+            self.library_files_changed, QtCore.Qt.QueuedConnection)
+        self.library_watcher.start()
+        self.library_watcher_thread.start()
+
+    def stop_library_watcher(self):
+        """ Stops watching the library directories.
+
+        LibraryGui.stop_library_watcher() -> None
+        """
+        self.library_watcher.stop()
+        self.library_watcher_thread.wait()
+
+    def library_files_changed(self, added, changed, removed):
+        """ Called with the files the library watcher has added, changed,
+        and removed in the library database. Updates only the affected rows of
+        the table.
+
+        LibraryGui.library_files_changed(list(str), list(str), list(str))
+            -> None
+        """
+        if removed:
+            self.model.remove_deleted_rows()
+        for file_path in changed:
+            self.update_table_row(file_path)
+        self.model.append_paths(added)
+        self.set_library_status()
 
     def set_visible_columns(self, columns):
         """ Receives a dictionary containing the settings for libary columns. 
@@ -923,26 +1142,21 @@ class LibraryGui(QtGui.QWidget):
 
         LibraryGui.get_library_row(str) -> int
         """
-        item = self.model.findItems(
-            file_path, column=self.get_file_path_column())
-        return item[0].row()
+        return self.model.find_row(file_path)
 
     def get_file_path(self, row):
         """ Returns the file_path of the item in the given row.
 
         LibraryGui.get_file_path(int) -> str
         """
-        return self.model.item(row, self.get_file_path_column()).text()
+        return self.model.get_file_path(row)
 
     def set_row_unavailable(self, row):
         """ Disables the given row.
 
         LibraryGui.set_row_unavailable(int) -> None
         """
-        for i in range(self.model.columnCount()):
-            item = self.model.item(row, i)
-            item.setToolTip(self.localisation.FILE_DOESNT_EXIST_STRING)
-            item.setForeground(QtGui.QBrush(INVALID_FILE_FONT_COLOUR))
+        self.model.set_path_unavailable(self.model.get_file_path(row))
 
     def set_path_unavailable(self, file_path):
         """ Finds a path in the library and sets it as unavailable. This is
@@ -950,8 +1164,7 @@ class LibraryGui(QtGui.QWidget):
 
         LibraryGui.set_path_unavailable(str) -> None
         """
-        row = self.get_library_row(file_path)
-        self.set_row_unavailable(row)
+        self.model.set_path_unavailable(file_path)
 
     def library_item_double_clicked(self, item):
         """ Called when a library item is double clicked. Gets the file path
@@ -964,44 +1177,30 @@ class LibraryGui(QtGui.QWidget):
         self.main_gui.player_gui.load_song(file_path)
         self.main_gui.player_gui.player.play_song()
 
-    def create_table_item(self, text):
-        """ Creates a QStandardItem from the text given and applies settings.
+    def update_table_row(self, file_path):
+        """ Updates a table row. The row for the given file_path is read from
+        the library database again and redrawn.
 
-        LibraryGui.create_table_item(str) -> QStandardItem
+        LibraryGui.update_table_row(str) -> None
         """
-        table_item = QtGui.QStandardItem()
-        table_item.setDragEnabled(True)
-        table_item.setEditable(False)
-        table_item.setText(text)
-        table_item.setFont(QtGui.QFont(TABLE_FONT, TABLE_FONT_SIZE))
-        return table_item
+        self.model.update_path(file_path)
 
-    def update_table_row(self, file_path):
-        """ Updates a table row. Get the metadata for the given file_path and
-        uses it to create a new table row. The old table row is located in the
-        QTableView and replaced with the new one.
+    def update_table_rows(self, file_paths):
+        """ Updates the table rows of the given file paths. Called when the
+        library database has written changes to them.
 
-        LibraryGui.update_table_row(str) -> None
+        LibraryGui.update_table_rows(list(str)) -> None
         """
-        updated_item_data = self.library.get_item_data(file_path)
-        new_row = \
-        [self.create_table_item(unicode(tag)) for tag in updated_item_data]
-        index = self.model.findItems(
-            file_path, column=self.get_file_path_column())[0]
-        row_position = index.row()
-        self.model.removeRow(row_position)
-        self.model.insertRow(row_position, new_row)
-        self.set_row_heights(TABLE_FONT_SIZE)
+        for file_path in file_paths:
+            self.update_table_row(file_path)
 
     def set_row_heights(self, size):
         """ Sets the height of all rows in the QTableView to the given size.
 
         LibraryGui.set_row_heights(int) -> None
         """
-        row = 0
-        while row < self.model.rowCount():
-            self.library_widget.setRowHeight(row, size * 1.8)
-            row += 1
+        self.library_widget.verticalHeader().setDefaultSectionSize(
+            int(size * 1.8))
 
     def remove_items(self):
         """ Called when a library item had been deleted (and confirmed via 
@@ -1010,14 +1209,10 @@ class LibraryGui(QtGui.QWidget):
 
         LibraryGui.remove_items() -> None
         """
-        rows = self.selected_rows()
-        file_paths = [self.model.item(
-            row.row(), self.get_file_path_column()).text() for row in rows]
-        rows.sort()
-        rows.reverse()
-        for row in rows:
-            self.model.removeRow(row.row())
-        self.library.remove_items(file_paths)
+        rows = [index.row() for index in self.selected_rows()]
+        ids = self.model.get_ids(rows)
+        self.model.remove_rows(rows)
+        self.library.remove_ids(ids)
         self.delete_prompt.accept()
 
     def selected_rows(self):
@@ -1060,7 +1255,7 @@ class LibraryGui(QtGui.QWidget):
 
         LibraryGui.get_library_size() -> int
         """
-        return self.model.rowCount()
+        return self.model.get_library_size()
 
     def get_number_of_selected_items(self):
         """ Returns the number of selected rows in the library.
@@ -1106,22 +1301,20 @@ class LibraryGui(QtGui.QWidget):
 
     def create_add_files_progress_dialog(self):
         """ Creates a progress dialog object to be used while loading tracks
-        into the library.
+        into the library. The dialog isn't modal, so Beatbox can still be used
+        while the library is loading, and its cancel button stops the load.
 
         LibraryGui.create_add_files_progress_dialog() -> None
         """
+        if self.progress_dialog is not None:
+            self.progress_dialog.close()
         self.progress_dialog = QtGui.QProgressDialog(
-            self.localisation.FILE_SEARCH_STRING, "", 0, 0)
-        self.progress_dialog.setCancelButton(None)
-        self.progress_dialog.setWindowModality(QtCore.Qt.WindowModal)
+            self.localisation.FILE_SEARCH_STRING,
+            self.localisation.CANCEL_STRING, 0, 0, self)
+        self.progress_dialog.setWindowModality(QtCore.Qt.NonModal)
         self.progress_dialog.setAutoReset(False)
-
-    def get_add_files_progress_dialog(self):
-        """ Gets the progress dialog object.
-
-        LibraryGui.get_add_files_progress_dialog() -> QProgressDialog
-        """
-        return self.progress_dialog
+        self.progress_dialog.setAutoClose(False)
+        self.progress_dialog.show()
 
     def keyPressEvent(self, event):
         """ Called when a key is pressed while the LibraryGui is the view being
@@ -1783,53 +1976,30 @@ class PlaylistListView(QtGui.QListView):
                             playlist_item.get_file_path(), drop_index)
                         drop_index +=1
 
-        else:
-            row = 0
-            model = QtGui.QStandardItemModel()
-            model.dropMimeData(event.mimeData(), QtCore.Qt.CopyAction,
-             0, 0, QtCore.QModelIndex())
-            # -1 is returned if the playlist is empty 
-            # or the drop is below all the other items
-            if drop_index == -1: 
-                while row < model.rowCount():
-                    file_path = model.item(row, self.main.tabview_gui.\
-                        library_gui.get_file_path_column()).text()
-                    if os.path.exists(file_path):
-                        title = model.item(row, self.main.tabview_gui.\
-                            library_gui.get_title_column()).text()
-                        artist = model.item(row, self.main.tabview_gui.\
-                            library_gui.get_artist_column()).text()
-                        playlist_item = self.create_playlist_item(
-                            file_path, title, artist)
-                        new_items.append(playlist_item)
-                        self.parent.playlist_model.appendRow(playlist_item)
-                        self.playlist.append_to_playlist(
-                            playlist_item.get_file_path())
-                    else:
-                        self.main.tabview_gui.library_gui.set_path_unavailable(
-                            file_path)
-                    row += 1
-            else:
-                while row < model.rowCount():
-                    file_path = model.item(row, self.main.tabview_gui.\
-                        library_gui.get_file_path_column()).text()
-                    if os.path.exists(file_path):
-                        title = model.item(row, self.main.tabview_gui.\
-                            library_gui.get_title_column()).text()
-                        artist = model.item(row, self.main.tabview_gui.\
-                            library_gui.get_artist_column()).text()
-                        playlist_item = self.create_playlist_item(
-                            file_path, title, artist)
-                        new_items.append(playlist_item)
-                        self.parent.playlist_model.insertRow(
-                            drop_index, playlist_item)
-                        self.playlist.insert_in_playlist(
-                            playlist_item.get_file_path(), drop_index)
-                        drop_index += 1
-                    else:
-                        self.main.tabview_gui.library_gui.set_path_unavailable(
-                            file_path)
-                    row += 1
+        elif event.mimeData().hasFormat(LIBRARY_MIME_TYPE):
+            ## Songs from the library, encoded by LibraryTableModel.mimeData
+            songs = json.loads(
+                event.mimeData().data(LIBRARY_MIME_TYPE).data())
+            for file_path, title, artist in songs:
+                if not os.path.exists(file_path):
+                    self.main.tabview_gui.library_gui.set_path_unavailable(
+                        file_path)
+                    continue
+                playlist_item = self.create_playlist_item(
+                    file_path, title, artist)
+                new_items.append(playlist_item)
+                # -1 is returned if the playlist is empty 
+                # or the drop is below all the other items
+                if drop_index == -1:
+                    self.parent.playlist_model.appendRow(playlist_item)
+                    self.playlist.append_to_playlist(
+                        playlist_item.get_file_path())
+                else:
+                    self.parent.playlist_model.insertRow(
+                        drop_index, playlist_item)
+                    self.playlist.insert_in_playlist(
+                        playlist_item.get_file_path(), drop_index)
+                    drop_index += 1
         self.parent.get_album_covers(new_items)
 
     def dragEnterEvent(self, event):
@@ -1879,14 +2049,20 @@ class PlaylistListView(QtGui.QListView):
     def create_playlist_item(self, file_path, title = None, artist = None):
         """ Creates a new PlaylistItem with the file_path argument. If the 
         artist and title arguments are empty the metadata is taken from the file
-        and then applied to the new PlaylistItem to display.
+        and then applied to the new PlaylistItem to display. Songs in the
+        library are taken from the library database rather than the file.
 
         PlaylistListView.create_playlist_item(str, str, str) -> PlaylistItem
         """
 
         playlist_item = PlaylistItem(file_path)
         if title == None or artist == None:
-            artist, title = self.metadata.get_playlist_metadata(file_path)
+            track = self.main.tabview_gui.library_gui.library.get_track(
+                file_path)
+            if track is None:
+                artist, title = self.metadata.get_playlist_metadata(file_path)
+            else:
+                artist, title = track.artist, track.title
         playlist_item.set_item_metadata(title, artist)
         return playlist_item
 
@@ -1910,7 +2086,7 @@ class PlaylistItemCoverThread(QtCore.QThread):
     fetched.
     """
     ## This only works if created here.
-    thread_done = QtCore.Signal(object, object)
+    thread_done = QtCore.Signal(object, object, object)
 
     def __init__(self, items, parent=None):
         super(PlaylistItemCoverThread, self).__init__(parent)
@@ -1919,18 +2095,112 @@ class PlaylistItemCoverThread(QtCore.QThread):
 
     def run(self):
         """ Goes through all items added to the playlist and gets their
-        album covers. The data for the images are added to a list which is then 
-        sent back to the class that started the thread. Returns None to 
-        close thread.
+        album covers. The hash of each item's cover is added to a list. Covers
+        the icon registry already has aren't decoded, and the rest are decoded
+        once, however many items share them, and sent ready to paint back to
+        the class that started the thread. Returns None to close thread.
 
         PlaylistItemCoverThread.run() -> None
         """
-        images = []
+        cover_hashes = []
+        images = {}
+        registered = set()
         for item in self.items:
-            image = self.metadata.get_album_cover(item.get_file_path())
-            image_bytes = QtCore.QByteArray(image)
-            images.append(image_bytes)
-        self.thread_done.emit(self.items, images)
+            cover_hash, image = artcache.ART_CACHE.get_cover(
+                item.get_file_path(), artcache.PLAYLIST_ICON_SIZE)
+            if cover_hash is None or cover_hash in registered:
+                pass
+            elif ICON_REGISTRY.has_icon(cover_hash):
+                registered.add(cover_hash)
+            elif cover_hash not in images:
+                images[cover_hash] = artcache.decode_image(image,
+                    artcache.PLAYLIST_ICON_SIZE)
+            if cover_hash not in registered and \
+                images.get(cover_hash) is None:
+                cover_hash = None
+            cover_hashes.append(cover_hash)
+        self.thread_done.emit(self.items, cover_hashes, images)
+        return None
+
+class PlayerCoverThread(QtCore.QThread):
+    """This is a thread in which the album cover of the song loaded in the
+    player is found and decoded, so the GUI only has to paint it.
+    """
+    thread_done = QtCore.Signal(object, object)
+
+    def __init__(self, file_path, parent=None):
+        super(PlayerCoverThread, self).__init__(parent)
+        self.file_path = file_path
+
+    def run(self):
+        """ Gets the song's album cover from the art cache and decodes it, then
+        sends it back with the song's path. None is sent if the song has no
+        cover. Returns None to close thread.
+
+        PlayerCoverThread.run() -> None
+        """
+        thumbnail = artcache.ART_CACHE.get_thumbnail(self.file_path,
+            PLAYER_COVER_SIZE)
+        image = None
+        if thumbnail is not None:
+            image = artcache.decode_image(thumbnail, PLAYER_COVER_SIZE)
+        self.thread_done.emit(self.file_path, image)
+        return None
+
+class LibraryWatcherThread(QtCore.QThread):
+    """This is a thread that waits for batches of changes from a
+    DirectoryWatcher, applies them to the library database, and sends the
+    files added, changed, and removed to the GUI thread.
+    """
+    batch_ready = QtCore.Signal(object, object, object)
+
+    def __init__(self, directory_watcher, library, parent=None):
+        super(LibraryWatcherThread, self).__init__(parent)
+        self.directory_watcher = directory_watcher
+        self.library = library
+
+    def run(self):
+        """ Syncs each batch of changes until the watcher is stopped. Returns
+        None to close thread.
+
+        LibraryWatcherThread.run() -> None
+        """
+        while True:
+            batch = self.directory_watcher.wait_for_batch()
+            if batch is None:
+                return None
+            added, changed, removed = self.library.sync_files(
+                batch[0], batch[1])
+            self.batch_ready.emit(added, changed, removed)
+
+class LibraryScanThread(QtCore.QThread):
+    """This is a thread that runs a scan or ingest of the library, so the GUI
+    stays responsive while it runs. Progress from the ScanTask is sent to the
+    GUI thread, and the function's result is sent once it's finished or been
+    cancelled.
+    """
+    progress_changed = QtCore.Signal(object, object, object)
+    task_done = QtCore.Signal(object)
+
+    def __init__(self, function, args, task, parent=None):
+        super(LibraryScanThread, self).__init__(parent)
+        self.function = function
+        self.args = args
+        self.task = task
+        self.task.callback = self.progress_changed.emit
+
+    def run(self):
+        """ Runs the function with the task. Returns None to close thread.
+
+        LibraryScanThread.run() -> None
+        """
+        try:
+            result = self.function(*self.args, task=self.task)
+        except Exception as e:
+            print "Library scan failed. " + type(e).__name__ + ': ' + \
+                unicode(e)
+            result = []
+        self.task_done.emit(result)
         return None
 
 class PlaylistItem(QtGui.QStandardItem):
@@ -1957,18 +2227,15 @@ class PlaylistItem(QtGui.QStandardItem):
         self.artist = artist
         self.title = title
         self.setText(title + '\n' + artist)
-        album_art = QtGui.QPixmap(DEFAULT_ALBUM_COVER)
-        self.setIcon(album_art)
+        self.setIcon(ICON_REGISTRY.get_default_icon())
         self.setSizeHint(QtCore.QSize(290, 60))
 
-    def set_item_icon(self, image_bytes):
+    def set_item_icon(self, icon):
         """ Changes the icon (i.e. album cover) of the PlaylistItem.
 
-        PlaylistItem.set_item_icon(str) -> None
+        PlaylistItem.set_item_icon(QIcon) -> None
         """
-        pixel_map = QtGui.QPixmap()
-        pixel_map.loadFromData(image_bytes)
-        self.setIcon(pixel_map)
+        self.setIcon(icon)
 
     def get_file_path(self):
         """ Gets the file_path associated with the PlaylistItem.
@@ -1997,6 +2264,376 @@ class PlaylistItemModel(QtGui.QStandardItemModel):
         playlist_item = self.item(row)
         return playlist_item.get_file_path()
 
+class LibraryTableModel(QtCore.QAbstractTableModel):
+    """ This is a subclass of Pyside’s QAbstractTableModel class. It holds
+    only the ids of the songs in the library, in display order. Rows are
+    read from the library database a page at a time when they are first
+    displayed, and a limited number of pages are kept in memory. Rows are
+    added to the view in blocks as it's scrolled with fetchMore.
+    """
+
+    def __init__(self, library, columns, localisation, parent=None):
+        super(LibraryTableModel, self).__init__(parent)
+        self.library = library
+        self.columns = columns
+        self.localisation = localisation
+        self.font = QtGui.QFont(TABLE_FONT, TABLE_FONT_SIZE)
+        self.unavailable_brush = QtGui.QBrush(INVALID_FILE_FONT_COLOUR)
+        self.unavailable_paths = set()
+        self.file_path_column = [c['Column'] for c in columns
+            if c['Name'] == 'File Path'][0]
+        self.title_column = [c['Column'] for c in columns
+            if c['Name'] == 'Title'][0]
+        self.artist_column = [c['Column'] for c in columns
+            if c['Name'] == 'Artist'][0]
+        self.ids = []
+        self.id_rows = None # song id: row, built from ids when first needed
+        self.fetched_rows = 0
+        self.pages = collections.OrderedDict()
+        self.sort_column = None
+        self.sort_order = QtCore.Qt.AscendingOrder
+        self.search_text = u''
+
+    def load(self):
+        """ Gets the ids of all songs from the library in the current sort
+        order and resets the model.
+
+        LibraryTableModel.load() -> None
+        """
+        self.beginResetModel()
+        self.ids = self.get_sorted_ids()
+        self.id_rows = None
+        self.fetched_rows = min(len(self.ids), LIBRARY_FETCH_SIZE)
+        self.pages.clear()
+        self.endResetModel()
+
+    def get_sorted_ids(self):
+        """ Returns the ids of all songs in the library that match the search
+        text, in the current sort order.
+
+        LibraryTableModel.get_sorted_ids() -> list(int)
+        """
+        if self.sort_column is None:
+            order_by = None
+        else:
+            order_by = self.columns[self.sort_column]['Database Name']
+        descending = self.sort_order == QtCore.Qt.DescendingOrder
+        if self.search_text:
+            return self.library.search(self.search_text, order_by, descending)
+        return self.library.get_library_ids(order_by, descending)
+
+    def set_search_text(self, text):
+        """ Filters the model to the songs matching the given text.
+
+        LibraryTableModel.set_search_text(unicode) -> None
+        """
+        self.search_text = text
+        self.load()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.fetched_rows
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.columns)
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return False
+        return self.fetched_rows < len(self.ids)
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        """ Called by the view when it's scrolled to the last row. Adds the
+        next block of rows to the view.
+
+        LibraryTableModel.fetchMore(QModelIndex) -> None
+        """
+        if parent.isValid():
+            return None
+        count = min(LIBRARY_FETCH_SIZE, len(self.ids) - self.fetched_rows)
+        if count > 0:
+            self.beginInsertRows(QtCore.QModelIndex(), self.fetched_rows,
+                self.fetched_rows + count - 1)
+            self.fetched_rows += count
+            self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.fetched_rows:
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            return self.get_row(index.row())[index.column()]
+        elif role == QtCore.Qt.FontRole:
+            return self.font
+        elif role == QtCore.Qt.ForegroundRole:
+            if self.is_row_unavailable(index.row()):
+                return self.unavailable_brush
+        elif role == QtCore.Qt.ToolTipRole:
+            if self.is_row_unavailable(index.row()):
+                return self.localisation.FILE_DOESNT_EXIST_STRING
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if orientation == QtCore.Qt.Horizontal and \
+        role == QtCore.Qt.DisplayRole:
+            return self.columns[section]['Name']
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable | \
+            QtCore.Qt.ItemIsDragEnabled
+
+    def mimeTypes(self):
+        return [LIBRARY_MIME_TYPE]
+
+    def mimeData(self, indexes):
+        """ Called when rows are dragged. Encodes the file path, title, and
+        artist of each of the rows of the given indexes, in order, as a JSON
+        list under LIBRARY_MIME_TYPE, along with the files' urls.
+
+        LibraryTableModel.mimeData(list(QModelIndex)) -> QMimeData
+        """
+        songs = []
+        for row in sorted(set([index.row() for index in indexes])):
+            values = self.get_row(row)
+            songs.append((values[self.file_path_column],
+                values[self.title_column], values[self.artist_column]))
+        data = QtCore.QMimeData()
+        data.setData(LIBRARY_MIME_TYPE, json.dumps(songs))
+        data.setUrls([QtCore.QUrl.fromLocalFile(song[0]) for song in songs])
+        return data
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        """ Called by the view when a column header is clicked. The library
+        database does the sorting, and selected rows stay selected.
+
+        LibraryTableModel.sort(int, Qt.SortOrder) -> None
+        """
+        self.sort_column = column
+        self.sort_order = order
+        self.layoutAboutToBeChanged.emit()
+        old_indexes = self.persistentIndexList()
+        old_ids = [self.ids[index.row()] for index in old_indexes]
+        self.ids = self.get_sorted_ids()
+        self.id_rows = None
+        self.pages.clear()
+        new_indexes = []
+        for index, song_id in zip(old_indexes, old_ids):
+            row = self.get_id_rows().get(song_id)
+            if row is None or row >= self.fetched_rows:
+                new_indexes.append(QtCore.QModelIndex())
+            else:
+                new_indexes.append(self.index(row, index.column()))
+        self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
+
+    def get_row(self, row):
+        """ Returns the display text of the given row, reading its page from
+        the library database if it isn't cached.
+
+        LibraryTableModel.get_row(int) -> list(unicode)
+        """
+        page_number = row // LIBRARY_PAGE_SIZE
+        page = self.pages.pop(page_number, None)
+        if page is None:
+            page = self.load_page(page_number)
+        self.pages[page_number] = page # Most recently used pages are last
+        while len(self.pages) > LIBRARY_CACHED_PAGES:
+            self.pages.popitem(last=False)
+        return page[row - page_number * LIBRARY_PAGE_SIZE]
+
+    def load_page(self, page_number):
+        """ Reads a page of rows from the library database and formats them
+        for display.
+
+        LibraryTableModel.load_page(int) -> list(list(unicode))
+        """
+        start = page_number * LIBRARY_PAGE_SIZE
+        ids = self.ids[start:start + LIBRARY_PAGE_SIZE]
+        rows = self.library.get_rows(ids)
+        empty_row = [u''] * len(self.columns)
+        return [self.library.format_row(rows[song_id]) if song_id in rows
+            else empty_row for song_id in ids]
+
+    def get_file_path(self, row):
+        """ Returns the file path of the song in the given row.
+
+        LibraryTableModel.get_file_path(int) -> str
+        """
+        return self.get_row(row)[self.file_path_column]
+
+    def find_row(self, file_path):
+        """ Returns the row of the given file path, or None if it isn't in
+        the model.
+
+        LibraryTableModel.find_row(str) -> int
+        """
+        return self.get_id_rows().get(self.library.get_item_id(file_path))
+
+    def get_id_rows(self):
+        """ Returns the row of each song id in the model, building it from the
+        ids if they've changed since it was last needed.
+
+        LibraryTableModel.get_id_rows() -> dict(int: int)
+        """
+        if self.id_rows is None:
+            self.id_rows = dict((song_id, row) for row, song_id in
+                enumerate(self.ids))
+        return self.id_rows
+
+    def is_row_unavailable(self, row):
+        """ Checks if the file of the given row has been found to be missing.
+
+        LibraryTableModel.is_row_unavailable(int) -> bool
+        """
+        return bool(self.unavailable_paths) and \
+            self.get_file_path(row) in self.unavailable_paths
+
+    def set_path_unavailable(self, file_path):
+        """ Marks the given file path as missing so its row is greyed out.
+
+        LibraryTableModel.set_path_unavailable(str) -> None
+        """
+        self.unavailable_paths.add(file_path)
+        row = self.find_row(file_path)
+        if row is not None and row < self.fetched_rows:
+            self.row_changed(row)
+
+    def row_changed(self, row):
+        """ Tells the view that the given row needs to be drawn again.
+
+        LibraryTableModel.row_changed(int) -> None
+        """
+        self.dataChanged.emit(self.index(row, 0),
+            self.index(row, len(self.columns) - 1))
+
+    def update_path(self, file_path):
+        """ Reads the row of the given file path from the library database
+        again.
+
+        LibraryTableModel.update_path(str) -> None
+        """
+        self.unavailable_paths.discard(file_path)
+        row = self.find_row(file_path)
+        if row is not None:
+            self.pages.pop(row // LIBRARY_PAGE_SIZE, None)
+            if row < self.fetched_rows:
+                self.row_changed(row)
+
+    def append_paths(self, file_paths):
+        """ Adds rows for the given file paths, which have just been added
+        to the library database, to the end of the model.
+
+        LibraryTableModel.append_paths(list(str)) -> None
+        """
+        if self.search_text:
+            return self.load() # The new songs might not match the search
+        ids = [self.library.get_item_id(file_path) for file_path in file_paths]
+        ids = [song_id for song_id in ids if song_id is not None]
+        if not ids:
+            return None
+        if self.id_rows is not None:
+            for row, song_id in enumerate(ids, len(self.ids)):
+                self.id_rows[song_id] = row
+        if self.fetched_rows < len(self.ids):
+            self.ids.extend(ids) # Not in the view yet so fetchMore adds them
+        else:
+            self.beginInsertRows(QtCore.QModelIndex(), len(self.ids),
+                len(self.ids) + len(ids) - 1)
+            self.ids.extend(ids)
+            self.fetched_rows = len(self.ids)
+            self.endInsertRows()
+        self.pages.pop((len(self.ids) - len(ids)) // LIBRARY_PAGE_SIZE, None)
+
+    def remove_rows(self, rows):
+        """ Removes the given rows from the model. Runs of consecutive rows
+        are removed from the view together, and if the rows are too scattered
+        for that to be quick they're all removed in one layout change.
+
+        LibraryTableModel.remove_rows(list(int)) -> None
+        """
+        rows = set(rows)
+        self.id_rows = None # Rows after the removed ones move up
+        unfetched = [row for row in rows if row >= self.fetched_rows]
+        if unfetched:
+            ## Not in the view yet, so these don't need to be signalled
+            self.ids = self.ids[:self.fetched_rows] + [song_id for row,
+                song_id in enumerate(self.ids) if row >= self.fetched_rows
+                and row not in rows]
+        ranges = []
+        for row in sorted(rows - set(unfetched), reverse=True):
+            if ranges and ranges[-1][0] == row + 1:
+                ranges[-1][0] = row
+            else:
+                ranges.append([row, row])
+        if len(ranges) > LIBRARY_MAX_REMOVED_RANGES:
+            self.remove_scattered_rows(rows - set(unfetched))
+        else:
+            for first, last in ranges: # Last first so rows don't move
+                self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+                del self.ids[first:last + 1]
+                self.fetched_rows -= last - first + 1
+                self.endRemoveRows()
+        self.pages.clear()
+
+    def remove_scattered_rows(self, rows):
+        """ Removes the given rows from the model in a single layout change,
+        keeping the selection of the rows that are left.
+
+        LibraryTableModel.remove_scattered_rows(set(int)) -> None
+        """
+        self.layoutAboutToBeChanged.emit()
+        new_rows = []
+        new_row = 0
+        for row in range(self.fetched_rows):
+            if row in rows:
+                new_rows.append(None)
+            else:
+                new_rows.append(new_row)
+                new_row += 1
+        old_indexes = self.persistentIndexList()
+        new_indexes = []
+        for index in old_indexes:
+            row = new_rows[index.row()]
+            if row is None:
+                new_indexes.append(QtCore.QModelIndex())
+            else:
+                new_indexes.append(self.index(row, index.column()))
+        self.ids = [song_id for row, song_id in enumerate(self.ids)
+            if row not in rows]
+        self.fetched_rows = new_row
+        self.changePersistentIndexList(old_indexes, new_indexes)
+        self.layoutChanged.emit()
+
+    def get_ids(self, rows):
+        """ Returns the song ids of the given rows.
+
+        LibraryTableModel.get_ids(list(int)) -> list(int)
+        """
+        return [self.ids[row] for row in rows]
+
+    def remove_deleted_rows(self):
+        """ Removes the rows of any songs that are no longer in the library
+        database.
+
+        LibraryTableModel.remove_deleted_rows() -> None
+        """
+        library_ids = set(self.library.get_library_ids())
+        self.remove_rows([row for row, song_id in enumerate(self.ids)
+            if song_id not in library_ids])
+
+    def get_library_size(self):
+        """ Returns the number of songs in the model, including those that
+        haven't been fetched by the view yet.
+
+        LibraryTableModel.get_library_size() -> int
+        """
+        return len(self.ids)
+
 class LibraryTableView(QtGui.QTableView):
     """ This is a subclass of Pyside’s QTableView class. The ways in which 
     items are dragged, dropped, and selected have been reimplemented.
@@ -2038,11 +2675,12 @@ class LibraryTableView(QtGui.QTableView):
         """
 
         rows = self.selectionModel().selectedRows()
+        columns = (self.parent.get_file_path_column(),
+            self.parent.get_title_column(), self.parent.get_artist_column())
         indexes = []
         for row in rows:
-            indexes.append(self.model().index(row.row(), 0))
-            indexes.append(self.model().index(row.row(), 1))
-            indexes.append(self.model().index(row.row(), 11))
+            for column in columns:
+                indexes.append(self.model().index(row.row(), column))
         data = self.model().mimeData(indexes)
         drag = QtGui.QDrag(self)
         drag.setMimeData(data)
@@ -2081,17 +2719,12 @@ class LibraryTableView(QtGui.QTableView):
 
         file_paths = []
         for item in event.mimeData().urls():
-            file_path = item.toString()[7:]
+            file_path = os.path.realpath(item.toString()[7:])
             if self.metadata.isValidFile(file_path) and \
             not self.library.file_in_library(file_path):
                 file_paths.append(file_path)
         if len(file_paths) > 0:
-            self.library.add_files_to_library(file_paths)
-            new_track_data = []
-            for item in file_paths:
-                data = self.library.get_item_data(item)
-                new_track_data.append(data)
-            self.parent.add_items(new_track_data)
+            self.parent.add_files(file_paths)
 
     def contextMenuEvent(self, event):
         """ Creates a context menu when an item in the library is right-clicked.
@@ -2119,7 +2752,7 @@ class LibraryTableView(QtGui.QTableView):
         playlist_widget = self.main.beatbox_gui.playlist_gui.playlist_widget
         new_items = []
         for row in self.parent.selected_rows():
-            file_path = self.parent.get_file_path(row)
+            file_path = self.parent.get_file_path(row.row())
             playlist_item = playlist_widget.create_playlist_item(file_path)
             playlist_widget.append_item(playlist_item)
             new_items.append(playlist_item)
@@ -2135,6 +2768,8 @@ class PreferencesDialog(QtGui.QDialog):
         self.preferences = self.parent.preferences
         self.localisation = self.parent.localisation
         self.library = self.parent.beatbox_gui.tabview_gui.library_gui.library
+        self.library_watcher = \
+            self.parent.beatbox_gui.tabview_gui.library_gui.library_watcher
         self.create_preferences_widget()
         self.load_preferences()
         self.pending_actions = []
@@ -2180,6 +2815,33 @@ class PreferencesDialog(QtGui.QDialog):
         self.directories_list_view = QtGui.QListWidget(self)
         layout.addWidget(self.directories_list_view)
 
+        library_hbox_2 = QtGui.QHBoxLayout()
+        workers_label = QtGui.QLabel(self.localisation.INGEST_WORKERS_STRING)
+        library_hbox_2.addWidget(workers_label)
+        self.workers_spin_box = QtGui.QSpinBox(self)
+        self.workers_spin_box.setRange(0, 64)
+        self.workers_spin_box.valueChanged.connect(self.workers_changed)
+        library_hbox_2.addWidget(self.workers_spin_box)
+        layout.addLayout(library_hbox_2)
+        self.io_order_check_box = QtGui.QCheckBox(
+            self.localisation.IO_ORDERED_INGEST_STRING, self)
+        self.io_order_check_box.toggled.connect(self.io_order_changed)
+        layout.addWidget(self.io_order_check_box)
+        self.thumbnails_check_box = QtGui.QCheckBox(
+            self.localisation.INGEST_THUMBNAILS_STRING, self)
+        self.thumbnails_check_box.toggled.connect(self.thumbnails_changed)
+        layout.addWidget(self.thumbnails_check_box)
+        library_hbox_3 = QtGui.QHBoxLayout()
+        poll_interval_label = QtGui.QLabel(
+            self.localisation.WATCH_POLL_INTERVAL_STRING)
+        library_hbox_3.addWidget(poll_interval_label)
+        self.poll_interval_spin_box = QtGui.QSpinBox(self)
+        self.poll_interval_spin_box.setRange(5, 3600)
+        self.poll_interval_spin_box.valueChanged.connect(
+            self.poll_interval_changed)
+        library_hbox_3.addWidget(self.poll_interval_spin_box)
+        layout.addLayout(library_hbox_3)
+
         buttons_hbox = QtGui.QHBoxLayout()
         self.apply_button = QtGui.QPushButton(
             self.localisation.APPLY_STRING, self)
@@ -2200,6 +2862,18 @@ class PreferencesDialog(QtGui.QDialog):
         """
         for d in self.preferences.get_library_dirs_pref():
             self.directories_list_view.addItem(QtGui.QListWidgetItem(d))
+        self.workers_spin_box.blockSignals(True)
+        self.workers_spin_box.setValue(self.library.ingest_workers)
+        self.workers_spin_box.blockSignals(False)
+        self.io_order_check_box.blockSignals(True)
+        self.io_order_check_box.setChecked(self.library.io_ordered_ingest)
+        self.io_order_check_box.blockSignals(False)
+        self.thumbnails_check_box.blockSignals(True)
+        self.thumbnails_check_box.setChecked(self.library.ingest_thumbnails)
+        self.thumbnails_check_box.blockSignals(False)
+        self.poll_interval_spin_box.blockSignals(True)
+        self.poll_interval_spin_box.setValue(self.library_watcher.poll_interval)
+        self.poll_interval_spin_box.blockSignals(False)
 
     def language_changed(self):
         """ Called when the language combo box is changed. Sets a flag so that
@@ -2209,6 +2883,41 @@ class PreferencesDialog(QtGui.QDialog):
         """
         self._language_changed_flag = True
 
+    def workers_changed(self, value):
+        """ Called when the ingest workers spin box is changed. Queues up the
+        new number of workers to be set when apply is clicked.
+
+        PreferencesDialog.workers_changed(int) -> None
+        """
+        self.pending_actions.append((self.library.set_ingest_workers, value))
+
+    def io_order_changed(self, checked):
+        """ Called when the disk order check box is toggled. Queues up the
+        change to be made when apply is clicked.
+
+        PreferencesDialog.io_order_changed(bool) -> None
+        """
+        self.pending_actions.append(
+            (self.library.set_io_ordered_ingest, checked))
+
+    def thumbnails_changed(self, checked):
+        """ Called when the ingest thumbnails check box is toggled. Queues up
+        the change to be made when apply is clicked.
+
+        PreferencesDialog.thumbnails_changed(bool) -> None
+        """
+        self.pending_actions.append(
+            (self.library.set_ingest_thumbnails, checked))
+
+    def poll_interval_changed(self, value):
+        """ Called when the poll interval spin box is changed. Queues up the
+        new interval to be set when apply is clicked.
+
+        PreferencesDialog.poll_interval_changed(int) -> None
+        """
+        self.pending_actions.append(
+            (self.library_watcher.set_poll_interval, value))
+
     def remove_directory(self):
         """ Removes the selected folder from the library.
 
@@ -2254,11 +2963,10 @@ class PreferencesDialog(QtGui.QDialog):
                 self.language_combo.currentText())
             self.parent.beatbox_gui.reload_text()
         self.accept() ## Close the dialog
+        self.parent.beatbox_gui.tabview_gui.library_gui.library_watcher.\
+        set_directories(self.library.directories)
         if new_dirs:
-            new_tracks = self.library.update_library()
-            self.parent.beatbox_gui.tabview_gui.library_gui.refresh_library()
-            self.parent.beatbox_gui.tabview_gui.library_gui.\
-            progress_dialog.reset()
+            self.parent.beatbox_gui.tabview_gui.library_gui.scan_library()
 
 class MetadataEditor(QtGui.QDialog):
     """ QDialog that allows the viewing and editing of song metadata.
@@ -2291,13 +2999,24 @@ class MetadataEditor(QtGui.QDialog):
             return [self.library_gui.get_file_path(row.row()) \
             for row in selected_rows]
 
+    def get_tracks(self):
+        """ Gets a Track for each of the selected songs. Songs in the library
+        are made from their rows in the library database, so their files
+        aren't read, and any others are read through the track cache.
+
+        MetadataEditor.get_tracks() -> list(Track)
+        """
+        tracks = self.library_gui.library.get_tracks(self.file_paths)
+        return [tracks.get(file_path) or metadata.TRACK_CACHE.get_track(
+            file_path) for file_path in self.file_paths]
+
     def create_single_item_editor(self):
         """ Creates a QTabWidget for viewing and editing a single track's 
         metadata.
 
         MetadataEditor.create_single_item_editor() -> None
         """
-        self.track = metadata.Track(self.file_paths[0])
+        self.track = self.get_tracks()[0]
 
         layout = QtGui.QVBoxLayout(self)
         self.tabview_widget = QtGui.QTabWidget(self)
@@ -2326,7 +3045,7 @@ class MetadataEditor(QtGui.QDialog):
 
         MetadataEditor.create_multiple_items_editor() -> None
         """
-        self.tracks = [metadata.Track(i) for i in self.file_paths]
+        self.tracks = self.get_tracks()
         md = self.aggregate_metadata(self.tracks)
 
         layout = QtGui.QVBoxLayout(self)
@@ -2355,15 +3074,18 @@ class MetadataEditor(QtGui.QDialog):
         layout = QtGui.QVBoxLayout(info_tab)
         top_box = QtGui.QGridLayout()
         album_cover = QtGui.QLabel()
-        cover = metadata.Metadata().get_album_cover(track.file_path)
+        md = metadata.Metadata()
+        cover = artcache.ART_CACHE.get_thumbnail(track.file_path,
+            PLAYER_COVER_SIZE)
         if cover == None:
-            pixel_map = QtGui.QPixmap(DEFAULT_ALBUM_COVER)
+            pixel_map = ICON_REGISTRY.get_default_pixmap(PLAYER_COVER_SIZE)
         else:
             pixel_map = QtGui.QPixmap()
             pixel_map.loadFromData(cover)
-        album_cover.setPixmap(pixel_map.scaled(PLAYER_COVER_SIZE,\
-         PLAYER_COVER_SIZE, QtCore.Qt.KeepAspectRatio,\
-          QtCore.Qt.SmoothTransformation))
+            pixel_map = pixel_map.scaled(PLAYER_COVER_SIZE,\
+             PLAYER_COVER_SIZE, QtCore.Qt.KeepAspectRatio,\
+              QtCore.Qt.SmoothTransformation)
+        album_cover.setPixmap(pixel_map)
         top_box.addWidget(album_cover, 0, 0, 0, 2)
         track_label = QtGui.QLabel(track.title)
         top_box.addWidget(track_label, 0, 1)
@@ -2381,21 +3103,22 @@ class MetadataEditor(QtGui.QDialog):
             ': </b>' + track.format)
         middle_box.addWidget(format_label)
         size_label = QtGui.QLabel('<b>' + self.localisation.SIZE_STRING + 
-            ': </b>'+ track.size)
+            ': </b>'+ md.format_size(track.size))
         middle_box.addWidget(size_label)
         length_label = QtGui.QLabel('<b>'+ self.localisation.LENGTH_STRING + 
-            ': </b>' + track.time)
+            ': </b>' + md.format_time(track.time))
         middle_box.addWidget(length_label)
         bit_rate_label = QtGui.QLabel(
             '<b>' + self.localisation.BIT_RATE_STRING + ': </b>' \
-            + track.bit_rate)
+            + md.format_bit_rate(track.bit_rate))
         middle_box.addWidget(bit_rate_label)
         sample_rate_label = QtGui.QLabel('<b>' + 
-            self.localisation.SAMPLE_RATE_STRING + ': </b>' + track.sample_rate)
+            self.localisation.SAMPLE_RATE_STRING + ': </b>' + \
+            md.format_sample_rate(track.sample_rate))
         middle_box.addWidget(sample_rate_label)
         date_modified_label = QtGui.QLabel('<b>' + 
             self.localisation.DATE_MODIFIED_STRING + ': </b>' +\
-             track.date_modified)
+             md.format_date(track.date_modified))
         middle_box.addWidget(date_modified_label)
         channels_label = QtGui.QLabel(
             '<b>' + self.localisation.CHANNELS_STRING + \
@@ -2757,13 +3480,18 @@ def main():
     on_exit(application.exec_(), main_gui)
 
 def on_exit(app_exit, main):
-    """ Called on exiting the app. Saves the preferences.
+    """ Called on exiting the app. Saves the preferences and the caches.
 
     on_exit(int, MainGui) -> None
     """
 
     main.beatbox_gui.playlist.save_playlist()
     main.preferences.save_prefs()
+    main.beatbox_gui.tabview_gui.library_gui.cancel_library_task()
+    main.beatbox_gui.tabview_gui.library_gui.stop_library_watcher()
+    main.beatbox_gui.tabview_gui.library_gui.library.close()
+    metadata.TRACK_CACHE.save()
+    artcache.ART_CACHE.save()
     sys.exit(app_exit)
 
 if __name__ == '__main__':
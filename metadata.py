@@ -22,8 +22,13 @@ without express permission, with exclusion of commercial application.
 """
 
 # Standard libraries
+import collections
+import cPickle
+import os
 from os import listdir
 import os.path
+import sys
+import threading
 import time
 
 # 3rd party libraries
@@ -35,6 +40,216 @@ from mutagen.asf import ASF
 from mutagen.oggvorbis import OggVorbis
 from mutagen import *
 
+## Audio file extensions, in lower case, and the format they're read as
+AUDIO_FORMATS = {'.mp3': 'mp3', '.flac': 'flac', '.ogg': 'ogg', '.m4a': 'm4a',
+	'.wma': 'wma'}
+MUTAGEN_PARSERS = {'mp3': MP3, 'flac': FLAC, 'ogg': OggVorbis, 'm4a': MP4,
+	'wma': ASF}
+SNIFF_SIZE = 16 # Bytes read from the start of a file to recognise its format
+ASF_HEADER = '\x30\x26\xb2\x75\x8e\x66\xcf\x11' # Start of the ASF GUID
+## Errors a tag that's missing or in an unexpected form raises
+TAG_ERRORS = (KeyError, IndexError, TypeError, ValueError, UnicodeError)
+TRACK_CACHE_NAME = 'data/track_cache.cpk'
+TRACK_CACHE_SIZE = 256 # Tracks kept in memory by the track cache
+TRACK_CACHE_DISK_SIZE = 5000 # Tracks kept in the track cache's file
+COVER_CACHE_BYTES = 32 * 1024 * 1024 # Bytes of covers kept with cached Tracks
+## Names of the image files in a song's folder used as its cover when it has
+## none embedded, in order of preference, ignoring case, and the extensions
+## they can have, also in order of preference
+COVER_FILE_NAMES = ('cover', 'front', 'folder')
+COVER_FILE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+COVER_RESOLVER_SIZE = 10000 # Folders whose cover file is remembered
+
+def get_format(path):
+	""" Returns the format of the audio file at the given path from its
+	extension, ignoring case, or None if it isn't an audio file.
+
+	get_format(str) -> str
+	"""
+	return AUDIO_FORMATS.get(os.path.splitext(path)[1].lower())
+
+def sniff_format(file_path):
+	""" Returns the format of the given audio file from the magic bytes at
+	its start, or None if they aren't recognised. An ID3 tag is also put at
+	the start of some FLAC files, so those are left to the extension.
+
+	sniff_format(str) -> str
+	"""
+	with open(file_path, 'rb') as audio_file:
+		return recognise_format(audio_file.read(SNIFF_SIZE))
+
+def recognise_format(header):
+	""" Returns the format of an audio file from the first SNIFF_SIZE bytes
+	of it, or None if they aren't recognised.
+
+	recognise_format(str) -> str
+	"""
+	if header.startswith('fLaC'):
+		return 'flac'
+	elif header.startswith('OggS'):
+		return 'ogg'
+	elif header[4:8] == 'ftyp':
+		return 'm4a'
+	elif header.startswith(ASF_HEADER):
+		return 'wma'
+	elif header.startswith('ID3'):
+		return None
+	elif len(header) > 1 and header[0] == '\xff' and \
+		ord(header[1]) & 0xe0 == 0xe0:
+		return 'mp3' # An MPEG frame sync
+	return None
+
+def first(values):
+	""" Tag converter returning the first value as it is.
+
+	first(list) -> str
+	"""
+	return values[0]
+
+def text(values):
+	""" Tag converter returning the first value as text.
+
+	text(list) -> str
+	"""
+	return unicode(values[0])
+
+def year(values):
+	""" Tag converter returning the year of the first value, which may be
+	a full date.
+
+	year(list) -> str
+	"""
+	return unicode(values[0])[:4]
+
+def before_slash(values):
+	""" Tag converter returning the number before the slash of an
+	'N/TOTAL' value.
+
+	before_slash(list) -> str
+	"""
+	return unicode(values[0]).split('/')[0]
+
+def after_slash(values):
+	""" Tag converter returning the total after the slash of an 'N/TOTAL'
+	value.
+
+	after_slash(list) -> str
+	"""
+	return unicode(values[0]).split('/')[1]
+
+def pair_first(values):
+	""" Tag converter returning the number from an MP4 (number, total)
+	pair.
+
+	pair_first(list) -> str
+	"""
+	return unicode(values[0][0])
+
+def pair_second(values):
+	""" Tag converter returning the total from an MP4 (number, total) pair.
+
+	pair_second(list) -> str
+	"""
+	return unicode(values[0][1])
+
+def joined(values):
+	""" Tag converter returning every value joined by slashes.
+
+	joined(list) -> str
+	"""
+	return '/'.join([unicode(value) for value in values])
+
+## The tags each field of a Track is read from in each format, as a list of
+## (tag key, converter). The first tag that's there and converts gives the
+## field's value, and fields without one are empty.
+VORBIS_TAGS = {'title': [('title', first)], 'artist': [('artist', first)],
+	'album': [('album', first)], 'year': [('date', first)],
+	'genre': [('genre', first)],
+	'track_number': [('tracknumber', first)],
+	'total_tracks': [('totaltracks', first), ('tracktotal', first)],
+	'disc_number': [('discnumber', first)],
+	'total_discs': [('disctotal', first)],
+	'album_artist': [('album artist', first), ('albumartist', first)],
+	'bpm': [('TBPM', first)],
+	'composer': [('composer', first), ('TCOM', first)],
+	'publisher': [('publisher', first), ('label', first)],
+	'comment': [('comment', first)],
+	'rating': [('rating', first), ('POPM', first)]}
+FORMAT_TAGS = {
+	'mp3': {'title': [('TIT2', first)], 'artist': [('TPE1', first)],
+		'album': [('TALB', first)], 'year': [('TDRC', text)],
+		'genre': [('TCON', first)],
+		'track_number': [('TRCK', before_slash)],
+		'total_tracks': [('TRCK', after_slash)],
+		'disc_number': [('TPOS', before_slash)],
+		'total_discs': [('TPOS', after_slash)],
+		'album_artist': [('TPE2', first)], 'bpm': [('TBPM', first)],
+		'composer': [('TCOM', first)], 'publisher': [('TPUB', first)],
+		'comment': [("COMM::'eng'", first)], 'rating': [('POPM', first)]},
+	'flac': VORBIS_TAGS,
+	'ogg': VORBIS_TAGS,
+	'm4a': {'title': [('\xa9nam', first)], 'artist': [('\xa9ART', first)],
+		'album': [('\xa9alb', first)], 'year': [('\xa9day', year)],
+		'genre': [('\xa9gen', first)],
+		'track_number': [('trkn', pair_first)],
+		'total_tracks': [('trkn', pair_second)],
+		'disc_number': [('disk', pair_first)],
+		'total_discs': [('disk', pair_second)],
+		'album_artist': [('aART', first)], 'bpm': [('tmpo', text)],
+		'composer': [('\xa9wrt', first)],
+		'publisher': [('----:com.apple.iTunes:LABEL', first),
+			('----:com.apple.iTunes:Label', first)],
+		'comment': [('\xa9cmt', first)],
+		'rating': [('----:com.apple.iTunes:Rating', first)]},
+	'wma': {'title': [('Title', text)], 'artist': [('Author', text)],
+		'album': [('WM/AlbumTitle', text)], 'year': [('WM/Year', year)],
+		'genre': [('WM/Genre', text)],
+		'track_number': [('WM/TrackNumber', before_slash)],
+		'total_tracks': [('WM/TrackNumber', after_slash)],
+		'disc_number': [('WM/PartOfSet', before_slash)],
+		'total_discs': [('WM/PartOfSet', after_slash)],
+		'album_artist': [('WM/AlbumArtist', text)],
+		'bpm': [('WM/BeatsPerMinute', text)],
+		'composer': [('WM/Composer', joined)],
+		'publisher': [('WM/Publisher', joined)],
+		'comment': [('WM/Comments', text)], 'rating': [('WM/Rating', first)]}}
+
+def compile_extractor(fields, case_insensitive=False):
+	""" Compiles a format's entry in FORMAT_TAGS into a function that reads
+	every field from a mutagen object's tags, or a dictionary of tag keys to
+	lists of values, in a single pass, returning them as a dictionary. Tags
+	kept as a list of pairs (Vorbis comments and ASF) are turned into a
+	dictionary once, rather than searched for each key. Vorbis comment keys
+	ignore case, so they're looked up in lower case.
+
+	compile_extractor(dict, bool) -> function
+	"""
+	if case_insensitive:
+		fields = dict((field, [(key.lower(), converter) for \
+			key, converter in tags]) for field, tags in fields.iteritems())
+	fields = tuple((field, tuple(tags)) for field, tags in fields.iteritems())
+	empty = dict.fromkeys([field for field, tags in fields], '')
+
+	def extract(tags):
+		if tags is None:
+			return dict(empty)
+		if hasattr(tags, 'as_dict'):
+			tags = tags.as_dict()
+		values = {}
+		for field, candidates in fields:
+			value = ''
+			for key, converter in candidates:
+				try:
+					value = converter(tags[key])
+				except TAG_ERRORS:
+					continue
+				break
+			values[field] = value
+		return values
+	return extract
+
+TAG_EXTRACTORS = dict((format, compile_extractor(fields,
+	format in ('flac', 'ogg'))) for format, fields in FORMAT_TAGS.iteritems())
 
 class Metadata(object):
 	"""This class contains all the functions for retrieving song metadata."""
@@ -44,41 +259,41 @@ class Metadata(object):
 
 		Metadata.isValidFile(str) -> boolean
 		"""
-		if path.endswith(".mp3"):
-			return True
-		elif path.endswith(".flac"):
-			return True
-		elif path.endswith(".ogg"):
-			return True
-		elif path.endswith(".m4a"):
-			return True
-		elif path.endswith(".wma"):
-			return True
-		else:
-			return False
+		return get_format(path) is not None
 
 	def get_mutagen_parser(self, file_path):
 		""" Gets the correct audio parser and file format for the given path.
 
+		The format is recognised from the start of the file where possible,
+		so a file with the wrong extension is still read, and otherwise from
+		its extension.
+
 		Metadata.get_mutagen_parser(str) -> Mutagen, str
 		"""
-
-		if file_path.endswith(".mp3"):
-			audio = MP3(file_path)
-			format = "mp3"
-		elif file_path.endswith(".flac"):
-			audio = FLAC(file_path)
-			format = "flac"
-		elif file_path.endswith(".ogg"):
-			audio = OggVorbis(file_path)
-			format = "ogg"
-		elif file_path.endswith(".m4a"):
-			audio = MP4(file_path)
-			format = "m4a"
-		elif file_path.endswith(".wma"):
-			audio = ASF(file_path)
-			format = "wma"
+		format = sniff_format(file_path) or get_format(file_path)
+		audio = MUTAGEN_PARSERS[format](file_path)
 		return audio, format
+
+	def get_tags(self, audio, format):
+		""" Gets every tag field of a Track (see FORMAT_TAGS) from the
+		metadata created by the Mutagen module, as a dictionary.
+
+		Metadata.get_tags(Mutagen, str) -> dict
+		"""
+		return TAG_EXTRACTORS[format](audio.tags)
+
+	def get_tag(self, audio, format, field):
+		""" Gets a single tag field of a Track from the metadata created by
+		the Mutagen module.
+
+		Metadata.get_tag(Mutagen, str, str) -> str
+		"""
+		for key, converter in FORMAT_TAGS[format][field]:
+			try:
+				return converter(audio[key])
+			except TAG_ERRORS:
+				pass
+		return ''
 		
 	def get_now_playing_metadata(self, path):
 		""" Gets the metadata relevant from a song loaded in the player (i.e 
@@ -86,109 +301,36 @@ class Metadata(object):
 		
 		Metadata.get_now_playing_metadata(str) -> Track
 		"""
-		track = Track(path)
-		return track
+		return TRACK_CACHE.get_track(path)
 
 	def get_playlist_metadata(self, path):
 		""" Gets the artist and title of a track to add to the playlist.
+
+		Metadata.get_playlist_metadata(str) -> (str, str)
 		"""
-		audio, format = self.get_mutagen_parser(path)
-		artist = self.get_artist(audio, format)
-		title = self.get_title(audio, format)
-		return (artist, title)
+		track = TRACK_CACHE.get_track(path)
+		return (track.artist, track.title)
 
 	def get_artist(self, audio, format):
 		""" Get the artist name from the metadata created by the Mutagen module. 
 
 		Metadata.get_artist(Mutagen, str) -> str
 		"""
-		if format == "mp3":
-			try:
-				return audio["TPE1"][0]
-			except:
-				return ""
-		elif format == "flac":
-			try:
-				return audio["artist"][0]
-			except:
-				return ""
-		elif format == "ogg":
-			try:
-				return audio["artist"][0]
-			except:
-				return ""
-		elif format == "m4a":
-			if audio["\xa9ART"]:
-				return audio["\xa9ART"][0]
-			else:
-				return ""
-		elif format == "wma":
-			if audio["Author"]:
-				return audio["Author"][0]
-			else:
-				return ""
+		return self.get_tag(audio, format, 'artist')
 
 	def get_title(self, audio, format):
 		""" Get the song name from the metadata created by the Mutagen module. 
 
 		Metadata.get_title(Mutagen, str) -> str
 		"""
-		if format == "mp3":
-			try:
-				return audio["TIT2"][0]
-			except:
-				return ""
-		elif format == "flac":
-			try:
-				return audio["title"][0]
-			except:
-				return ""
-		elif format == "ogg":
-			try:
-				return audio["title"][0]
-			except:
-				return ""
-		elif format == "m4a":
-			if audio["\xa9nam"]:
-				return audio["\xa9nam"][0]
-			else:
-				return ""
-		elif format == "wma":
-			if audio["Title"]:
-				return audio["Title"][0]
-			else:
-				return ""
+		return self.get_tag(audio, format, 'title')
 
 	def get_album(self, audio, format):
 		""" Get the album name from the metadata created by the Mutagen module. 
 
 		Metadata.get_album(Mutagen, str) -> str
 		"""
-		if format == "mp3":
-			try:
-				return audio["TALB"][0]
-			except:
-				return ""
-		elif format == "flac":
-			try:
-				return audio["album"][0]
-			except:
-				return ""
-		elif format == "ogg":
-			try:
-				return audio["album"][0]
-			except:
-				return ""
-		elif format == "m4a":
-			if audio["\xa9alb"]:
-				return audio["\xa9alb"][0]
-			else:
-				return ""
-		elif format == "wma":
-			if audio["WM/AlbumTitle"]:
-				return str(audio["WM/AlbumTitle"][0])
-			else:
-				return ""
+		return self.get_tag(audio, format, 'album')
 
 	def get_date(self, audio, format):
 		""" Get the year/date of the song's creation from the metadata 
@@ -196,96 +338,21 @@ class Metadata(object):
 
 		Metadata.get_date(Mutagen, str) -> str
 		"""
-		if format == "mp3":
-			try:
-				return str(audio["TDRC"][0])
-			except:
-				return ""
-		elif format == "flac":
-			try:
-				return audio["date"][0]
-			except:
-				return ""
-		elif format == "ogg":
-			try:
-				return audio["date"][0]
-			except:
-				return ""
-		elif format == "m4a":
-			if audio["\xa9day"]:
-				return audio["\xa9day"][0][:4] 
-				#M4a stores as YYYY-MM-DD-HH-SS, only want the year so slice it.
-			else:
-				return ""
-		elif format == "wma":
-			if audio["WM/Year"]:
-				return str(audio["WM/Year"][0])[:4]
-			else:
-				return ""
+		return self.get_tag(audio, format, 'year')
 
 	def get_genre(self, audio, format):
 		""" Get the song genre from the metadata created by the Mutagen module. 
 
 		Metadata.get_genre(Mutagen, str) -> str
 		"""
-		if format == "mp3":
-			try:
-				return audio["TCON"][0]
-			except:
-				return ""
-		elif format == "flac":
-			try:
-				return audio["genre"][0]
-			except:
-				return ""
-		elif format == "ogg":
-			try:
-				return audio["genre"][0]
-			except:
-				return ""
-		elif format == "m4a":
-			try:
-				return audio["\xa9gen"][0]
-			except:
-				return ""
-		elif format == "wma":
-			try:
-				return str(audio["WM/Genre"][0])
-			except:
-				return ""
+		return self.get_tag(audio, format, 'genre')
 
 	def get_track_number(self, audio, format):
 		""" Get the track no. from the metadata created by the Mutagen module. 
 
 		Metadata.get_track_number(Mutagen, str) -> str
 		"""
-		if format == "mp3":
-			try:
-				track_number = audio["TRCK"][0]
-				return track_number.split('/')[0]
-			except:
-				return ""
-		elif format == "flac":
-			try:
-				return audio['tracknumber'][0]
-			except:
-				return ""
-		elif format == "ogg":
-			try:
-				return audio["tracknumber"][0]
-			except:
-				return ""
-		elif format == "m4a":
-			try:
-				return str(audio["trkn"][0][0])
-			except:
-				return ""
-		elif format == "wma":
-			try:
-				track_number = str(audio["WM/TrackNumber"][0])
-				return track_number.split('/')[0]
-			except:
-				return ""
+		return self.get_tag(audio, format, 'track_number')
 
 	def get_total_tracks(self, audio, format):
 		""" Get the total number of tracks from the metadata created by the 
@@ -293,69 +360,14 @@ class Metadata(object):
 
 		Metadata.get_total_tracks(Mutagen, str) -> str
 		"""
-		if format == "mp3":
-			try:
-				track_number = audio["TRCK"][0]
-				return track_number.split('/')[1]
-			except:
-				return ""
-		elif format == "flac":
-			try:
-				return audio['totaltracks'][0]
-			except:
-				try:
-					return audio['tracktotal'][0]
-				except:
-					return ""
-		elif format == "ogg":
-			try:
-				return audio["totaltracks"][0]
-			except:
-				return ""
-		elif format == "m4a":
-			try:
-				return str(audio["trkn"][0][1])
-			except:
-				return ""
-		elif format == "wma":
-			try:
-				track_number = str(audio["WM/TrackNumber"][0])
-				return track_number.split('/')[1]
-			except:
-				return ""
+		return self.get_tag(audio, format, 'total_tracks')
 
 	def get_disc_number(self, audio, format):
 		""" Get the disc number from the metadata created by the Mutagen module. 
 
 		Metadata.get_disc_number(Mutagen, str) -> str
 		"""
-		if format == "mp3":
-			try:
-				disc_number = audio["TPOS"][0]
-				return disc_number.split('/')[0]
-			except:
-				return ""
-		elif format == "flac":
-			try:
-				return audio["discnumber"][0]
-			except:
-				return ""
-		elif format == "ogg":
-			try:
-				return audio["discnumber"][0]
-			except:
-				return ""
-		elif format == "m4a":
-			try:
-				return str(audio["disk"][0][0])
-			except:
-				return ""
-		elif format == "wma":
-			try:
-				disc_number = str(audio["WM/PartOfSet"][0])
-				return disc_number.split('/')[0]
-			except:
-				return ""
+		return self.get_tag(audio, format, 'disc_number')
 
 	def get_total_discs(self, audio, format):
 		""" Get the total number of discs from the metadata created by the
@@ -363,33 +375,7 @@ class Metadata(object):
 
 		Metadata.get_total_discs(Mutagen, str) -> str
 		"""
-		if format == "mp3":
-			try:
-				disc_number = audio["TPOS"][0]
-				return disc_number.split('/')[1]
-			except:
-				return ""
-		elif format == "flac":
-			try:
-				return audio["disctotal"][0]
-			except:
-				return ""
-		elif format == "ogg":
-			try:
-				return audio["disctotal"][0]
-			except:
-				return ""
-		elif format == "m4a":
-			try:
-				return str(audio["disk"][0][1])
-			except:
-				return ""
-		elif format == "wma":
-			try:
-				disc_number = str(audio["WM/PartOfSet"][0])
-				return disc_number.split('/')[1]
-			except:
-				return ""
+		return self.get_tag(audio, format, 'total_discs')
 
 	def get_album_artist(self, audio, format):
 		""" Get the album artist name from the metadata created by the Mutagen 
@@ -397,37 +383,7 @@ class Metadata(object):
 
 		Metadata.get_album_artist(Mutagen, str) -> str
 		"""
-		if format == "mp3":
-			try:
-				return audio["TPE2"][0]
-			except:
-				return ""
-		elif format == "flac":
-			try:
-				return audio["album artist"][0]
-			except:
-				try:
-					return audio["albumartist"][0]
-				except:
-					return ""
-		elif format == "ogg":
-			try:
-				return audio["album artist"][0]
-			except:
-				try:
-					return audio["albumartist"][0]
-				except:
-					return ""
-		elif format == "m4a":
-			try:
-				return audio["aART"][0]
-			except:
-				return ""
-		elif format == "wma":
-			try:
-				return str(audio["WM/AlbumArtist"][0])
-			except:
-				return ""
+		return self.get_tag(audio, format, 'album_artist')
 
 	def get_bpm(self, audio, format):
 		""" Get the BPM from the metadata created by the Mutagen 
@@ -435,69 +391,15 @@ class Metadata(object):
 
 		Metadata.get_bpm(Mutagen, str) -> str
 		"""
-		if format == "mp3":
-			try:
-				return audio["TBPM"][0]
-			except:
-				return ""
-		elif format == "flac":
-			try:
-				return audio["TBPM"][0]
-			except:
-				return ""
-		elif format == "ogg":
-			try:
-				return audio["TBPM"][0]
-			except:
-				return ""
-		elif format == "m4a":
-			try:
-				return str(audio['tmpo'][0])
-			except:
-				return "" 
-		elif format == "wma":
-			try:
-				return str(audio["WM/BeatsPerMinute"][0])
-			except:
-				return ""
+		return self.get_tag(audio, format, 'bpm')
 
 	def get_composer(self, audio, format):
 		""" Get the composer of the song from the metadata created by 
 		the Mutagen module. 
 
-		Metadata.get_bpm(Mutagen, str) -> str
+		Metadata.get_composer(Mutagen, str) -> str
 		"""
-		if format == "mp3":
-			try:
-				return audio["TCOM"][0]
-			except:
-				return ""
-		elif format == "flac":
-			try:
-				return audio["composer"][0]
-			except:
-				try:
-					return audio["TCOM"][0]
-				except:
-					return ""
-		elif format == "ogg":
-			try:
-				return audio["composer"][0]
-			except:
-				try:
-					return audio["TCOM"][0]
-				except:
-					return ""
-		elif format == "m4a":
-			try:
-				return audio["\xa9wrt"][0]
-			except:
-				return ""
-		elif format == "wma":
-			try:
-				return '/'.join([str(c) for c in audio["WM/Composer"]])
-			except:
-				return ""
+		return self.get_tag(audio, format, 'composer')
 
 	def get_publisher(self, audio, format):
 		""" Get the publisher name from the metadata created by the Mutagen 
@@ -505,120 +407,80 @@ class Metadata(object):
 
 		Metadata.get_publisher(Mutagen, str) -> str
 		"""
-		if format == "mp3":
-			try:
-				return audio["TPUB"][0]
-			except:
-				return ""
-		elif format == "flac":
-			try:
-				return audio["publisher"][0]
-			except:
-				try:
-					return audio["label"][0]
-				except:
-					return ""
-		elif format == "ogg":
-			try:
-				return audio["publisher"][0]
-			except:
-				try:
-					return audio["label"][0]
-				except:
-					return ""
-		elif format == "m4a":
-			try:
-				return audio["----:com.apple.iTunes:LABEL"][0]
-			except:
-				try:
-					return audio["----:com.apple.iTunes:Label"][0]
-				except:
-					return ""
-		elif format == "wma":
-			try:
-				return '/'.join([str(p) for p in audio["WM/Publisher"]])
-			except:
-				return ""
+		return self.get_tag(audio, format, 'publisher')
+
+	def get_stream_info(self, audio):
+		""" Gets the length, bit rate, sample rate, and channels of a song
+		from the metadata created by the Mutagen module, as a dictionary.
+
+		Metadata.get_stream_info(Mutagen) -> dict
+		"""
+		return {'time': self.get_track_time(audio),
+			'bit_rate': self.get_bit_rate(audio),
+			'sample_rate': self.get_sample_rate(audio),
+			'channels': self.get_channels(audio)}
 
 	def get_track_time(self, audio):
-		""" Get the track length from the metadata created by the Mutagen
-		module. 
+		""" Get the track length in seconds from the metadata created by the
+		Mutagen module. 
 
-		Metadata.get_track_time(Mutagen, str) -> str
+		Metadata.get_track_time(Mutagen) -> float
 		"""
 
-		return self.format_time(audio.info.length)
+		return audio.info.length
 
 	def get_date_modified(self, file_path):
-		""" Get the date of last modification of the given path.
+		""" Get the date of last modification of the given path as seconds
+		since the epoch.
+
+		Metadata.get_date_modified(str) -> float
+		"""
+		return os.path.getmtime(file_path)
 
-		Metadata.get_date_modified(str) -> time
+	def get_fingerprint(self, file_path):
+		""" Get the (modification time, size in bytes) of the given path.
+		Used by the library to tell if a file has changed since it was read.
+
+		Metadata.get_fingerprint(str) -> (float, int)
 		"""
-		date_mod = time.ctime(os.path.getmtime(file_path))
-		return date_mod
+		stat = os.stat(file_path)
+		return stat.st_mtime, stat.st_size
 
 	def get_size(self, file_path):
-		""" Get the size in Mb for the given path.
+		""" Get the size in bytes for the given path.
 
-		Metadata.get_size(str) -> str
+		Metadata.get_size(str) -> int
 		"""
-		size = float(os.path.getsize(file_path))
-		mb = (size/1024)/1024
-		return '%.2f MB' %mb
+		return os.path.getsize(file_path)
 
 	def get_comment(self, audio, format):
 		""" Get the comments from the metadata created by the Mutagen module. 
 
 		Metadata.get_comment(Mutagen, str) -> str
 		"""
-		if format == "mp3":
-			try:
-				return audio["COMM::'eng'"][0]
-			except:
-				return ""
-		elif format == "flac":
-			try:
-				return audio["comment"][0]
-			except:
-				return ""
-		elif format == "ogg":
-			try:
-				return audio["comment"][0]
-			except:
-				return ""
-		elif format == "m4a":
-			try:
-				return audio["\xa9cmt"][0]
-			except:
-				return ""
-		elif format =='wma':
-			try:
-				return str(audio["WM/Comments"][0])
-			except:
-				return ""
+		return self.get_tag(audio, format, 'comment')
 
 	def get_bit_rate(self, audio):
-		""" Get the bit rate of the given song
+		""" Get the bit rate of the given song in bits per second, or None if
+		it isn't known.
 
-		Metadata.get_bit_rate(Mutagen) -> str
+		Metadata.get_bit_rate(Mutagen) -> int
 		"""
 		try:
-			bit_rate = audio.info.bitrate/1000
-			if bit_rate == 0:
-				return "Unknown"
-			return str(bit_rate) + " kbps"
+			return audio.info.bitrate or None
 		except:
-			return "N/A"
+			return None
 
 	def get_sample_rate(self, audio):
-		""" Get the sample rate of the given song
+		""" Get the sample rate of the given song in Hz, or None if it isn't
+		known.
 
-		Metadata.get_sample_rate(Mutagen) -> str
+		Metadata.get_sample_rate(Mutagen) -> int
 		"""
-		if audio.info.sample_rate == 0:
-			return "Unknown"
-		else:
-			return str(audio.info.sample_rate) + " kHz"
+		try:
+			return audio.info.sample_rate or None
+		except:
+			return None
 
 	def get_channels(self, audio):
 		""" Get the number of channels of the given song
@@ -655,37 +517,7 @@ class Metadata(object):
 
 		Metadata.get_rating(Mutagen, str) -> str
 		"""
-		if format == "mp3":
-			try:
-				return audio["POPM"][0]
-			except:
-				return ""
-		elif format == "flac":
-			try:
-				return audio["rating"][0]
-			except:
-				try:
-					return audio["POPM"][0]
-				except:
-					return ""
-		elif format == "ogg":
-			try:
-				return audio["rating"][0]
-			except:
-				try:
-					return audio["POPM"][0]
-				except:
-					return ""
-		elif format == "m4a":
-			try:
-				return audio["----:com.apple.iTunes:Rating"][0]
-			except:
-				return ""
-		elif format == "wma":
-			try:
-				return audio["WM/Rating"][0]
-			except:
-				return ""
+		return self.get_tag(audio, format, 'rating')
 
 	def get_album_cover(self, file_path):
 		""" Gets the album cover of the given track. Returns it as a string
@@ -693,39 +525,38 @@ class Metadata(object):
 
 		Metadata.get_album_cover(str) -> str
 		"""
-		audio, format = self.get_mutagen_parser(file_path)
+		image = TRACK_CACHE.get_cover(file_path)
+		if image == "":
+			cover_path = COVER_RESOLVER.get_cover_path(
+				os.path.dirname(file_path))
+			if cover_path is not None:
+				return self.convert_image(cover_path)
+			return None
+		else:
+			return image
+
+	def get_embedded_cover(self, audio, format):
+		""" Gets the album cover embedded in the metadata created by the
+		Mutagen module, or an empty string if there isn't one.
+
+		Metadata.get_embedded_cover(Mutagen, str) -> str
+		"""
 		if format == "mp3":
 			try:
-				image = audio["APIC:"].data
+				return audio["APIC:"].data
 			except:
-				image = ""
+				return ""
 		elif format == "m4a":
 			try:
-				image = audio["covr"][0]
+				return audio["covr"][0]
 			except:
-				image = ""
+				return ""
 		elif format == "wma":
 			try:
-				image = unicode(str(audio["WM/Picture"][0]))
+				return unicode(str(audio["WM/Picture"][0]))
 			except:
-				image = ""
-		else:
-			image = ""
-		if image == "":
-			folder = file_path.rsplit('/', 1)[0]
-			files = [f for f in listdir(folder) if os.path.isfile(
-				os.path.join(folder,f))]
-			for i, item in enumerate(files):
-				files[i] = item.lower()
-			for f in files:
-				if f == 'cover.jpg':
-					return self.convert_image(folder +'/cover.jpg')
-				elif f == 'front.jpg':
-					return self.convert_image(folder +'/front.jpg')
-				elif f == 'folder.jpg':
-					return self.convert_image(folder +'/folder.jpg')
-		else:
-			return image
+				return ""
+		return ""
 
 	def convert_image(self, file_path):
 		""" Opens a given image file and returns the bytes of it.
@@ -738,10 +569,12 @@ class Metadata(object):
 		return image
 
 	def format_time(self, time):
-		""" Formats a time given in milliseconds to a format of HH:MM:SS.
+		""" Formats a time given in seconds to a format of HH:MM:SS.
 
 		Metadata.format_time(int) -> str
 		"""
+		if time is None:
+			return ""
 		time = int(time)
 		hours = time / 3600
 		if hours < 1:
@@ -750,8 +583,8 @@ class Metadata(object):
 			hours = str(0) + str(hours) + ':'
 		else:
 			hours = str(hours) + ":"
-		minutes = time / 60
-		if minutes > 10 or hours == '':
+		minutes = (time % 3600) / 60
+		if minutes >= 10 or hours == '':
 			minutes = str(minutes) + ':'
 		else:
 			minutes = str(0) + str(minutes) + ':'
@@ -763,6 +596,42 @@ class Metadata(object):
 
 		return hours + minutes + seconds
 
+	def format_size(self, size):
+		""" Formats a size given in bytes as megabytes.
+
+		Metadata.format_size(int) -> str
+		"""
+		if size is None:
+			return ""
+		return '%.2f MB' % (float(size) / 1024 / 1024)
+
+	def format_bit_rate(self, bit_rate):
+		""" Formats a bit rate given in bits per second as kbps.
+
+		Metadata.format_bit_rate(int) -> str
+		"""
+		if not bit_rate:
+			return "Unknown"
+		return str(bit_rate / 1000) + " kbps"
+
+	def format_sample_rate(self, sample_rate):
+		""" Formats a sample rate given in Hz as kHz.
+
+		Metadata.format_sample_rate(int) -> str
+		"""
+		if not sample_rate:
+			return "Unknown"
+		return '%g kHz' % (sample_rate / 1000.0)
+
+	def format_date(self, date):
+		""" Formats a date given in seconds since the epoch.
+
+		Metadata.format_date(float) -> str
+		"""
+		if date is None:
+			return ""
+		return time.ctime(date)
+
 	def save_mp3_metadata(self, file_path, data):
 		""" Saves the given metadata for an MP3 file.
 
@@ -960,11 +829,77 @@ class Track(object):
 	"""This serves as a container for the metadata of a song. It can be 
 	passed around Beatbox so metadata can be easily accessed.
 	"""
+	## Fields are kept in slots rather than a dictionary, as the library can
+	## have a very large number of Tracks
+	__slots__ = ('file_path', 'title', 'artist', 'album', 'year', 'genre',
+		'album_artist', 'track_number', 'total_tracks', 'disc_number',
+		'total_discs', 'bpm', 'composer', 'comment', 'publisher', 'time',
+		'date_modified', 'size', 'bit_rate', 'sample_rate', 'format',
+		'channels', 'rating')
+	## The columns of the Songs table from_row reads a Track from. Ratings
+	## aren't kept in the library.
+	ROW_COLUMNS = ('path', 'title', 'artist', 'album', 'year', 'genre',
+		'album_artist', 'track_number', 'total_tracks', 'disc_number',
+		'total_discs', 'bpm', 'composer', 'comment', 'publisher', 'time',
+		'date_modified', 'size', 'bit_rate', 'sample_rate', 'format',
+		'channels')
 
 	def __init__(self, file_path):
 		self.file_path = file_path
 		self.set_all()
 
+	@classmethod
+	def from_tags(cls, file_path, format, tags, info):
+		""" Creates a Track from tags and stream info that have already been
+		read, as returned by Metadata.get_tags and Metadata.get_stream_info,
+		without parsing the file again.
+
+		Track.from_tags(str, str, dict, dict) -> Track
+		"""
+		track = cls.__new__(cls)
+		track.file_path = file_path
+		track.set_fields(format, tags, info)
+		return track
+
+	@classmethod
+	def from_row(cls, row):
+		""" Creates a Track from a row of the library's Songs table, with
+		the columns in ROW_COLUMNS, without reading the file. Track and disc
+		numbers the database keeps as integers are turned back into text, as
+		they're read from tags.
+
+		Track.from_row(tuple) -> Track
+		"""
+		(file_path, title, artist, album, year, genre, album_artist,
+			track_number, total_tracks, disc_number, total_discs, bpm,
+			composer, comment, publisher, time, date_modified, size,
+			bit_rate, sample_rate, format, channels) = row
+		track = cls.__new__(cls)
+		track.file_path = file_path
+		track.set_title(row_text(title))
+		track.set_artist(row_text(artist))
+		track.set_album(row_text(album))
+		track.set_year(row_text(year))
+		track.set_genre(row_text(genre))
+		track.set_album_artist(row_text(album_artist))
+		track.set_track_number(row_text(track_number))
+		track.set_total_tracks(row_text(total_tracks))
+		track.set_disc_number(row_text(disc_number))
+		track.set_total_discs(row_text(total_discs))
+		track.set_bpm(row_text(bpm))
+		track.set_composer(row_text(composer))
+		track.set_comment(row_text(comment))
+		track.set_publisher(row_text(publisher))
+		track.set_time(time)
+		track.set_date_modified(row_number(date_modified, float))
+		track.set_size(row_number(size, int))
+		track.set_bit_rate(row_number(bit_rate, int))
+		track.set_sample_rate(row_number(sample_rate, int))
+		track.set_format(format)
+		track.set_channels(channels)
+		track.set_rating('')
+		return track
+
 	def set_all(self):
 		""" Gets all the metadata for the Track
 
@@ -972,28 +907,38 @@ class Track(object):
 		"""
 		md = Metadata()
 		audio, format = md.get_mutagen_parser(self.file_path)
-		self.set_title(md.get_title(audio, format))
-		self.set_artist(md.get_artist(audio, format))
-		self.set_album(md.get_album(audio, format))
-		self.set_year(md.get_date(audio, format))
-		self.set_genre(md.get_genre(audio, format))
-		self.set_album_artist(md.get_album_artist(audio, format))
-		self.set_track_number(md.get_track_number(audio, format))
-		self.set_total_tracks(md.get_total_tracks(audio, format))
-		self.set_disc_number(md.get_disc_number(audio, format))
-		self.set_total_discs(md.get_total_discs(audio, format))
-		self.set_bpm(md.get_bpm(audio, format))
-		self.set_composer(md.get_composer(audio, format))
-		self.set_comment(md.get_comment(audio, format))
-		self.set_publisher(md.get_publisher(audio, format))
-		self.set_time(md.get_track_time(audio))
+		self.set_fields(format, md.get_tags(audio, format),
+			md.get_stream_info(audio))
+
+	def set_fields(self, format, tags, info):
+		""" Sets the metadata of the Track from its tags and stream info, and
+		the file's date modified and size.
+
+		Track.set_fields(str, dict, dict) -> None
+		"""
+		md = Metadata()
+		self.set_title(tags['title'])
+		self.set_artist(tags['artist'])
+		self.set_album(tags['album'])
+		self.set_year(tags['year'])
+		self.set_genre(tags['genre'])
+		self.set_album_artist(tags['album_artist'])
+		self.set_track_number(tags['track_number'])
+		self.set_total_tracks(tags['total_tracks'])
+		self.set_disc_number(tags['disc_number'])
+		self.set_total_discs(tags['total_discs'])
+		self.set_bpm(tags['bpm'])
+		self.set_composer(tags['composer'])
+		self.set_comment(tags['comment'])
+		self.set_publisher(tags['publisher'])
+		self.set_time(info['time'])
 		self.set_date_modified(md.get_date_modified(self.file_path))
 		self.set_size(md.get_size(self.file_path))
-		self.set_bit_rate(md.get_bit_rate(audio))
-		self.set_sample_rate(md.get_sample_rate(audio))
+		self.set_bit_rate(info['bit_rate'])
+		self.set_sample_rate(info['sample_rate'])
 		self.set_format(format)
-		self.set_channels(md.get_channels(audio))
-		self.set_rating(md.get_rating(audio, format))
+		self.set_channels(info['channels'])
+		self.set_rating(tags['rating'])
 
 	def save_metadata(self, data):
 		""" Saves the given metadata.
@@ -1010,6 +955,7 @@ class Track(object):
 			md.save_asf_metadata(audio, data)
 		elif format == 'm4a':
 			md.save_m4a_metadata(audio, data)
+		TRACK_CACHE.discard(self.file_path)
 		self.set_all()
 		return True
 
@@ -1117,28 +1063,28 @@ class Track(object):
 	def set_date_modified(self, date_modified):
 		""" Sets date modified of the Track.
 
-		Track.set_date_modified(str) -> None
+		Track.set_date_modified(float) -> None
 		"""
 		self.date_modified = date_modified
 
 	def set_size(self, size):
 		""" Sets size of the Track.
 
-		Track.set_size(str) -> None
+		Track.set_size(int) -> None
 		"""
 		self.size = size
 
 	def set_bit_rate(self, bit_rate):
 		""" Sets bit rate of the Track.
 
-		Track.set_bit_rate(str) -> None
+		Track.set_bit_rate(int) -> None
 		"""
 		self.bit_rate = bit_rate
 
 	def set_sample_rate(self, sample_rate):
 		""" Sets sample rate of the Track.
 
-		Track.set_sample_rate(str) -> None
+		Track.set_sample_rate(int) -> None
 		"""
 		self.sample_rate = sample_rate
 
@@ -1166,11 +1112,12 @@ class Track(object):
 	def set_time(self, time):
 		""" Sets length of the Track.
 
-		Track.set_time(str) -> None
+		Track.set_time(float) -> None
 		"""
 		self.time = time
 
 	def __str__(self):
+		md = Metadata()
 		return "Title: " + self.title + "\nArtist: " + self.artist + \
 		"\nAlbum: "\
 		+ self.album + "\nYear: " + self.year + "\nGenre: " + self.genre + \
@@ -1179,12 +1126,341 @@ class Track(object):
 		"\nDisc Number: " + self.disc_number  + "\nTotal Discs: " \
 		+ self.total_discs  + "\nBPM: " + self.bpm + "\nComposer: " + \
 		self.composer + "\nPublisher: " + self.publisher + "\nTime: " + \
-		self.time + "\nDate modified: " + self.date_modified + \
-		"\nComment: " + self.comment + "\nSize: " + self.size + "\nBit Rate: " \
-		+ self.bit_rate + "\nSample Rate: " + self.sample_rate + "\nFormat: "\
+		md.format_time(self.time) + "\nDate modified: " + \
+		md.format_date(self.date_modified) + "\nComment: " + self.comment + \
+		"\nSize: " + md.format_size(self.size) + "\nBit Rate: " + \
+		md.format_bit_rate(self.bit_rate) + "\nSample Rate: " + \
+		md.format_sample_rate(self.sample_rate) + "\nFormat: "\
 		 + self.format + "\nChannels: " + self.channels + \
 		"\nRating: " + self.rating
 
+def row_text(value):
+	""" Returns a text field of a Track from its value in the library
+	database, where text that looks like a number may have become one.
+
+	row_text(object) -> unicode
+	"""
+	if value is None:
+		return ''
+	return unicode(value)
+
+def row_number(value, number_type):
+	""" Returns a numeric field of a Track from its value in the library
+	database, where it may be kept as text, or None if it isn't known.
+
+	row_number(object, type) -> number
+	"""
+	if value is None or value == '':
+		return None
+	return number_type(value)
+
+def read_track_and_cover(file_path):
+	""" Reads the given file into a Track, and takes the album cover embedded
+	in it, or an empty string if there isn't one, from the same parse.
+
+	read_track_and_cover(str) -> (Track, str)
+	"""
+	md = Metadata()
+	audio, format = md.get_mutagen_parser(file_path)
+	track = Track.from_tags(file_path, format, md.get_tags(audio, format),
+		md.get_stream_info(audio))
+	return track, md.get_embedded_cover(audio, format)
+
+class TrackCache(object):
+	""" A cache of the Tracks read from audio files, so a file that's
+	shown in several places is only parsed once until it changes. Entries
+	are keyed on the file's path and checked against its (mtime, size)
+	fingerprint whenever they're used. The most recently used Tracks are
+	kept in memory along with their embedded covers, which are read from the
+	same parse, and if a file name is given older Tracks are kept in it
+	between runs. The cache can be used from any thread.
+	"""
+
+	def __init__(self, file_name=None, size=TRACK_CACHE_SIZE,
+		disk_size=TRACK_CACHE_DISK_SIZE, cover_bytes=COVER_CACHE_BYTES):
+		self.file_name = file_name
+		self.size = size
+		self.disk_size = disk_size
+		self.cover_bytes = cover_bytes
+		## path: [fingerprint, Track, cover or None if it hasn't been read]
+		self._entries = collections.OrderedDict()
+		self._cover_total = 0
+		self._disk = None # path: (fingerprint, Track), loaded when needed
+		self._lock = threading.RLock()
+
+	def get_track(self, file_path):
+		""" Returns the Track for the given file, parsing it only if it
+		isn't cached or has changed since it was.
+
+		TrackCache.get_track(str) -> Track
+		"""
+		return self.get_entry(file_path, False)[1]
+
+	def get_cover(self, file_path):
+		""" Returns the album cover embedded in the given file, or an empty
+		string if there isn't one, parsing it only if it isn't cached or has
+		changed since it was.
+
+		TrackCache.get_cover(str) -> str
+		"""
+		return self.get_entry(file_path, True)[2]
+
+	def get_entry(self, file_path, need_cover):
+		""" Returns the up to date [fingerprint, Track, cover] entry for the
+		given file. The file is parsed if there isn't one, or if the cover is
+		needed and hasn't been read.
+
+		TrackCache.get_entry(str, bool) -> list
+		"""
+		fingerprint = Metadata().get_fingerprint(file_path)
+		with self._lock:
+			entry = self._entries.get(file_path)
+			if entry is not None and entry[0] == fingerprint and \
+				(entry[2] is not None or not need_cover):
+				self._entries[file_path] = self._entries.pop(file_path)
+				return entry
+			if entry is None and not need_cover:
+				disk_entry = self.load().get(file_path)
+				if disk_entry is not None and disk_entry[0] == fingerprint:
+					entry = [fingerprint, disk_entry[1], None]
+					self.store(file_path, entry)
+					return entry
+		## Parsed outside the lock so other threads aren't held up
+		entry = [fingerprint] + list(read_track_and_cover(file_path))
+		with self._lock:
+			self.store(file_path, entry)
+		return entry
+
+	def store(self, file_path, entry):
+		""" Adds an entry to the memory cache, dropping the least recently
+		used entries to keep it within its size and the covers within their
+		bytes. Called with the lock held.
+
+		TrackCache.store(str, list) -> None
+		"""
+		self.discard(file_path)
+		self._entries[file_path] = entry
+		self._cover_total += len(entry[2] or '')
+		while len(self._entries) > self.size or \
+			(self._cover_total > self.cover_bytes and len(self._entries) > 1):
+			old_path, old_entry = self._entries.popitem(last=False)
+			self._cover_total -= len(old_entry[2] or '')
+			if self._disk is not None:
+				self._disk[old_path] = (old_entry[0], old_entry[1])
+
+	def discard(self, file_path):
+		""" Removes the given file from the cache, for when it's known to
+		have changed.
+
+		TrackCache.discard(str) -> None
+		"""
+		with self._lock:
+			entry = self._entries.pop(file_path, None)
+			if entry is not None:
+				self._cover_total -= len(entry[2] or '')
+			if self._disk is not None:
+				self._disk.pop(file_path, None)
+
+	def load(self):
+		""" Returns the Tracks kept in the cache's file, reading it the first
+		time it's needed. The file is ignored if it can't be read.
+
+		TrackCache.load() -> OrderedDict
+		"""
+		with self._lock:
+			if self._disk is None:
+				self._disk = collections.OrderedDict()
+				if self.file_name is not None:
+					try:
+						with open(self.file_name, 'rb') as cache_file:
+							self._disk.update(cPickle.load(cache_file))
+					except (IOError, EOFError, AttributeError, ImportError,
+						cPickle.UnpicklingError):
+						pass
+			return self._disk
+
+	def save(self):
+		""" Writes the cached Tracks to the cache's file, most recently used
+		last, keeping at most disk_size of them. The file is written to a
+		temporary file first so a crash while saving can't corrupt it.
+
+		TrackCache.save() -> None
+		"""
+		if self.file_name is None:
+			return None
+		with self._lock:
+			entries = self.load()
+			for file_path, entry in self._entries.iteritems():
+				entries.pop(file_path, None)
+				entries[file_path] = (entry[0], entry[1])
+			entries = entries.items()[-self.disk_size:]
+		temp_name = self.file_name + '.tmp'
+		with open(temp_name, 'wb') as cache_file:
+			cPickle.dump(entries, cache_file, cPickle.HIGHEST_PROTOCOL)
+		os.rename(temp_name, self.file_name)
+
+## The cache every Track shown outside the library is read through
+TRACK_CACHE = TrackCache(TRACK_CACHE_NAME)
+
+class CoverResolver(object):
+	""" Finds the image file used as the cover of the songs in a folder
+	without one embedded. Each folder is listed once, and the file chosen,
+	or that there isn't one, is remembered along with the folder's
+	modification time, so it's only listed again once a file in it has been
+	added, removed, or renamed. The resolver can be used from any thread.
+	"""
+
+	def __init__(self, names=COVER_FILE_NAMES,
+		extensions=COVER_FILE_EXTENSIONS, size=COVER_RESOLVER_SIZE):
+		self.size = size
+		self._folders = collections.OrderedDict() # folder: (mtime, path)
+		self._lock = threading.Lock()
+		self.set_priorities(names, extensions)
+
+	def set_priorities(self, names, extensions):
+		""" Sets the names and extensions of the files used as covers, each
+		in order of preference. Names come before extensions, so cover.png
+		is preferred to front.jpg if 'cover' is before 'front'.
+
+		CoverResolver.set_priorities(list(str), list(str)) -> None
+		"""
+		priorities = {} # lower case file name: priority, lowest first
+		for name in names:
+			for extension in extensions:
+				priorities.setdefault((name + extension).lower(),
+					len(priorities))
+		with self._lock:
+			self._priorities = priorities
+			self._folders.clear()
+
+	def get_cover_path(self, folder):
+		""" Returns the path of the cover file in the given folder, or None if
+		there isn't one.
+
+		CoverResolver.get_cover_path(str) -> str
+		"""
+		try:
+			mtime = os.stat(folder).st_mtime
+		except OSError:
+			return None
+		with self._lock:
+			cached = self._folders.pop(folder, None)
+			if cached is not None and cached[0] == mtime:
+				self._folders[folder] = cached
+				return cached[1]
+			priorities = self._priorities
+		cover_path = self.find_cover(folder, priorities)
+		with self._lock:
+			self._folders.pop(folder, None)
+			self._folders[folder] = (mtime, cover_path)
+			while len(self._folders) > self.size:
+				self._folders.popitem(last=False)
+		return cover_path
+
+	def find_cover(self, folder, priorities):
+		""" Lists the given folder and returns the path of the file with the
+		highest priority, or None if none of them are there.
+
+		CoverResolver.find_cover(str, dict) -> str
+		"""
+		try:
+			names = listdir(folder)
+		except OSError:
+			return None
+		best = None
+		for name in names:
+			priority = priorities.get(name.lower())
+			if priority is not None and (best is None or priority < best[0]) \
+				and os.path.isfile(os.path.join(folder, name)):
+				best = (priority, name)
+		if best is None:
+			return None
+		return os.path.join(folder, best[1])
+
+## The resolver every song's cover file is found through
+COVER_RESOLVER = CoverResolver()
+
+def benchmark(directory, repeat=5):
+	""" Prints the time per file taken to parse the audio files in the given
+	directory with mutagen, then to extract their tags one field at a time
+	and in a single pass. The best of the given number of runs is used.
+
+	benchmark(str, int) -> None
+	"""
+	md = Metadata()
+	file_paths = [os.path.join(directory, f) for f in sorted(listdir(
+		directory)) if md.isValidFile(f)]
+	if not file_paths:
+		print 'No audio files in ' + directory
+		return None
+	parsed = [md.get_mutagen_parser(f) for f in file_paths]
+	per_field = [getattr(md, 'get_' + field) for field in ('title', 'artist',
+		'album', 'date', 'genre', 'album_artist', 'track_number',
+		'total_tracks', 'disc_number', 'total_discs', 'bpm', 'composer',
+		'comment', 'publisher', 'rating')]
+
+	def parse():
+		for file_path in file_paths:
+			md.get_mutagen_parser(file_path)
+
+	def extract_per_field():
+		for audio, format in parsed:
+			for get_field in per_field:
+				get_field(audio, format)
+
+	def extract_single_pass():
+		for audio, format in parsed:
+			md.get_tags(audio, format)
+
+	for name, function in (('mutagen parse', parse),
+		('tags, one field at a time', extract_per_field),
+		('tags, single pass', extract_single_pass)):
+		best = None
+		for i in range(repeat):
+			start = time.time()
+			function()
+			elapsed = time.time() - start
+			if best is None or elapsed < best:
+				best = elapsed
+		print '%s: %.1f us per file' % (name, best / len(file_paths) * 1e6)
+
+def memory_benchmark(count=1000000):
+	""" Prints the memory the given number of Tracks made by Track.from_row
+	take, against the same Tracks kept in a dictionary per instance, as
+	Tracks were before they had slots. Field values are shared between
+	Tracks, so only the Tracks themselves are counted.
+
+	memory_benchmark(int) -> None
+	"""
+	class DictTrack(object):
+		pass
+
+	row = (u'/music/Artist/Album/01 Title.mp3', u'Title', u'Artist', u'Album',
+		u'2001', u'Rock', u'Artist', 1, 12, 1, 1, u'', u'', u'', u'', 215.3,
+		u'1380000000.0', u'8654321', u'320000', u'44100', u'mp3', u'Stereo')
+	start = time.time()
+	tracks = [Track.from_row(row) for i in xrange(count)]
+	elapsed = time.time() - start
+	slotted = sum(sys.getsizeof(track) for track in tracks)
+	dict_tracks = []
+	for track in tracks:
+		dict_track = DictTrack()
+		for field in Track.__slots__:
+			setattr(dict_track, field, getattr(track, field))
+		dict_tracks.append(dict_track)
+	dict_backed = sum(sys.getsizeof(track) + sys.getsizeof(track.__dict__)
+		for track in dict_tracks)
+	print '%d Tracks made from rows in %.2fs' % (count, elapsed)
+	for name, size in (('dictionary per Track', dict_backed),
+		('slots', slotted)):
+		print '%s: %.1f MiB, %d bytes per Track' % (name,
+			size / 1024.0 / 1024.0, size / count)
+
 
 if __name__ == "__main__":
-	pass
+	## metadata.py DIRECTORY benchmarks reading the tags of its audio files,
+	## and metadata.py without one measures the memory of a million Tracks
+	if len(sys.argv) > 1:
+		benchmark(sys.argv[1])
+	else:
+		memory_benchmark()
@@ -194,17 +194,12 @@ class Player(object):
 
     def get_album_art(self, file_path):
         """ Gets the album art of the given file_path and sets it as PlayerGui's
-        album cover QLabel. The image is set as the default image if none is
-        found.
+        album cover QLabel. The art is found and decoded in a thread, and the
+        default image is set if none is found.
 
         Player.get_album_art(str) -> None
         """
-        artwork = self.metadata.get_album_cover(file_path)
-        if not artwork:
-            image = open('images/cover.png', 'rb')
-            artwork = image.read()
-            image.close()
-        self.parent.set_album_art(artwork)
+        self.parent.load_album_art(file_path)
 
     def set_shuffle_mode(self):
         """ Sets shuffle mode. True represents 'shuffle', False represents 'no 
@@ -22,6 +22,9 @@ without express permission, with exclusion of commercial application.
 import cPickle
 import os.path
 
+#Beatbox libraries
+import watcher
+
 ## DEFAULT PREFERENCES
 LIBRARY_COLUMNS = [
     {'Name':'Title', 'Activated':True,'Database Name': 'title', 'Column':0},
@@ -96,6 +99,13 @@ class Preferences(object):
 		self.preferences['library_directories'] = self.set_library_dirs_pref()
 		self.preferences['library_columns'] = self.set_library_columns_pref()
 		self.preferences['language'] = self.set_language_pref()
+		self.preferences['ingest_workers'] = self.set_ingest_workers_pref()
+		self.preferences['io_ordered_ingest'] = \
+			self.set_io_ordered_ingest_pref()
+		self.preferences['ingest_thumbnails'] = \
+			self.set_ingest_thumbnails_pref()
+		self.preferences['watch_poll_interval'] = \
+			self.set_watch_poll_interval_pref()
 		cPickle.dump(self.preferences, output)
 		output.close()
 
@@ -170,4 +180,69 @@ class Preferences(object):
 		"""
 		return self.preferences.get('language', 'English')
 
+	def set_ingest_workers_pref(self):
+		""" Gets the current number of library ingest workers to be saved.
+
+		Preferences.set_ingest_workers_pref() -> int
+		"""
+		return self.parent.beatbox_gui.tabview_gui.library_gui.library.\
+		ingest_workers
+
+	def get_ingest_workers_pref(self):
+		""" Gets the saved number of library ingest workers. 0 means one
+		worker per CPU.
+
+		Preferences.get_ingest_workers_pref() -> int
+		"""
+		return self.preferences.get('ingest_workers', 0)
+
+	def set_io_ordered_ingest_pref(self):
+		""" Gets whether new files are read in disk order, to be saved.
+
+		Preferences.set_io_ordered_ingest_pref() -> bool
+		"""
+		return self.parent.beatbox_gui.tabview_gui.library_gui.library.\
+		io_ordered_ingest
+
+	def get_io_ordered_ingest_pref(self):
+		""" Gets whether new files are read in disk order.
+
+		Preferences.get_io_ordered_ingest_pref() -> bool
+		"""
+		return self.preferences.get('io_ordered_ingest', False)
+
+	def set_ingest_thumbnails_pref(self):
+		""" Gets whether thumbnails of new files' covers are made as they're
+		read, to be saved.
+
+		Preferences.set_ingest_thumbnails_pref() -> bool
+		"""
+		return self.parent.beatbox_gui.tabview_gui.library_gui.library.\
+		ingest_thumbnails
+
+	def get_ingest_thumbnails_pref(self):
+		""" Gets whether thumbnails of new files' covers are made as they're
+		read.
+
+		Preferences.get_ingest_thumbnails_pref() -> bool
+		"""
+		return self.preferences.get('ingest_thumbnails', False)
+
+	def set_watch_poll_interval_pref(self):
+		""" Gets the seconds between polls of the library directories, used
+		when inotify isn't available, to be saved.
+
+		Preferences.set_watch_poll_interval_pref() -> int
+		"""
+		return self.parent.beatbox_gui.tabview_gui.library_gui.\
+		library_watcher.poll_interval
+
+	def get_watch_poll_interval_pref(self):
+		""" Gets the saved seconds between polls of the library directories.
+
+		Preferences.get_watch_poll_interval_pref() -> int
+		"""
+		return self.preferences.get('watch_poll_interval',
+			watcher.POLL_INTERVAL)
+
 
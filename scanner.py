@@ -0,0 +1,489 @@
+# -◊- coding: utf-8 -◊-
+
+"""
+Beatbox 1.0
+
+Copyright (C) 2013 Luke Hansford - l.s.hansford@gmail.com
+
+DESCRIPTION
+
+This module contains all functions for finding the audio files in the library
+directories.
+
+LICENSE
+
+I, Luke Hansford, Hereby grant the rights to distribute, modify, and edit the
+source to Beatbox 1.0, on the condition that this agreement, and my ownership
+of the code contained herewithin be maintained.
+
+Furthurmore, I grant the right to use excerpts from the source to Beatbox 1.0
+without express permission, with exclusion of commercial application.
+"""
+
+#Standard libraries
+import array
+import itertools
+import os
+import os.path
+import Queue
+import random
+import shutil
+import stat
+import struct
+import sys
+import tempfile
+import threading
+import time
+try:
+	import fcntl
+except ImportError:
+	fcntl = None # Not a Unix, so physical offsets can't be found
+try:
+	import ctypes
+	import ctypes.util
+except ImportError:
+	ctypes = None
+
+#3rd party libraries
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir
+	except ImportError:
+		scandir = None # Falls back to listdir and a stat per entry
+
+#Beatbox libraries
+import metadata
+
+
+IO_ORDER_WINDOW = 500 # Files found while scanning that are sorted together
+READAHEAD_HEAD = 64 * 1024 # Bytes read ahead from the start of a file
+READAHEAD_TAIL = 16 * 1024 # Bytes read ahead from the end, for trailing tags
+POSIX_FADV_WILLNEED = 3
+POSIX_FADV_DONTNEED = 4
+## The FS_IOC_FIEMAP ioctl, as the signed int fcntl.ioctl expects
+FS_IOC_FIEMAP = struct.unpack('i', struct.pack('I', 0xC020660B))[0]
+FIEMAP_HEADER = '=QQLLLL' # start, length, flags, mapped, count, reserved
+FIEMAP_EXTENT_SIZE = 56
+BENCHMARK_FILE_SIZE = 512 # KiB in each file of a synthetic benchmark tree
+## File systems held in memory, where emptying the cache has no effect
+MEMORY_FILE_SYSTEMS = ('tmpfs', 'ramfs')
+
+if hasattr(os, 'posix_fadvise'):
+	posix_fadvise = os.posix_fadvise
+else:
+	try:
+		libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+		libc.posix_fadvise.argtypes = [ctypes.c_int, ctypes.c_int64,
+			ctypes.c_int64, ctypes.c_int]
+		posix_fadvise = libc.posix_fadvise
+	except (AttributeError, OSError, TypeError):
+		posix_fadvise = None # Readahead hints are skipped
+
+def list_directory(directory):
+	""" Lists a directory, returning the paths of the files in it and the
+	paths, device numbers, and inode numbers of its subdirectories. Uses
+	scandir when it's available, as the type of each entry comes with the
+	listing so files don't need to be stat'd. Symbolic links to directories
+	are followed, and given by their real path so each file is only ever
+	found under one path.
+
+	list_directory(str) -> (list(str), list((str, int, int)))
+	"""
+	files = []
+	directories = []
+	if scandir is not None:
+		for entry in scandir(directory):
+			if entry.is_dir(follow_symlinks=False):
+				info = entry.stat(follow_symlinks=False)
+				directories.append((entry.path, info.st_dev, info.st_ino))
+			elif entry.is_symlink() and entry.is_dir():
+				directories.append(linked_directory(entry.path))
+			elif metadata.get_format(entry.name) is not None and \
+				entry.is_file():
+				files.append(entry.path)
+	else:
+		for name in os.listdir(directory):
+			path = os.path.join(directory, name)
+			try:
+				info = os.lstat(path)
+			except OSError:
+				continue
+			if stat.S_ISDIR(info.st_mode):
+				directories.append((path, info.st_dev, info.st_ino))
+			elif stat.S_ISLNK(info.st_mode) and os.path.isdir(path):
+				directories.append(linked_directory(path))
+			elif metadata.get_format(name) is not None and \
+				os.path.isfile(path):
+				files.append(path)
+	return files, directories
+
+def linked_directory(path):
+	""" Returns the real path, device number, and inode number of the
+	directory a symbolic link points to.
+
+	linked_directory(str) -> (str, int, int)
+	"""
+	real_path = os.path.realpath(path)
+	info = os.stat(real_path)
+	return real_path, info.st_dev, info.st_ino
+
+def normalise_directories(directories):
+	""" Returns the given directories as real paths with duplicates, and
+	directories inside another of the directories, removed, so no directory
+	is scanned twice.
+
+	normalise_directories(list(str)) -> list(str)
+	"""
+	real_paths = []
+	for directory in directories:
+		real_path = os.path.realpath(directory)
+		if real_path not in real_paths:
+			real_paths.append(real_path)
+	return [d for d in real_paths if not any(d != root and d.startswith(
+		root.rstrip('/') + '/') for root in real_paths)]
+
+class DirectoryScanner(object):
+	""" Finds the audio files in a list of directories, streaming them out as
+	each directory is listed rather than once the whole scan is done. Every
+	directory is only listed once, however many times it's reached through
+	nested directories or symbolic links, including links back up the tree.
+	Each device (a separate disk, or a mount point inside one of the
+	directories) is walked by its own thread, so independent disks are
+	scanned in parallel while one disk is never made to seek between two
+	walks.
+	"""
+
+	def __init__(self, directories, cancelled=None):
+		self.directories = list(directories)
+		self.cancelled = cancelled
+		self._lock = threading.Lock()
+		self._pending = {} # device -> directories waiting to be listed
+		self._threads = {} # device -> thread walking it
+		self._outstanding = 0 # Directories added but not listed yet
+		self._visited = set() # (device, inode) of every directory added
+		self._results = Queue.Queue()
+		self._stopped = False
+		self._error = None # exc_info of the first walk that failed
+
+	def scan(self):
+		""" Yields the path of every audio file found. Stopping early, or the
+		cancelled function returning True, stops the walking threads. If a
+		walking thread fails, the scan stops and its exception is raised here.
+
+		DirectoryScanner.scan() -> iter(str)
+		"""
+		roots = []
+		for directory in normalise_directories(self.directories):
+			try:
+				info = os.stat(directory)
+			except OSError:
+				continue # Unplugged drives are left alone
+			roots.append((directory, info.st_dev, info.st_ino))
+		if not roots:
+			return
+		for directory, device, inode in roots:
+			self.add_directory(directory, device, inode)
+		try:
+			while True:
+				files = self._results.get()
+				if files is None:
+					if self._error is not None:
+						raise self._error[0], self._error[1], self._error[2]
+					return
+				for file_path in files:
+					yield file_path
+		finally:
+			self.stop()
+
+	def stop(self):
+		""" Stops the walking threads at the next directory.
+
+		DirectoryScanner.stop() -> None
+		"""
+		with self._lock:
+			self._stopped = True
+
+	def add_directory(self, directory, device, inode):
+		""" Queues a directory to be listed by the thread for its device,
+		starting the thread if the device isn't being walked. Directories that
+		have already been queued, under this path or any other, are skipped.
+
+		DirectoryScanner.add_directory(str, int, int) -> None
+		"""
+		with self._lock:
+			if (device, inode) in self._visited:
+				return None
+			self._visited.add((device, inode))
+			self._outstanding += 1
+			self._pending.setdefault(device, []).append(directory)
+			if device not in self._threads:
+				thread = threading.Thread(target=self.walk_device,
+					args=(device,))
+				thread.daemon = True
+				self._threads[device] = thread
+				thread.start()
+
+	def walk_device(self, device):
+		""" Lists the device's queued directories until there are none left,
+		queueing their subdirectories in turn. Run by one thread per device.
+		Unreadable directories are skipped; any other failure stops the scan
+		and is kept for scan to raise, so it's never left waiting on a thread
+		that has died.
+
+		DirectoryScanner.walk_device(int) -> None
+		"""
+		while True:
+			with self._lock:
+				pending = self._pending[device]
+				if self._stopped or not pending:
+					del self._threads[device]
+					return None
+				directory = pending.pop()
+			try:
+				if self.cancelled is not None and self.cancelled():
+					self.stop()
+				try:
+					files, directories = list_directory(directory)
+				except OSError:
+					files, directories = [], []
+				if files:
+					self._results.put(files)
+				for subdirectory, subdevice, inode in directories:
+					self.add_directory(subdirectory, subdevice, inode)
+			except Exception:
+				with self._lock:
+					if self._error is None:
+						self._error = sys.exc_info()
+					self._stopped = True
+			finally:
+				with self._lock:
+					self._outstanding -= 1
+					done = self._outstanding == 0 or self._stopped
+				if done:
+					self._results.put(None)
+
+def scan_directories(directories, cancelled=None):
+	""" Yields the path of every audio file in the given directories as it's
+	found.
+
+	scan_directories(list(str), function) -> iter(str)
+	"""
+	return DirectoryScanner(directories, cancelled).scan()
+
+
+def physical_offset(file_path):
+	""" Returns the offset on disk of the start of the given file using the
+	FIEMAP ioctl, or None if the file system or platform doesn't support it.
+
+	physical_offset(str) -> int
+	"""
+	if fcntl is None:
+		return None
+	try:
+		fd = os.open(file_path, os.O_RDONLY)
+	except OSError:
+		return None
+	try:
+		request = array.array('B', struct.pack(FIEMAP_HEADER, 0,
+			2 ** 64 - 1, 0, 0, 1, 0) + '\0' * FIEMAP_EXTENT_SIZE)
+		fcntl.ioctl(fd, FS_IOC_FIEMAP, request, True)
+		if struct.unpack_from('=L', request, 20)[0] == 0:
+			return None # Empty, or its data is inline
+		return struct.unpack_from('=Q', request,
+			struct.calcsize(FIEMAP_HEADER) + 8)[0]
+	except (IOError, OSError):
+		return None
+	finally:
+		os.close(fd)
+
+def io_order_key(file_path):
+	""" Returns a key that sorts files in the order they're laid out on disk:
+	by device, then by physical offset where it can be found, otherwise by
+	inode, which most file systems allocate roughly in disk order.
+
+	io_order_key(str) -> tuple
+	"""
+	try:
+		info = os.stat(file_path)
+	except OSError:
+		return (0, 0, 0)
+	offset = physical_offset(file_path)
+	if offset is None:
+		return (info.st_dev, 1, info.st_ino)
+	return (info.st_dev, 0, offset)
+
+def advise_readahead(file_path, advice=POSIX_FADV_WILLNEED):
+	""" Tells the kernel the start and end of the given file, where the tags
+	are, will be read soon, so it can fetch them in the background. Does
+	nothing if posix_fadvise isn't available.
+
+	advise_readahead(str, int) -> None
+	"""
+	if posix_fadvise is None:
+		return None
+	try:
+		fd = os.open(file_path, os.O_RDONLY)
+	except OSError:
+		return None
+	try:
+		if advice != POSIX_FADV_WILLNEED:
+			posix_fadvise(fd, 0, 0, advice)
+			return None
+		size = os.fstat(fd).st_size
+		posix_fadvise(fd, 0, READAHEAD_HEAD, advice)
+		if size > READAHEAD_HEAD:
+			tail = max(READAHEAD_HEAD, size - READAHEAD_TAIL)
+			posix_fadvise(fd, tail, size - tail, advice)
+	finally:
+		os.close(fd)
+
+def io_order(file_paths, window=IO_ORDER_WINDOW):
+	""" Yields the given files, which can be a stream of files still being
+	found, sorted into disk order a window at a time, so the disk reads them
+	in one sweep rather than seeking back and forth. Readahead isn't
+	requested here, as a pool's feeder takes every file from the generator
+	long before they're read, so readers call advise_readahead just before
+	reading each file.
+
+	io_order(iter(str), int) -> iter(str)
+	"""
+	file_paths = iter(file_paths)
+	while True:
+		batch = [(io_order_key(f), f) for f in \
+			itertools.islice(file_paths, window)]
+		if not batch:
+			return
+		batch.sort()
+		for key, file_path in batch:
+			yield file_path
+
+def read_tags_region(file_path):
+	""" Reads the start and end of a file, roughly as a tag parser does. Used
+	by the benchmark.
+
+	read_tags_region(str) -> None
+	"""
+	with open(file_path, 'rb') as audio_file:
+		audio_file.read(READAHEAD_HEAD)
+		audio_file.seek(-min(READAHEAD_TAIL, os.fstat(
+			audio_file.fileno()).st_size), os.SEEK_END)
+		audio_file.read()
+
+def create_benchmark_tree(directory, count, size):
+	""" Creates a tree of count files of the given size for the benchmark.
+	They're written in a random order, so the order they're laid out on disk
+	doesn't match the order they're found in.
+
+	create_benchmark_tree(str, int, int) -> None
+	"""
+	names = ['%03d/%05d.mp3' % (i % 100, i) for i in range(count)]
+	random.shuffle(names)
+	block = os.urandom(size)
+	for name in names:
+		file_path = os.path.join(directory, name)
+		if not os.path.isdir(os.path.dirname(file_path)):
+			os.makedirs(os.path.dirname(file_path))
+		with open(file_path, 'wb') as audio_file:
+			audio_file.write(block)
+	os.system('sync')
+
+def file_system_type(path):
+	""" Returns the type of the file system the given path is on, from the
+	mount with the longest mount point containing it, or None if the mounts
+	can't be read.
+
+	file_system_type(str) -> str
+	"""
+	path = os.path.realpath(path)
+	best_match = (-1, None)
+	try:
+		with open('/proc/mounts') as mounts:
+			for line in mounts:
+				fields = line.split()
+				if len(fields) < 3:
+					continue
+				## Spaces and other characters in mount points are escaped
+				mount_point = fields[1].decode('string_escape')
+				if path == mount_point or path.startswith(
+					mount_point.rstrip('/') + '/'):
+					best_match = max(best_match, (len(mount_point), fields[2]))
+	except IOError:
+		return None
+	return best_match[1]
+
+def check_benchmark_directory(directory, size=0):
+	""" Returns a reason the benchmark can't be run in the given directory,
+	or None if it can. Directories in memory are refused, as their files
+	can't be dropped from the cache, as are directories without size bytes
+	free for a synthetic tree.
+
+	check_benchmark_directory(str, int) -> str
+	"""
+	if not os.path.isdir(directory):
+		return directory + ' is not a directory.'
+	file_system = file_system_type(directory)
+	if file_system in MEMORY_FILE_SYSTEMS:
+		return directory + ' is on ' + file_system + ', which is held in ' + \
+			'memory, so reads from it are never cold.'
+	if file_system is None:
+		print 'Warning: the file system of ' + directory + ' is unknown, ' + \
+			'so the results are meaningless if it is held in memory.'
+	info = os.statvfs(directory)
+	if size > info.f_bavail * info.f_frsize:
+		return directory + ' has less than ' + str(size / (1024 * 1024)) + \
+			' MiB free.'
+	return None
+
+def benchmark(directory):
+	""" Compares the rate files in the given directory can be read from a cold
+	cache in the order they're found against disk order with readahead
+	requested before each file is read, as the ingest workers do, and prints
+	the results. The cache is emptied with POSIX_FADV_DONTNEED, so the files
+	need to have been written out to disk first.
+
+	benchmark(str) -> None
+	"""
+	file_paths = list(scan_directories([directory]))
+	for name, order, readahead in (('found order', lambda files: files,
+		False), ('disk order', io_order, True)):
+		for file_path in file_paths:
+			advise_readahead(file_path, POSIX_FADV_DONTNEED)
+		start = time.time()
+		for file_path in order(file_paths):
+			if readahead:
+				advise_readahead(file_path)
+			read_tags_region(file_path)
+		elapsed = time.time() - start
+		print '%s: %d files in %.2fs, %.0f files/s' % (name, len(file_paths),
+			elapsed, len(file_paths) / max(elapsed, 1e-6))
+
+
+if __name__ == "__main__":
+	## scanner.py directory benchmarks the audio files already in directory.
+	## scanner.py directory files [KiB] creates a synthetic tree of that many
+	## files, BENCHMARK_FILE_SIZE KiB each by default, in a temporary
+	## directory inside directory, and removes it after. Either way the
+	## directory must be on a disk, not a file system held in memory.
+	if len(sys.argv) < 2:
+		print 'Usage: scanner.py directory [files [KiB per file]]'
+		sys.exit(2)
+	target_directory = sys.argv[1]
+	file_count = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+	file_size = 1024 * (int(sys.argv[3]) if len(sys.argv) > 3 else
+		BENCHMARK_FILE_SIZE)
+	problem = check_benchmark_directory(target_directory,
+		file_count * file_size)
+	if problem is not None:
+		print 'Benchmark not run. ' + problem
+		sys.exit(1)
+	if not file_count:
+		benchmark(target_directory)
+	else:
+		benchmark_directory = tempfile.mkdtemp(dir=target_directory)
+		try:
+			create_benchmark_tree(benchmark_directory, file_count, file_size)
+			benchmark(benchmark_directory)
+		finally:
+			shutil.rmtree(benchmark_directory)
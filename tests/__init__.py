@@ -0,0 +1,22 @@
+# -◊- coding: utf-8 -◊-
+
+"""
+Beatbox 1.0
+
+Copyright (C) 2013 Luke Hansford - l.s.hansford@gmail.com
+
+DESCRIPTION
+
+The tests for Beatbox, run from the Beatbox directory with:
+
+	python -m unittest discover tests
+
+LICENSE
+
+I, Luke Hansford, Hereby grant the rights to distribute, modify, and edit the
+source to Beatbox 1.0, on the condition that this agreement, and my ownership
+of the code contained herewithin be maintained.
+
+Furthurmore, I grant the right to use excerpts from the source to Beatbox 1.0
+without express permission, with exclusion of commercial application.
+"""
@@ -0,0 +1,151 @@
+# -◊- coding: utf-8 -◊-
+
+"""
+Beatbox 1.0
+
+Copyright (C) 2013 Luke Hansford - l.s.hansford@gmail.com
+
+DESCRIPTION
+
+This module contains the tests for the database connection manager.
+
+LICENSE
+
+I, Luke Hansford, Hereby grant the rights to distribute, modify, and edit the
+source to Beatbox 1.0, on the condition that this agreement, and my ownership
+of the code contained herewithin be maintained.
+
+Furthurmore, I grant the right to use excerpts from the source to Beatbox 1.0
+without express permission, with exclusion of commercial application.
+"""
+
+#Standard libraries
+import os.path
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+#Beatbox libraries
+import database
+
+
+class WriterThreadTest(unittest.TestCase):
+	""" Tests that failing changes and callbacks are reported without losing
+	the other changes or stopping the writer.
+	"""
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.manager = database.ConnectionManager(os.path.join(
+			self.directory, 'test.db'))
+		self.manager.execute('CREATE TABLE numbers(number INT UNIQUE)')
+
+	def tearDown(self):
+		self.call(self.manager.close)
+		shutil.rmtree(self.directory)
+
+	def call(self, function):
+		""" Calls the given function, failing rather than hanging if it
+		blocks.
+		"""
+		thread = threading.Thread(target=function)
+		thread.daemon = True
+		thread.start()
+		thread.join(10)
+		self.assertFalse(thread.is_alive(), function.__name__ + ' blocked')
+
+	def flush(self):
+		self.call(self.manager.flush)
+
+	def numbers(self):
+		return [row[0] for row in self.manager.reader().execute(
+			'SELECT number FROM numbers ORDER BY number')]
+
+	def test_failing_callback(self):
+		def fail(result):
+			raise ValueError('Callback failed')
+		results = []
+		self.manager.execute('INSERT INTO numbers VALUES (1)', callback=fail)
+		self.manager.execute('INSERT INTO numbers VALUES (2)',
+			callback=results.append)
+		self.flush()
+		self.manager.execute('INSERT INTO numbers VALUES (3)')
+		self.flush()
+		self.assertEqual(len(results), 1)
+		self.assertEqual(self.numbers(), [1, 2, 3])
+		self.assertTrue(self.manager._writer.is_alive())
+
+	def test_failing_change(self):
+		results = []
+		self.manager.execute('INSERT INTO numbers VALUES (1)')
+		self.manager.execute('INSERT INTO numbers VALUES (1)',
+			callback=results.append)
+		self.manager.execute('INSERT INTO numbers VALUES (2)')
+		self.flush()
+		self.assertEqual(results, [])
+		self.assertEqual(self.numbers(), [1, 2])
+
+	def test_write_does_not_wait_for_commit(self):
+		started = threading.Event()
+		release = threading.Event()
+		def slow_change(connection):
+			started.set()
+			release.wait(10)
+		self.manager.write(slow_change)
+		self.assertTrue(started.wait(10))
+		start = time.time()
+		self.manager.execute('INSERT INTO numbers VALUES (1)')
+		self.assertTrue(time.time() - start < 1)
+		release.set()
+		self.flush()
+		self.assertEqual(self.numbers(), [1])
+
+	def test_close_commits_queued_changes(self):
+		self.manager.write(lambda connection: time.sleep(0.2))
+		self.manager.execute('INSERT INTO numbers VALUES (1)')
+		self.manager.execute('INSERT INTO numbers VALUES (2)')
+		self.call(self.manager.close)
+		self.assertEqual(self.numbers(), [1, 2])
+
+	def test_dead_writer_is_restarted(self):
+		self.flush()
+		self.manager._writer.jobs.put(None) # Stops the writer
+		self.manager._writer.join(10)
+		self.manager.execute('INSERT INTO numbers VALUES (1)')
+		self.flush()
+		self.assertEqual(self.numbers(), [1])
+
+class MigrateTest(unittest.TestCase):
+	""" Tests that a failed migration leaves the database at the last version
+	that was upgraded to.
+	"""
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.manager = database.ConnectionManager(os.path.join(
+			self.directory, 'test.db'))
+
+	def tearDown(self):
+		self.manager.close()
+		shutil.rmtree(self.directory)
+
+	def test_failed_migration(self):
+		def create(connection):
+			connection.execute('CREATE TABLE numbers(number INT)')
+		def fail(connection):
+			connection.execute('ALTER TABLE numbers ADD COLUMN name TEXT')
+			raise sqlite3.OperationalError('Migration failed')
+		self.assertRaises(sqlite3.OperationalError, self.manager.migrate,
+			[create, fail])
+		connection = self.manager.reader()
+		self.assertEqual(connection.execute('PRAGMA user_version')
+			.fetchone()[0], 1)
+		self.assertEqual([row[1] for row in connection.execute(
+			'PRAGMA table_info(numbers)')], [u'number'])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,83 @@
+# -◊- coding: utf-8 -◊-
+
+"""
+Beatbox 1.0
+
+Copyright (C) 2013 Luke Hansford - l.s.hansford@gmail.com
+
+DESCRIPTION
+
+This module contains the tests for the fast tag reader, which must read the
+same metadata as mutagen or leave the file to it.
+
+LICENSE
+
+I, Luke Hansford, Hereby grant the rights to distribute, modify, and edit the
+source to Beatbox 1.0, on the condition that this agreement, and my ownership
+of the code contained herewithin be maintained.
+
+Furthurmore, I grant the right to use excerpts from the source to Beatbox 1.0
+without express permission, with exclusion of commercial application.
+"""
+
+#Standard libraries
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+#Beatbox libraries
+import fasttags
+import metadata
+
+
+class ReadTrackTest(unittest.TestCase):
+	""" Tests reading tags with the fast reader.
+	"""
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def assertSameTrack(self, track, expected):
+		for field in metadata.Track.__slots__:
+			self.assertEqual(getattr(track, field), getattr(expected, field),
+				field)
+
+	def test_matches_mutagen(self):
+		fasttags.create_benchmark_corpus(self.directory, 3, 1024)
+		file_paths = sorted(os.listdir(self.directory))
+		self.assertEqual(len(file_paths), 6)
+		for name in file_paths:
+			file_path = os.path.join(self.directory, name)
+			track = fasttags.read_track(file_path)
+			self.assertNotEqual(track, None, name)
+			self.assertSameTrack(track, metadata.Track(file_path))
+
+	def test_tags(self):
+		fasttags.create_benchmark_corpus(self.directory, 2, 1024)
+		for name in ('00001.flac', '00001.mp3'):
+			track = fasttags.read_track(os.path.join(self.directory, name))
+			self.assertEqual(track.title, u'Track 1')
+			self.assertEqual(track.artist, u'Artist 1')
+			self.assertEqual(track.album, u'Album 1')
+			self.assertEqual(track.format, name.split('.')[1])
+
+	def test_unreadable_files_are_left_to_mutagen(self):
+		for name, data in (('empty.mp3', ''), ('garbage.flac', 'x' * 1000),
+			('truncated.flac', 'fLaC\x80\x00\x00\x22')):
+			file_path = os.path.join(self.directory, name)
+			with open(file_path, 'wb') as audio_file:
+				audio_file.write(data)
+			self.assertEqual(fasttags.read_track(file_path), None, name)
+
+	def test_missing_file(self):
+		self.assertEqual(fasttags.read_track(os.path.join(self.directory,
+			'missing.mp3')), None)
+
+
+if __name__ == "__main__":
+	unittest.main()
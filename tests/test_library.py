@@ -0,0 +1,499 @@
+# -◊- coding: utf-8 -◊-
+
+"""
+Beatbox 1.0
+
+Copyright (C) 2013 Luke Hansford - l.s.hansford@gmail.com
+
+DESCRIPTION
+
+This module contains the tests for the library database.
+
+LICENSE
+
+I, Luke Hansford, Hereby grant the rights to distribute, modify, and edit the
+source to Beatbox 1.0, on the condition that this agreement, and my ownership
+of the code contained herewithin be maintained.
+
+Furthurmore, I grant the right to use excerpts from the source to Beatbox 1.0
+without express permission, with exclusion of commercial application.
+"""
+
+#Standard libraries
+import multiprocessing
+import os
+import os.path
+import shutil
+import sqlite3
+import struct
+import tempfile
+import unittest
+
+#3rd party libraries
+from mutagen.flac import FLAC
+
+#Beatbox libraries
+import database
+import library
+import metadata
+import preferences
+import scanner
+
+## A FLAC stream info block for 200 seconds of 44.1 kHz stereo
+FLAC_STREAM_INFO = struct.pack('>HH', 4096, 4096) + '\x00' * 6 + \
+	struct.pack('>Q', (44100 << 44) | (1 << 41) | (15 << 36) | 44100 * 200) + \
+	'\x00' * 16
+
+def create_flac(file_path, title):
+	""" Writes a FLAC file with the given title and a few silent frames.
+	"""
+	with open(file_path, 'wb') as audio_file:
+		audio_file.write('fLaC\x80' + struct.pack('>I',
+			len(FLAC_STREAM_INFO))[1:] + FLAC_STREAM_INFO + '\xff\xf8' + \
+			'\x00' * 2000)
+	audio = FLAC(file_path)
+	audio['title'] = title
+	audio.save()
+
+class Localisation(object):
+	ADDING_FILES_STRING = 'Adding songs to library...'
+
+class Preferences(object):
+	""" The preferences a Library is made with.
+	"""
+
+	def __init__(self, directories, workers):
+		self.directories = directories
+		self.workers = workers
+
+	def get_library_dirs_pref(self):
+		return list(self.directories)
+
+	def get_ingest_workers_pref(self):
+		return self.workers
+
+	def get_io_ordered_ingest_pref(self):
+		return False
+
+	def get_ingest_thumbnails_pref(self):
+		return False
+
+class Parent(object):
+	""" Stands in for the LibraryGui a Library belongs to.
+	"""
+
+	def __init__(self, directories, workers=1):
+		self.localisation = Localisation()
+		self.preferences = Preferences(directories, workers)
+
+
+class ParseTimeTest(unittest.TestCase):
+	""" Tests converting formatted track lengths to seconds.
+	"""
+
+	def test_minutes_and_seconds(self):
+		self.assertEqual(library.parse_time('4:10'), 250)
+		self.assertEqual(library.parse_time('0:07'), 7)
+
+	def test_hours(self):
+		self.assertEqual(library.parse_time('01:02:03'), 3723)
+		self.assertEqual(library.parse_time('12:00:00'), 43200)
+
+	def test_legacy_total_minutes(self):
+		## Older versions wrote the total minutes after the hours
+		self.assertEqual(library.parse_time('01:61:40'), 3700)
+		self.assertEqual(library.parse_time('02:120:00'), 7200)
+
+	def test_invalid(self):
+		self.assertEqual(library.parse_time(None), None)
+		self.assertEqual(library.parse_time(''), None)
+		self.assertEqual(library.parse_time('4:1x'), None)
+
+	def test_format_time_round_trip(self):
+		md = metadata.Metadata()
+		for seconds in (0, 59, 250, 3599, 3600, 3700, 7322, 36000):
+			self.assertEqual(library.parse_time(md.format_time(seconds)),
+				seconds)
+		self.assertEqual(md.format_time(3700), '01:01:40')
+		self.assertEqual(md.format_time(250), '4:10')
+
+class IngestChunkSizeTest(unittest.TestCase):
+	""" Tests the number of files sent to each ingest worker at a time.
+	"""
+
+	def test_stream(self):
+		self.assertEqual(library.ingest_chunk_size(0, 4),
+			library.STREAM_CHUNK_SIZE)
+
+	def test_list(self):
+		self.assertEqual(library.ingest_chunk_size(100, 4), 3)
+		self.assertEqual(library.ingest_chunk_size(10, 4), 1)
+		self.assertEqual(library.ingest_chunk_size(250000, 4), 64)
+
+class MigrationsTest(unittest.TestCase):
+	""" Tests upgrading a library database made by an older version of
+	Beatbox to the current schema.
+	"""
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.database_name = os.path.join(self.directory, 'library.db')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def create_database(self, version, rows):
+		""" Creates a database at the given schema version holding the
+		given rows of (path, time, size, bit rate, sample rate, date added,
+		date modified, plays), formatted as they were then.
+		"""
+		connection = sqlite3.connect(self.database_name)
+		for migration in library.LIBRARY_MIGRATIONS[:version]:
+			migration(connection)
+		connection.executemany('INSERT INTO Songs(path, title, time, size, \
+			bit_rate, sample_rate, date_added, date_modified, plays) VALUES \
+			(?, ?, ?, ?, ?, ?, ?, ?, ?)', [(row[0], os.path.basename(row[0]))
+			+ row[1:] for row in rows])
+		connection.execute('PRAGMA user_version = %d' % version)
+		connection.commit()
+		connection.close()
+
+	def migrate(self):
+		""" Migrates the database and returns a connection to it.
+		"""
+		manager = database.ConnectionManager(self.database_name)
+		manager.migrate(library.LIBRARY_MIGRATIONS)
+		manager.close()
+		connection = sqlite3.connect(self.database_name)
+		self.addCleanup(connection.close)
+		return connection
+
+	def test_formatted_columns_become_numbers(self):
+		self.create_database(2, [
+			('/music/a.mp3', '4:10', '5.00 MB', '320 kbps', '44100',
+				'2013-05-01 12:00:00', 'Wed May  1 12:00:00 2013', 3),
+			('/music/b.mp3', '01:61:40', '0.50 MB', '128 kbps', '48000',
+				'2013-05-02 12:00:00', 'Thu May  2 12:00:00 2013', 0)])
+		connection = self.migrate()
+		rows = connection.execute('SELECT path, time, size, bit_rate, \
+			sample_rate, plays, path_sort FROM Songs ORDER BY path').fetchall()
+		self.assertEqual([row[:6] for row in rows], [
+			(u'/music/a.mp3', 250, 5 * 1048576, 320000, 44100, 3),
+			(u'/music/b.mp3', 3700, 1048576 / 2, 128000, 48000, 0)])
+		self.assertEqual(rows[0][6], library.sort_key(u'/music/a.mp3'))
+		self.assertEqual(connection.execute('SELECT SUM(time) FROM Songs')
+			.fetchone()[0], 3950)
+		self.assertEqual(connection.execute('PRAGMA user_version')
+			.fetchone()[0], len(library.LIBRARY_MIGRATIONS))
+
+	def test_duplicate_paths_are_merged(self):
+		self.create_database(1, [
+			('/music/a.mp3', '1:00', None, None, None, None, None, 1),
+			('/music/a.mp3', '2:00', None, None, None, None, None, 2),
+			('/music/b.mp3', '3:00', None, None, None, None, None, 0)])
+		connection = self.migrate()
+		self.assertEqual(connection.execute('SELECT path, time FROM Songs \
+			ORDER BY path').fetchall(), [(u'/music/a.mp3', 120),
+			(u'/music/b.mp3', 180)])
+
+	def test_new_database(self):
+		connection = self.migrate()
+		tables = [row[0] for row in connection.execute(
+			"SELECT name FROM sqlite_master WHERE type = 'table'")]
+		self.assertIn('Songs', tables)
+		self.assertIn('failed_files', tables)
+
+	def test_migrating_twice_changes_nothing(self):
+		self.create_database(2, [('/music/a.mp3', '01:61:40', None, None,
+			None, None, None, 0)])
+		self.migrate()
+		connection = self.migrate()
+		self.assertEqual(connection.execute('SELECT time FROM Songs')
+			.fetchall(), [(3700,)])
+
+
+class LibraryTestCase(unittest.TestCase):
+	""" Runs each test in a temporary directory, which the library database
+	is made in, with an empty music directory.
+	"""
+
+	def setUp(self):
+		self.working_directory = os.getcwd()
+		self.directory = os.path.realpath(tempfile.mkdtemp())
+		os.chdir(self.directory)
+		os.mkdir('data')
+		self.music = os.path.join(self.directory, 'music')
+		os.mkdir(self.music)
+		self.library = None
+
+	def tearDown(self):
+		if self.library is not None:
+			self.library.close()
+		os.chdir(self.working_directory)
+		shutil.rmtree(self.directory)
+
+	def create_library(self, directories, workers=1):
+		self.library = library.Library(Parent(directories, workers),
+			preferences.LIBRARY_COLUMNS)
+		return self.library
+
+	def create_files(self, count, directory=None):
+		""" Creates count FLAC files in the given directory, or the music
+		directory, and returns their paths.
+		"""
+		file_paths = []
+		for i in range(count):
+			file_path = os.path.join(directory or self.music, '%03d.flac' % i)
+			create_flac(file_path, u'Track %d' % i)
+			file_paths.append(file_path)
+		return file_paths
+
+	def query(self, query, parameters=()):
+		return self.library.database.reader().execute(query,
+			parameters).fetchall()
+
+class IngestTest(LibraryTestCase):
+	""" Tests reading new files into the library, in a pool of worker
+	processes or in this process for small jobs, and writing them in batches.
+	"""
+
+	def setUp(self):
+		super(IngestTest, self).setUp()
+		self.pool = multiprocessing.Pool
+		self.pools = [] # Workers of each pool started
+		def pool(processes, *args):
+			self.pools.append(processes)
+			return self.pool(processes, *args)
+		multiprocessing.Pool = pool
+		self.batch_size = library.INGEST_BATCH_SIZE
+
+	def tearDown(self):
+		multiprocessing.Pool = self.pool
+		library.INGEST_BATCH_SIZE = self.batch_size
+		super(IngestTest, self).tearDown()
+
+	def titles(self):
+		return self.query('SELECT path, title FROM Songs ORDER BY path')
+
+	def expected_titles(self, file_paths):
+		return [(file_path, u'Track %d' % i) for i, file_path in \
+			enumerate(file_paths)]
+
+	def test_small_job_is_read_in_process(self):
+		file_paths = self.create_files(3)
+		self.create_library([self.music], workers=4)
+		self.assertEqual(sorted(self.library.add_files_to_library(
+			file_paths)), file_paths)
+		self.assertEqual(self.pools, [])
+		self.assertEqual(self.titles(), self.expected_titles(file_paths))
+
+	def test_large_job_is_read_by_pool(self):
+		file_paths = self.create_files(library.PARALLEL_INGEST_THRESHOLD)
+		self.create_library([self.music], workers=2)
+		self.assertEqual(sorted(self.library.add_files_to_library(
+			file_paths)), file_paths)
+		self.assertEqual(self.pools, [2])
+		self.assertEqual(self.titles(), self.expected_titles(file_paths))
+
+	def test_stream_is_read_by_pool(self):
+		file_paths = self.create_files(5)
+		self.create_library([self.music], workers=2)
+		self.assertEqual(sorted(self.library.add_files_to_library(
+			iter(file_paths))), file_paths)
+		self.assertEqual(self.pools, [2])
+		self.assertEqual(self.titles(), self.expected_titles(file_paths))
+
+	def test_one_worker_reads_in_process(self):
+		file_paths = self.create_files(library.PARALLEL_INGEST_THRESHOLD)
+		self.create_library([self.music], workers=1)
+		self.library.add_files_to_library(file_paths)
+		self.assertEqual(self.pools, [])
+		self.assertEqual(len(self.titles()), len(file_paths))
+
+	def test_rows_are_written_in_batches(self):
+		library.INGEST_BATCH_SIZE = 4
+		file_paths = self.create_files(10)
+		self.create_library([self.music])
+		batches = []
+		write_rows = self.library.write_rows
+		def record_batch(query, rows, *args):
+			batches.append(len(rows))
+			return write_rows(query, rows, *args)
+		self.library.write_rows = record_batch
+		progress = []
+		task = library.ScanTask(lambda *report: progress.append(report))
+		self.library.add_files_to_library(file_paths, task)
+		self.assertEqual(batches, [4, 4, 2])
+		self.assertEqual(len(self.titles()), 10)
+		self.assertEqual(progress[0], (Localisation.ADDING_FILES_STRING, 0,
+			10))
+		self.assertEqual(task.value, 10)
+
+	def check_failures(self, workers, count):
+		file_paths = self.create_files(count)
+		broken_path = os.path.join(self.music, 'broken.flac')
+		with open(broken_path, 'wb') as audio_file:
+			audio_file.write('fLaC' + '\x00' * 100)
+		missing_path = os.path.join(self.music, 'missing.flac')
+		self.create_library([self.music], workers)
+		task = library.ScanTask()
+		self.assertEqual(sorted(self.library.add_files_to_library(
+			file_paths + [broken_path, missing_path], task)), file_paths)
+		self.assertEqual(self.titles(), self.expected_titles(file_paths))
+		failures = dict(task.failed_files)
+		self.assertEqual(sorted(failures), [broken_path, missing_path])
+		self.assertTrue(failures[missing_path].startswith('OSError: '))
+		## Missing files have no fingerprint, so aren't recorded
+		self.assertEqual(self.query('SELECT path FROM failed_files'),
+			[(broken_path,)])
+
+	def test_failures_in_process(self):
+		self.check_failures(1, 2)
+		self.assertEqual(self.pools, [])
+
+	def test_failures_in_pool(self):
+		self.check_failures(2, library.PARALLEL_INGEST_THRESHOLD)
+		self.assertEqual(self.pools, [2])
+
+class FailedFilesTest(LibraryTestCase):
+	""" Tests that files which fail to be read are recorded, aren't read again
+	on each update until they change, and are forgotten once they're read or
+	gone.
+	"""
+
+	def setUp(self):
+		super(FailedFilesTest, self).setUp()
+		self.good_path = self.create_files(1)[0]
+		self.broken_path = os.path.join(self.music, 'broken.flac')
+		with open(self.broken_path, 'wb') as audio_file:
+			audio_file.write('fLaC' + '\x00' * 100)
+		self.read_track = library.read_track
+		self.read = []
+		def read_track(file_path):
+			self.read.append(file_path)
+			return self.read_track(file_path)
+		library.read_track = read_track
+		self.create_library([self.music])
+
+	def tearDown(self):
+		library.read_track = self.read_track
+		super(FailedFilesTest, self).tearDown()
+
+	def failed_files(self):
+		return self.query('SELECT path, mtime, file_size, error FROM \
+			failed_files')
+
+	def test_failed_file_is_recorded_and_skipped(self):
+		task = library.ScanTask()
+		self.assertEqual(self.library.update_library(task), [self.good_path])
+		self.assertEqual([f[0] for f in task.failed_files],
+			[self.broken_path])
+		info = os.stat(self.broken_path)
+		failed_files = self.failed_files()
+		self.assertEqual([f[:3] for f in failed_files], [(self.broken_path,
+			info.st_mtime, info.st_size)])
+		self.assertTrue(failed_files[0][3])
+		del self.read[:]
+		self.assertEqual(self.library.update_library(), [])
+		self.assertEqual(self.read, [])
+		self.assertEqual(len(self.failed_files()), 1)
+
+	def test_changed_file_is_read_again(self):
+		self.library.update_library()
+		create_flac(self.broken_path, u'Fixed')
+		os.utime(self.broken_path, (0, os.stat(self.broken_path).st_mtime +
+			10))
+		del self.read[:]
+		self.assertEqual(self.library.update_library(), [self.broken_path])
+		self.assertEqual(self.read, [self.broken_path])
+		self.assertEqual(self.failed_files(), [])
+		self.assertEqual(self.query('SELECT title FROM Songs WHERE path = ?',
+			(self.broken_path,)), [(u'Fixed',)])
+
+	def test_removed_file_is_forgotten(self):
+		self.library.update_library()
+		os.remove(self.broken_path)
+		self.library.update_library()
+		self.library.database.flush()
+		self.assertEqual(self.failed_files(), [])
+
+class ReadaheadTest(LibraryTestCase):
+	""" Tests that readahead is requested by the process reading each file,
+	just before it's read, when io ordered ingest is on.
+	"""
+
+	def setUp(self):
+		super(ReadaheadTest, self).setUp()
+		self.advise_readahead = scanner.advise_readahead
+		self.advised = []
+		scanner.advise_readahead = self.advised.append
+
+	def tearDown(self):
+		scanner.advise_readahead = self.advise_readahead
+		library.init_ingest_worker()
+		super(ReadaheadTest, self).tearDown()
+
+	def test_read_file(self):
+		file_path = self.create_files(1)[0]
+		library.init_ingest_worker(True)
+		self.assertNotEqual(library.read_track(file_path)[1], None)
+		self.assertEqual(self.advised, [file_path])
+		library.init_ingest_worker()
+		library.read_track(file_path)
+		self.assertEqual(self.advised, [file_path])
+
+	def test_ingest(self):
+		file_paths = self.create_files(3)
+		self.create_library([self.music])
+		self.library.set_io_ordered_ingest(True)
+		self.assertEqual(sorted(self.library.add_files_to_library(
+			iter(file_paths))), file_paths)
+		self.assertEqual(sorted(self.advised), file_paths)
+
+class SymlinkedRootTest(LibraryTestCase):
+	""" Tests that songs stored under a path through a symbolic link are moved
+	to their real path rather than removed and added again.
+	"""
+
+	def setUp(self):
+		super(SymlinkedRootTest, self).setUp()
+		os.mkdir(os.path.join(self.music, 'album'))
+		self.real_paths = self.create_files(2, os.path.join(self.music,
+			'album'))
+		self.link = os.path.join(self.directory, 'link')
+		os.symlink(self.music, self.link)
+		self.linked_paths = [os.path.join(self.link, 'album', name) for name \
+			in ('000.flac', '001.flac')]
+		self.create_library([self.link])
+
+	def test_rows_are_moved(self):
+		self.library.add_files_to_library(self.linked_paths)
+		self.library.database.execute(
+			'UPDATE Songs SET plays = 5, date_added = 100')
+		self.library.database.flush()
+		ids = self.query('SELECT id FROM Songs ORDER BY path')
+		self.assertEqual(self.library.update_library(), [])
+		self.assertEqual(self.query('SELECT id, path, plays, date_added FROM \
+			Songs ORDER BY path'), [ids[0] + (self.real_paths[0], 5, 100),
+			ids[1] + (self.real_paths[1], 5, 100)])
+		self.assertEqual(self.query('SELECT path_sort FROM Songs WHERE \
+			path = ?', (self.real_paths[0],)),
+			[(library.sort_key(self.real_paths[0]),)])
+
+	def test_rows_are_merged(self):
+		self.library.add_files_to_library(self.linked_paths[:1] + \
+			self.real_paths[:1])
+		self.library.database.execute('UPDATE Songs SET plays = 5, \
+			date_added = 100 WHERE path = ?', (self.linked_paths[0],))
+		self.library.database.execute('UPDATE Songs SET plays = 2, \
+			date_added = 50 WHERE path = ?', (self.real_paths[0],))
+		self.library.database.flush()
+		self.assertEqual(self.library.update_library(), [self.real_paths[1]])
+		rows = self.query('SELECT path, plays, date_added FROM Songs ORDER BY \
+			path')
+		self.assertEqual([row[0] for row in rows], self.real_paths)
+		self.assertEqual(rows[0][1:], (7, 50))
+
+
+if __name__ == "__main__":
+	unittest.main()
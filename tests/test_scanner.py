@@ -0,0 +1,142 @@
+# -◊- coding: utf-8 -◊-
+
+"""
+Beatbox 1.0
+
+Copyright (C) 2013 Luke Hansford - l.s.hansford@gmail.com
+
+DESCRIPTION
+
+This module contains the tests for finding the audio files in the library
+directories.
+
+LICENSE
+
+I, Luke Hansford, Hereby grant the rights to distribute, modify, and edit the
+source to Beatbox 1.0, on the condition that this agreement, and my ownership
+of the code contained herewithin be maintained.
+
+Furthurmore, I grant the right to use excerpts from the source to Beatbox 1.0
+without express permission, with exclusion of commercial application.
+"""
+
+#Standard libraries
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+#Beatbox libraries
+import scanner
+
+
+class DirectoryScannerTest(unittest.TestCase):
+	""" Tests that every audio file is found exactly once, and that failures
+	while walking end the scan rather than hanging it.
+	"""
+
+	def setUp(self):
+		self.directory = os.path.realpath(tempfile.mkdtemp())
+		for name in ('a/1.mp3', 'a/b/2.flac', 'c/3.ogg', 'c/cover.jpg'):
+			file_path = os.path.join(self.directory, name)
+			if not os.path.isdir(os.path.dirname(file_path)):
+				os.makedirs(os.path.dirname(file_path))
+			open(file_path, 'w').close()
+		self.list_directory = scanner.list_directory
+
+	def tearDown(self):
+		scanner.list_directory = self.list_directory
+		shutil.rmtree(self.directory)
+
+	def path(self, name):
+		return os.path.join(self.directory, name)
+
+	def scan(self, directories):
+		return sorted(scanner.scan_directories(directories))
+
+	def test_finds_audio_files(self):
+		self.assertEqual(self.scan([self.directory]), [self.path('a/1.mp3'),
+			self.path('a/b/2.flac'), self.path('c/3.ogg')])
+
+	def test_nested_and_repeated_directories(self):
+		self.assertEqual(self.scan([self.directory, self.path('a'),
+			self.directory + '/']), self.scan([self.directory]))
+
+	def test_symbolic_links(self):
+		os.symlink(self.path('a'), self.path('c/link'))
+		os.symlink(self.directory, self.path('a/b/loop'))
+		os.symlink(self.path('c'), self.path('linked_root'))
+		self.assertEqual(self.scan([self.directory]), [self.path('a/1.mp3'),
+			self.path('a/b/2.flac'), self.path('c/3.ogg')])
+		self.assertEqual(self.scan([self.path('linked_root')]),
+			[self.path('a/1.mp3'), self.path('a/b/2.flac'),
+			self.path('c/3.ogg')])
+
+	def test_missing_directory(self):
+		self.assertEqual(self.scan([self.path('missing')]), [])
+
+	def test_unreadable_directory_is_skipped(self):
+		def list_directory(directory):
+			if directory == self.path('a'):
+				raise OSError(13, 'Permission denied')
+			return self.list_directory(directory)
+		scanner.list_directory = list_directory
+		self.assertEqual(self.scan([self.directory]), [self.path('c/3.ogg')])
+
+	def test_failure_is_raised(self):
+		def list_directory(directory):
+			if directory == self.path('a/b'):
+				raise ValueError('Listing failed')
+			return self.list_directory(directory)
+		scanner.list_directory = list_directory
+		self.assertRaises(ValueError, self.scan, [self.directory])
+
+	def test_cancelled_failure_is_raised(self):
+		def cancelled():
+			raise RuntimeError('Cancel check failed')
+		scanner_ = scanner.DirectoryScanner([self.directory], cancelled)
+		self.assertRaises(RuntimeError, list, scanner_.scan())
+
+	def test_cancelled(self):
+		scanner_ = scanner.DirectoryScanner([self.directory], lambda: True)
+		self.assertTrue(len(list(scanner_.scan())) < 3)
+
+
+class IoOrderTest(unittest.TestCase):
+	""" Tests sorting files into disk order.
+	"""
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.file_paths = []
+		for i in range(20):
+			file_path = os.path.join(self.directory, '%02d.mp3' % i)
+			with open(file_path, 'wb') as audio_file:
+				audio_file.write('\x00' * 4096)
+			self.file_paths.append(file_path)
+		self.advise_readahead = scanner.advise_readahead
+		self.advised = []
+		scanner.advise_readahead = lambda file_path, advice=None: \
+			self.advised.append(file_path)
+
+	def tearDown(self):
+		scanner.advise_readahead = self.advise_readahead
+		shutil.rmtree(self.directory)
+
+	def test_every_file_is_yielded(self):
+		ordered = list(scanner.io_order(reversed(self.file_paths), 7))
+		self.assertEqual(sorted(ordered), self.file_paths)
+		for start in range(0, 20, 7):
+			window = ordered[start:start + 7]
+			self.assertEqual(window, sorted(window, key=scanner.io_order_key))
+
+	def test_readahead_is_left_to_the_reader(self):
+		## A pool's feeder drains the generator straight away, so hints
+		## given here would all be given before any file is read
+		list(scanner.io_order(self.file_paths))
+		self.assertEqual(self.advised, [])
+
+
+if __name__ == "__main__":
+	unittest.main()
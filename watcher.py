@@ -0,0 +1,317 @@
+# -◊- coding: utf-8 -◊-
+
+"""
+Beatbox 1.0
+
+Copyright (C) 2013 Luke Hansford - l.s.hansford@gmail.com
+
+DESCRIPTION
+
+This module contains all functions for watching the library directories for
+changes, so the library can be kept up to date without a full rescan.
+
+LICENSE
+
+I, Luke Hansford, Hereby grant the rights to distribute, modify, and edit the
+source to Beatbox 1.0, on the condition that this agreement, and my ownership
+of the code contained herewithin be maintained.
+
+Furthurmore, I grant the right to use excerpts from the source to Beatbox 1.0
+without express permission, with exclusion of commercial application.
+"""
+
+#Standard libraries
+import os
+import threading
+import time
+
+#3rd party libraries
+try:
+	import pyinotify
+except ImportError:
+	pyinotify = None # Falls back to polling the directories
+
+#Beatbox libraries
+import metadata
+import scanner
+
+
+DEBOUNCE_TIME = 2.0 # Seconds without changes before a batch is sent
+POLL_INTERVAL = 30 # Seconds between polls when inotify isn't available
+## Files modified in place don't change their directory's mtime, so every
+## file's fingerprint is checked once in this many polls
+FULL_POLL_EVERY = 10
+
+class DirectoryWatcher(object):
+	""" Watches a list of directories for audio files being created, modified,
+	moved, or deleted. Changes are coalesced per path and handed out in batches
+	once the directories have been quiet for the debounce time. Uses inotify if
+	pyinotify is installed, otherwise the directories are polled.
+	"""
+
+	def __init__(self, directories, debounce=DEBOUNCE_TIME,
+		poll_interval=POLL_INTERVAL):
+		self.directories = scanner.normalise_directories(directories)
+		self.debounce = debounce
+		self.poll_interval = poll_interval
+		self.metadata = metadata.Metadata()
+		self._condition = threading.Condition()
+		self._events = {} # path -> True if updated, False if removed
+		self._last_event_time = 0
+		self._running = False
+		self._backend = None
+
+	def start(self):
+		""" Starts watching the directories.
+
+		DirectoryWatcher.start() -> None
+		"""
+		with self._condition:
+			self._running = True
+		if pyinotify is not None:
+			self._backend = InotifyBackend(self)
+		else:
+			self._backend = PollingBackend(self)
+		self._backend.start()
+
+	def stop(self):
+		""" Stops watching the directories and wakes up wait_for_batch.
+
+		DirectoryWatcher.stop() -> None
+		"""
+		if self._backend is not None:
+			self._backend.stop()
+			self._backend = None
+		with self._condition:
+			self._running = False
+			self._condition.notify_all()
+
+	def set_directories(self, directories):
+		""" Changes the directories being watched.
+
+		DirectoryWatcher.set_directories(list(str)) -> None
+		"""
+		self.directories = scanner.normalise_directories(directories)
+		if self._backend is not None:
+			self._backend.stop()
+			self._backend = self._backend.__class__(self)
+			self._backend.start()
+
+	def set_poll_interval(self, poll_interval):
+		""" Changes the seconds between polls of the directories, used when
+		inotify isn't available. Takes effect from the next poll.
+
+		DirectoryWatcher.set_poll_interval(int) -> None
+		"""
+		self.poll_interval = poll_interval
+
+	def add_event(self, path, updated):
+		""" Records that the given path was updated (created, modified, or
+		moved in) or removed (deleted or moved out). Later events for the same
+		path replace earlier ones.
+
+		DirectoryWatcher.add_event(str, bool) -> None
+		"""
+		with self._condition:
+			self._events[path] = updated
+			self._last_event_time = time.time()
+			self._condition.notify_all()
+
+	def wait_for_batch(self):
+		""" Blocks until there are changes and the directories have been quiet
+		for the debounce time, then returns the sets of updated and removed
+		paths. Removed paths may be directories. Returns None once the watcher
+		is stopped.
+
+		DirectoryWatcher.wait_for_batch() -> (set(str), set(str))
+		"""
+		with self._condition:
+			while self._running:
+				if self._events:
+					quiet_time = time.time() - self._last_event_time
+					if quiet_time >= self.debounce:
+						events, self._events = self._events, {}
+						updated = set(p for p, u in events.iteritems() if u)
+						removed = set(p for p, u in events.iteritems() if not u)
+						return updated, removed
+					self._condition.wait(self.debounce - quiet_time)
+				else:
+					self._condition.wait(self.poll_interval)
+			return None
+
+	def walk_audio_files(self, directory):
+		""" Returns a dictionary of all audio files in the given directory and
+		their (mtime, size) fingerprints.
+
+		DirectoryWatcher.walk_audio_files(str) -> dict
+		"""
+		files = {}
+		for file_path in scanner.scan_directories([directory]):
+			try:
+				files[file_path] = self.metadata.get_fingerprint(file_path)
+			except OSError:
+				pass
+		return files
+
+class PollingBackend(threading.Thread):
+	""" Finds changes by polling the watched directories every poll interval.
+	Only each directory's mtime is checked, which changes when files are
+	added, removed, or renamed in it, and only directories whose mtime has
+	changed are listed again and have their files' fingerprints compared with
+	the previous poll. Every FULL_POLL_EVERY polls all fingerprints are
+	checked, to find files modified in place.
+	"""
+
+	def __init__(self, watcher):
+		super(PollingBackend, self).__init__()
+		self.daemon = True
+		self.watcher = watcher
+		self._stop_event = threading.Event()
+
+	def poll(self, previous, full=False):
+		""" Returns the state of every directory in the watched directories,
+		reusing the previous state of directories that haven't changed. The
+		state is a dictionary of each directory's path to its mtime, its
+		subdirectories, and the fingerprints of its audio files.
+
+		PollingBackend.poll(dict, bool) -> dict
+		"""
+		current = {}
+		visited = set()
+		pending = []
+		for directory in self.watcher.directories:
+			try:
+				pending.append(scanner.linked_directory(directory))
+			except OSError:
+				pass # Unplugged drives are left alone
+		while pending:
+			directory, device, inode = pending.pop()
+			if (device, inode) in visited:
+				continue
+			visited.add((device, inode))
+			try:
+				mtime = os.stat(directory).st_mtime
+			except OSError:
+				continue
+			state = previous.get(directory)
+			if state is not None and state[0] == mtime:
+				subdirectories, files = state[1], state[2]
+				if full:
+					files = self.get_fingerprints(files)
+			else:
+				try:
+					file_paths, subdirectories = \
+						scanner.list_directory(directory)
+				except OSError:
+					continue
+				files = self.get_fingerprints(file_paths)
+			current[directory] = (mtime, subdirectories, files)
+			pending.extend(subdirectories)
+		return current
+
+	def get_fingerprints(self, file_paths):
+		""" Returns the fingerprints of the given files that still exist.
+
+		PollingBackend.get_fingerprints(list(str)) -> dict
+		"""
+		files = {}
+		for file_path in file_paths:
+			try:
+				files[file_path] = \
+					self.watcher.metadata.get_fingerprint(file_path)
+			except OSError:
+				pass
+		return files
+
+	def run(self):
+		""" Polls the directories until stopped, sending the files that
+		differ from the previous poll to the watcher.
+
+		PollingBackend.run() -> None
+		"""
+		previous = self.poll({})
+		polls = 0
+		while not self._stop_event.wait(self.watcher.poll_interval):
+			polls += 1
+			current = self.poll(previous, polls % FULL_POLL_EVERY == 0)
+			for directory, (mtime, subdirectories, files) in \
+				current.iteritems():
+				previous_files = previous.get(directory, (0, [], {}))[2]
+				if files is previous_files:
+					continue
+				for path in files:
+					if previous_files.get(path) != files[path]:
+						self.watcher.add_event(path, True)
+				for path in previous_files:
+					if path not in files:
+						self.watcher.add_event(path, False)
+			for directory in previous:
+				if directory not in current:
+					for path in previous[directory][2]:
+						self.watcher.add_event(path, False)
+			previous = current
+
+	def stop(self):
+		""" Stops polling.
+
+		PollingBackend.stop() -> None
+		"""
+		self._stop_event.set()
+
+class InotifyBackend(object):
+	""" Receives changes from inotify through pyinotify. New subdirectories are
+	watched automatically.
+	"""
+
+	MASK = 0
+	if pyinotify is not None:
+		MASK = pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO | \
+		pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE | pyinotify.IN_CREATE
+
+	def __init__(self, watcher):
+		self.watcher = watcher
+		self.watch_manager = pyinotify.WatchManager()
+		self.notifier = pyinotify.ThreadedNotifier(
+			self.watch_manager, self.process_event)
+		self.notifier.daemon = True
+
+	def start(self):
+		""" Adds watches for the directories and starts the notifier thread.
+
+		InotifyBackend.start() -> None
+		"""
+		for directory in self.watcher.directories:
+			self.watch_manager.add_watch(
+				directory, self.MASK, rec=True, auto_add=True)
+		self.notifier.start()
+
+	def stop(self):
+		""" Stops the notifier thread.
+
+		InotifyBackend.stop() -> None
+		"""
+		self.notifier.stop()
+
+	def process_event(self, event):
+		""" Called by pyinotify for each event. Directories moved in have all
+		their files reported as updated, and directories removed or moved out
+		are reported as removed.
+
+		InotifyBackend.process_event(pyinotify.Event) -> None
+		"""
+		path = event.pathname
+		if event.dir:
+			if event.mask & (pyinotify.IN_MOVED_TO | pyinotify.IN_CREATE):
+				for file_path in self.watcher.walk_audio_files(path):
+					self.watcher.add_event(file_path, True)
+			elif event.mask & (pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE):
+				self.watcher.add_event(path, False)
+		elif self.watcher.metadata.isValidFile(path):
+			if event.mask & (pyinotify.IN_CLOSE_WRITE | pyinotify.IN_MOVED_TO):
+				self.watcher.add_event(path, True)
+			elif event.mask & (pyinotify.IN_MOVED_FROM | pyinotify.IN_DELETE):
+				self.watcher.add_event(path, False)
+
+
+if __name__ == "__main__":
+	pass